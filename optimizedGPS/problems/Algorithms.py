@@ -1,14 +1,10 @@
 import sys
 
-try:
-    from gurobipy import GRB, quicksum, Var
-except:
-    pass
-
 from Heuristics import RealGPS
 from Models import FixedWaitingTimeModel, TEGModel
 from Problem import Problem, SolvinType
 from Solver import Solver
+from SolverBackend import GRB, quicksum, Var
 from optimizedGPS.structure.DriversStructure import DriversStructure
 from optimizedGPS.structure.Graph import Graph
 
@@ -57,7 +53,11 @@ class TEGColumnGenerationAlgorithm(Problem):
     UNIQUE_COLUMN_GENERATION = "unique"
 
     def __init__(self, graph, drivers_graph, drivers_structure=None, heuristic=None, column_generation_type=None,
-                 **kwargs):
+                 cache=None, backend=None, **kwargs):
+        """
+        :param cache: PresolveCache instance given to the master problems' solvers
+        :param backend: solver backend of the master problems (see SolverBackend)
+        """
         super(TEGColumnGenerationAlgorithm, self).__init__(graph, drivers_graph, drivers_structure=drivers_structure,
                                                            **kwargs)
         if column_generation_type in [None, self.UNIQUE_COLUMN_GENERATION]:
@@ -67,8 +67,11 @@ class TEGColumnGenerationAlgorithm(Problem):
         else:
             raise TypeError("colum generation type should be one of the class column generation possibilities")
         self.heuristic = heuristic if heuristic is not None else RealGPS(graph, drivers_graph)
+        self.cache = cache
+        self.backend = backend
         self.master = Solver(
-            self.graph, drivers_graph, TEGModel, drivers_structure=self.get_initial_structures(), binary=False)
+            self.graph, drivers_graph, TEGModel, drivers_structure=self.get_initial_structures(), binary=False,
+            cache=cache, backend=backend)
 
     def get_initial_structures(self):
         """
@@ -178,12 +181,13 @@ class TEGColumnGenerationAlgorithm(Problem):
 
     def solve_master_as_integer(self):
         """
-        Solve the master problem with integer variables
+        Solve the master problem with integer variables, starting from the heuristic's solution
         """
         graph = self.master.graph
         drivers_graph = self.master.drivers_graph
         drivers_structure = self.master.drivers_structure
-        self.master = Solver(graph, drivers_graph, TEGModel, drivers_structure=drivers_structure, binary=True)
+        self.master = Solver(graph, drivers_graph, TEGModel, drivers_structure=drivers_structure, binary=True,
+                             cache=self.cache, backend=self.backend, initial_solution=self.heuristic.opt_solution)
         self.master.solve()
 
     def solve_with_solver(self):
@@ -2,16 +2,17 @@
 # !/bin/env python
 
 import logging
+import operator
+import time
 from collections import defaultdict
 
-try:
-    from gurobipy import GRB, quicksum, Var
-except:
-    pass
-
 import labels
 from optimizedGPS import options
+from PiecewiseLinear import PiecewiseLinearFunction
 from Problem import Model
+from SolverBackend import GRB, GUROBI, quicksum, Var
+from TEGMatrix import TEGMatrix
+from TEGVariables import TEGVariables
 from optimizedGPS.structure import ReducedTimeExpandedGraph as TEG
 from optimizedGPS.structure import Graph, Driver
 
@@ -123,12 +124,12 @@ class MainContinuousTimeModel(EdgeCharacterizationModel):
                     name="%s:%s:%s" % (labels.VISITED_EDGES, id(driver), str(edge))
                 )
                 # starting ending constraints
-                self.model.addConstr(
+                self.add_constraint(
                     self.E[edge, driver] <= self.horizon * self.x[edge, driver],
                     name="%s:%s:%s" % (labels.STARTING_ENDING, id(driver), str(edge))
                 )
                 # transfert equation
-                self.model.addConstr(
+                self.add_constraint(
                     self.E[edge, driver] - self.S[edge, driver] + self.horizon * (1 - self.x[edge, driver]) >=
                     self.get_traffic(edge, driver),
                     name="%s:%s:%s" % (labels.TRANSFERT, id(driver), str(edge))
@@ -251,16 +252,56 @@ class TEGModel(EdgeCharacterizationModel):
     """
     Time Expanded Graph Model
     """
+    # formulations of the piecewise linear congestion functions, see add_congestion_variables
+    SOS2 = PiecewiseLinearFunction.SOS2
+    INCREMENTAL = PiecewiseLinearFunction.INCREMENTAL
+
+    def __init__(self, graph, drivers_graph, matrix=False, initial_solution=None, lazy=False, breakpoints=None,
+                 congestion_formulation=None, **kwargs):
+        """
+        :param matrix: if True, the constraints are assembled as sparse matrices (see TEGMatrix) and added in bulk,
+                       instead of one by one
+        :param initial_solution: solution given to the solver as MIP start, see set_initial_solution
+        :param lazy: if True, the waiting time constraints are not built: the ones violated by the solution are added
+                     and the model solved again, until no one is violated (see optimize)
+        :param breakpoints: if None, the congestion functions' piecewise linear approximations have a breakpoint at
+                            every integer traffic: they are exact on binary solutions, but their size grows with the
+                            number of drivers. Otherwise, number of evenly spaced breakpoints: the approximations are
+                            exact on the breakpoints only, and distort the waiting times in between. The waiting times
+                            being integers, a traffic whose approximated congestion isn't an integer can't occur when
+                            a driver enters the edge
+        :param congestion_formulation: SOS2 or INCREMENTAL. If None, SOS2 with gurobi, INCREMENTAL otherwise
+        """
+        self.matrix = matrix
+        self.initial_solution = initial_solution
+        self.lazy = lazy
+        self.breakpoints = breakpoints
+        self.congestion_formulation = congestion_formulation
+        self.congestion = {}  # edge -> piecewise linear approximation of its congestion function
+        self.congestion_variables = {}  # (edge, time) -> variables of the approximation at time, if not linear
+        self.congestion_expressions = {}  # (edge, time) -> expression of the congestion at time, if not linear
+        # for each family of constraints: number of rows and nonzeros, assembling and loading times
+        self.build_statistics = {}
+        super(TEGModel, self).__init__(graph, drivers_graph, **kwargs)
+
     def initialize(self, **kwargs):
         self.TEGgraph = TEG(self.graph, self.horizon)
+        if self.congestion_formulation is None:
+            self.congestion_formulation = self.SOS2 if self.backend == GUROBI else self.INCREMENTAL
+        if self.congestion_formulation not in PiecewiseLinearFunction.FORMULATIONS or \
+                (self.congestion_formulation == self.SOS2 and self.backend != GUROBI):
+            message = "Congestion formulation %s not available with the %s backend" % (self.congestion_formulation,
+                                                                                      self.backend)
+            log.error(message)
+            raise ValueError(message)
         super(TEGModel, self).initialize(**kwargs)
 
     def bigM(self):
-        return max([self.graph.get_congestion_function(*edge)(self.drivers_graph.number_of_drivers())
+        return max([self.get_congestion_approximation(edge)(self.drivers_graph.number_of_drivers())
                     for edge in self.graph.edges_iter()])
 
     def has_variable(self, driver, edge, start, end):
-        return isinstance(self.x[self.TEGgraph.build_edge(edge, start, end), driver], Var)
+        return self.x.has(driver, edge, start, end)
 
     def number_of_variables(self):
         """
@@ -294,12 +335,158 @@ class TEGModel(EdgeCharacterizationModel):
         :param times: set of (starting time, ending time)
         :return:
         """
+        new_times = []
         for i, j in times:
-            _edge = self.TEGgraph.build_edge(edge, i, j)
-            if not isinstance(self.x[_edge, driver], Var):
-                self.x[_edge, driver] = \
-                    self.model.addVar(0.0, name='x[%s,%s]' % (str(_edge), id(driver)), vtype=self.vtype)
+            if not self.x.has(driver, edge, i, j):
+                _edge = self.TEGgraph.build_edge(edge, i, j)
+                self.x.add(driver, edge, i, j,
+                           self.model.addVar(0.0, name='x[%s,%s]' % (str(_edge), id(driver)), vtype=self.vtype))
+                new_times.append((i, j))
+        self.model.update()
+        if self.built is True:
+            # the model is already built: the new variables are added to the existing constraints
+            for i, j in new_times:
+                self.add_variable_to_constraints(driver, edge, i, j)
+            self.model.update()
+
+    def add_variable_to_constraints(self, driver, edge, start, end):
+        """
+        Set the coefficients of the variable of driver on edge from start to end in every existing constraint.
+        The congestion functions are supposed linear, as in get_reduced_cost.
+        """
+        variable = self.x.get(driver, edge, start, end)
+        coefficients = {"%s:%s:%s" % (labels.EDGE_TIME_UNICITY, id(driver), str(edge)): 1}
+        if edge[0] != driver.end:
+            coefficients["%s:%s:%s:%s" % (labels.TRANSFERT, id(driver), str(edge[0]), start)] = 1
+        if edge[1] != driver.end:
+            coefficients["%s:%s:%s:%s" % (labels.TRANSFERT, id(driver), str(edge[1]), end)] = -1
+        ending_times = self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end) or ()
+        if edge[1] == driver.end and end in ending_times:
+            coefficients["%s:%s" % (labels.ENDING_TIME, id(driver))] = 1
+        if edge[0] == driver.end and start in ending_times:
+            coefficients["%s:%s" % (labels.ENDING_NODE, id(driver))] = 1
+
+        # driver is on edge during (start, end]: he is in the traffic of every waiting time constraint in between,
+        # or of the traffic defining the congestion in between if it isn't linear
+        func = self.get_congestion_approximation(edge)
+        for time in xrange(start + 1, end + 1):
+            if func.is_linear():
+                for d in self.drivers_graph.get_all_drivers():
+                    for label in (labels.UPPER_WAITING_TIME, labels.LOWER_WAITING_TIME):
+                        coefficients["%s:%s:%s:%s" % (label, id(d), str(edge), time)] = - func.get_slope()
+            else:
+                coefficients["%s:%s:%s" % (labels.CONGESTION_TRAFFIC, str(edge), time)] = 1
+        # his own waiting time constraints at start: waiting time <= ..., and waiting time + bigM * (1 - x) >= ...
+        for label in (labels.UPPER_WAITING_TIME, labels.LOWER_WAITING_TIME):
+            constr_name = "%s:%s:%s:%s" % (label, id(driver), str(edge), start)
+            if self.has_constraint(constr_name):
+                coefficients[constr_name] = end - start
+                if self.get_constraint(constr_name).Sense == GRB.GREATER_EQUAL:
+                    coefficients[constr_name] -= self.bigM()
+
+        for constr_name, value in coefficients.iteritems():
+            self.set_coefficient(constr_name, variable, value)
+
+    def get_waiting_time_expression(self, driver, edge, start):
+        """
+        Time spent by driver on edge if he enters it at start, 0 otherwise
+        """
+        return quicksum(variable * (end - start) for end, variable in self.x.iter_ending(driver, edge, start))
+
+    def get_entering_expression(self, driver, edge, start):
+        """
+        1 if driver enters edge at start, 0 otherwise
+        """
+        return quicksum(variable for _, variable in self.x.iter_ending(driver, edge, start))
+
+    def get_traffic_expression(self, edge, time):
+        """
+        Number of drivers on edge at time
+        """
+        return quicksum(variable for _, _, _, variable in self.x.iter_covering(edge, time))
+
+    def get_congestion_approximation(self, edge):
+        """
+        Return the piecewise linear approximation of edge's congestion function, on [0, number of drivers].
+        It is computed once per edge
+        """
+        if edge not in self.congestion:
+            self.congestion[edge] = PiecewiseLinearFunction.from_function(
+                self.graph.get_congestion_function(*edge), self.drivers_graph.number_of_drivers(), self.breakpoints)
+        return self.congestion[edge]
+
+    def get_congestion_expression(self, edge, time):
+        """
+        Linear expression of the congestion on edge at time, i.e. of its congestion function at the traffic at time.
+        If the function isn't linear, the variables of its approximation are added the first time (see
+        add_congestion_variables), and shared by every driver
+        """
+        func = self.get_congestion_approximation(edge)
+        if func.is_linear():
+            return func.values[0].item() + func.get_slope() * self.get_traffic_expression(edge, time)
+        if (edge, time) not in self.congestion_expressions:
+            self.add_congestion_variables(edge, time)
+            self.add_congestion_constraints(edge, time)
+        return self.congestion_expressions[edge, time]
+
+    def add_congestion_variables(self, edge, time):
+        """
+        Add the variables of the piecewise linear approximation f of edge's congestion function at the traffic at
+        time (see PiecewiseLinearFunction.iter_rows for their meaning), and keep the expression of f(traffic).
+        In a continuous model, there are no SOS2 constraints and z is continuous: f is relaxed.
+
+        :return: the variables
+        """
+        func = self.get_congestion_approximation(edge)
+        n = func.number_of_breakpoints()
+        if self.congestion_formulation == self.SOS2:
+            variables = [self.model.addVar(0.0, 1.0, name='l[%s,%s,%s]' % (str(edge), time, k)) for k in xrange(n)]
+        else:
+            variables = [self.model.addVar(0.0, 1.0, name='d[%s,%s,%s]' % (str(edge), time, k))
+                         for k in xrange(n - 1)]
+            variables += [self.model.addVar(0.0, 1.0, name='z[%s,%s,%s]' % (str(edge), time, k), vtype=self.vtype)
+                          for k in xrange(n - 2)]
         self.model.update()
+        if self.congestion_formulation == self.SOS2 and self.binary:
+            self.model.addSOS(GRB.SOS_TYPE2, variables, range(n))
+        constant, coefficients = func.get_expression(self.congestion_formulation)
+        self.congestion_variables[edge, time] = variables
+        self.congestion_expressions[edge, time] = constant + quicksum(
+            coefficient * variables[k] for k, coefficient in coefficients.iteritems())
+        return variables
+
+    def add_congestion_constraints(self, edge, time):
+        """
+        Add the rows defining the variables of the approximation of edge's congestion function at time (see
+        add_congestion_variables)
+        """
+        variables, traffic = self.congestion_variables[edge, time], self.get_traffic_expression(edge, time)
+        senses = {GRB.LESS_EQUAL: operator.le, GRB.GREATER_EQUAL: operator.ge, GRB.EQUAL: operator.eq}
+        for label, suffix, coefficients, traffic_coefficient, sense, rhs in \
+                self.get_congestion_approximation(edge).iter_rows(self.congestion_formulation):
+            expression = quicksum(coefficient * variables[k] for k, coefficient in coefficients.iteritems())
+            if traffic_coefficient != 0:
+                expression = expression + traffic_coefficient * traffic
+            self.add_constraint(senses[sense](expression, rhs),
+                                name=":".join([label, str(edge), str(time)] + map(str, suffix)))
+
+    def get_flow_expression(self, driver, node, time):
+        """
+        1 if driver leaves node at time, -1 if he reaches it at time, 0 otherwise
+        """
+        return quicksum(self.x.iter_leaving(driver, node, time)) - quicksum(self.x.iter_entering(driver, node, time))
+
+    def get_ending_expression(self, driver, leaving=False):
+        """
+        1 if driver reaches his end at one of his possible ending times, 0 otherwise.
+        If leaving is True, 1 if he leaves his end at one of these times
+        """
+        iter_variables = self.x.iter_leaving if leaving else self.x.iter_entering
+        return quicksum(
+            variable
+            for time in self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end) or ()
+            for variable in iter_variables(driver, driver.end, time)
+        )
 
     def generate_constraints(self, driver, edge, times):
         """
@@ -312,40 +499,23 @@ class TEGModel(EdgeCharacterizationModel):
         """
         for i, _ in times:
             constr_name = "%s:%s:%s:%s" % (labels.UPPER_WAITING_TIME, id(driver), str(edge), i)
-            if not self.has_constraint(constr_name):
+            if not self.lazy and not self.has_constraint(constr_name):
                 self.add_constraint(
-                    quicksum(self.x[self.TEGgraph.build_edge(edge, i, j), driver] * (j - i)
-                             for j in self.drivers_structure.iter_ending_times(driver, edge, starting_time=i)) <=
-                    self.graph.get_congestion_function(*edge)(
-                        quicksum(
-                            quicksum(self.x[self.TEGgraph.build_edge(edge, ii, jj), d]
-                                     for ii, jj in self.drivers_structure.iter_time_intervals(d, edge) if ii < i <= jj)
-                            for d in self.drivers_graph.get_all_drivers()
-                        )
-                    ),
+                    self.get_waiting_time_expression(driver, edge, i) <= self.get_congestion_expression(edge, i),
                     name=constr_name
                 )
             constr_name = "%s:%s:%s:%s" % (labels.LOWER_WAITING_TIME, id(driver), str(edge), i)
-            if not self.has_constraint(constr_name):
+            if not self.lazy and not self.has_constraint(constr_name):
                 self.add_constraint(
-                    quicksum(self.x[self.TEGgraph.build_edge(edge, i, j), driver] * (j - i)
-                             for j in self.drivers_structure.iter_ending_times(driver, edge, starting_time=i)) +
-                    self.bigM() * (1 - quicksum(
-                        self.x[self.TEGgraph.build_edge(edge, i, j), driver]
-                        for j in self.drivers_structure.iter_ending_times(driver, edge, starting_time=i))) >=
-                    self.graph.get_congestion_function(*edge)(
-                        quicksum(
-                            quicksum(self.x[self.TEGgraph.build_edge(edge, ii, jj), d]
-                                     for ii, jj in self.drivers_structure.iter_time_intervals(d, edge) if ii < i <= jj)
-                            for d in self.drivers_graph.get_all_drivers()
-                        )
-                    ),
+                    self.get_waiting_time_expression(driver, edge, i) +
+                    self.bigM() * (1 - self.get_entering_expression(driver, edge, i)) >=
+                    self.get_congestion_expression(edge, i),
                     name=constr_name
                 )
             constr_name = "%s:%s:%s" % (labels.EDGE_TIME_UNICITY, id(driver), str(edge))
             if not self.has_constraint(constr_name):
                 self.add_constraint(
-                    quicksum(self.x[self.TEGgraph.build_edge(edge, i, j), driver]
+                    quicksum(self.x.get(driver, edge, i, j)
                              for i, j in self.drivers_structure.iter_time_intervals(driver, edge)) <= 1,
                     name=constr_name
                 )
@@ -353,39 +523,17 @@ class TEGModel(EdgeCharacterizationModel):
                 if node != driver.end:
                     constr_name = "%s:%s:%s:%s" % (labels.TRANSFERT, id(driver), str(node), i)
                     if not self.has_constraint(constr_name):
-                        node_ = self.TEGgraph.build_node(node, i)
                         self.add_constraint(
-                            quicksum(
-                                self.x[(node_, succ), driver] for succ in self.TEGgraph.successors_iter(node_)) -
-                            quicksum(
-                                self.x[(pred, node_), driver] for pred in self.TEGgraph.predecessors_iter(node_)) ==
+                            self.get_flow_expression(driver, node, i) ==
                             1 * (node == driver.start and i == driver.time),
                             name=constr_name
                         )
             constr_name = "%s:%s" % (labels.ENDING_TIME, id(driver))
             if not self.has_constraint(constr_name):
-                self.add_constraint(
-                    quicksum(
-                        quicksum(
-                            self.x[(s, self.TEGgraph.build_node(driver.end, time)), driver]
-                            for s in self.TEGgraph.predecessors_iter(self.TEGgraph.build_node(driver.end, time))
-                        )
-                        for time in self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end)
-                    ) == 1,
-                    name=constr_name
-                )
+                self.add_constraint(self.get_ending_expression(driver) == 1, name=constr_name)
             constr_name = "%s:%s" % (labels.ENDING_NODE, id(driver))
             if not self.has_constraint(constr_name):
-                self.add_constraint(
-                    quicksum(
-                        quicksum(
-                            self.x[(self.TEGgraph.build_node(driver.end, time), s), driver]
-                            for s in self.TEGgraph.successors_iter(self.TEGgraph.build_node(driver.end, time))
-                        )
-                        for time in self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end)
-                    ) == 0,
-                    name=constr_name
-                )
+                self.add_constraint(self.get_ending_expression(driver, leaving=True) == 0, name=constr_name)
 
     def check_feasibility(self, x):
         """
@@ -466,9 +614,8 @@ class TEGModel(EdgeCharacterizationModel):
         If the problem has already been solved, and it is a continuous model, then return the reduced cost associated
         to the given variable index.
         """
-        var = self.x[self.TEGgraph.build_edge(edge, start, end), driver]
-        if isinstance(var, Var):
-            return var.getAttr(GRB.Attr.RC)
+        if self.x.has(driver, edge, start, end):
+            return self.x.get(driver, edge, start, end).getAttr(GRB.Attr.RC)
         lambda_plus = {
             (d, i): self.get_dual_variable_from_constraint(
                 "%s:%s:%s:%s" % (labels.UPPER_WAITING_TIME, id(d), str(edge), i)) or 0
@@ -491,97 +638,155 @@ class TEGModel(EdgeCharacterizationModel):
         omega_plus = self.get_dual_variable_from_constraint("%s:%s" % (labels.ENDING_TIME, id(driver))) or 0
         omega_minus = self.get_dual_variable_from_constraint("%s:%s" % (labels.ENDING_NODE, id(driver))) or 0
 
-        func = self.graph.get_congestion_function(*edge)
-        alpha = func(1) - func(0)
+        func = self.get_congestion_approximation(edge)
+        if func.is_linear():
+            traffic_cost = func.get_slope() * sum(lambda_plus.get((d, i), 0) - lambda_minus.get((d, i), 0)
+                                                  for d in self.drivers_graph.get_all_drivers()
+                                                  for i in self.drivers_structure.get_starting_times(d, edge)
+                                                  if start < i <= end)
+        else:
+            # the traffic is in the constraints defining the congestion
+            traffic_cost = sum(
+                self.get_dual_variable_from_constraint("%s:%s:%s" % (labels.CONGESTION_TRAFFIC, str(edge), i)) or 0
+                for i in xrange(start + 1, end + 1)
+            )
 
         reduced_cost = (end - start) * (lambda_minus.get((driver, start), 0) - lambda_plus.get((driver, start), 0)) + \
-            self.bigM() * lambda_plus.get((driver, start), 0) + \
-            alpha * sum(lambda_plus.get((d, i), 0) - lambda_minus.get((d, i), 0)
-                        for d in self.drivers_graph.get_all_drivers()
-                        for i in self.drivers_structure.get_starting_times(d, edge)
-                        if start < i <= end) + \
+            self.bigM() * lambda_plus.get((driver, start), 0) + traffic_cost + \
             mu + (driver.end != edge[1]) * tau_end - (driver.end != edge[0]) * tau_start - \
             (driver.end == edge[0]) * omega_minus - (driver.end == edge[1]) * (omega_plus - start)
 
         return reduced_cost
 
     def build_variables(self):
-        self.x = defaultdict(lambda: 0)
+        self.x = TEGVariables()
         for driver in self.drivers_graph.get_all_drivers():
             for edge in self.get_edges_for_driver(driver):
                 self.generate_variables(driver, edge, self.drivers_structure.iter_time_intervals(driver, edge))
 
+    def build_constraints_from_matrix(self):
+        """
+        Add the constraints of build_constraints family by family, as sparse matrices.
+        The variables of the congestion functions' approximations are added first, the rows defining them are
+        assembled with the other ones.
+        """
+        congestion = {}
+        if not self.lazy:
+            for (_, edge, start, _), _ in self.x.iteritems():
+                func = self.get_congestion_approximation(edge)
+                if not func.is_linear() and (edge, start) not in congestion:
+                    if (edge, start) not in self.congestion_variables:
+                        self.add_congestion_variables(edge, start)
+                    congestion[edge, start] = func, self.congestion_variables[edge, start]
+        matrix = TEGMatrix(self.graph, self.drivers_graph, self.drivers_structure, self.x, self.bigM(),
+                           congestion=congestion, formulation=self.congestion_formulation)
+        matrix.build(waiting_time=not self.lazy)
+        self.build_statistics = matrix.get_statistics()
+        for label, family in matrix.families.iteritems():
+            ct = time.time()
+            self.add_matrix_constraints(family.get_matrix(), matrix.variables, family.senses, family.rhs, family.names)
+            self.build_statistics[label]['loading_time'] = time.time() - ct
+
+    def add_waiting_time_constraints(self, driver, edge, start):
+        """
+        Add the constraints on the time driver waits on edge if he enters it at start:
+            waiting time <= f(traffic) and waiting time + bigM * (1 - x) >= f(traffic)
+        """
+        self.add_constraint(
+            self.get_waiting_time_expression(driver, edge, start) <= self.get_congestion_expression(edge, start),
+            name="%s:%s:%s:%s" % (labels.LOWER_WAITING_TIME, id(driver), str(edge), start)
+        )
+        self.add_constraint(
+            self.get_waiting_time_expression(driver, edge, start) +
+            self.bigM() * (1 - self.get_entering_expression(driver, edge, start)) >=
+            self.get_congestion_expression(edge, start),
+            name="%s:%s:%s:%s" % (labels.UPPER_WAITING_TIME, id(driver), str(edge), start)
+        )
+
+    def iter_violated_waiting_time_constraints(self, solution=None, tolerance=1e-6):
+        """
+        Iterate the (driver, edge, starting time) whose waiting time constraints (see add_waiting_time_constraints)
+        are violated by solution.
+        Both constraints hold when driver doesn't enter edge at the starting time: only the drivers entering an edge
+        are checked.
+
+        :param solution: dictionary (driver, edge, start, end) -> value. If None, the solver's current solution
+        """
+        if solution is None:
+            keys, variables = zip(*self.x.iteritems()) if len(self.x) > 0 else ((), ())
+            solution = dict(zip(keys, self.model.getAttr(GRB.Attr.X, list(variables))))
+        traffic, waiting, entering = defaultdict(float), defaultdict(float), defaultdict(float)
+        for (driver, edge, start, end), value in solution.iteritems():
+            if value > tolerance:
+                for time in xrange(start + 1, end + 1):
+                    traffic[edge, time] += value
+                waiting[driver, edge, start] += (end - start) * value
+                entering[driver, edge, start] += value
+        big_m = self.bigM()
+        for (driver, edge, start), value in entering.iteritems():
+            congestion = self.get_congestion_approximation(edge)(traffic.get((edge, start), 0))
+            if waiting[driver, edge, start] > congestion + tolerance or \
+                    waiting[driver, edge, start] + big_m * (1 - value) < congestion - tolerance:
+                yield driver, edge, start
+
+    def optimize(self):
+        """
+        If the model is lazy: add the waiting time constraints violated by the solution and solve again, until no
+        one is violated. The number of rounds, of added constraints, and the time spent in these rounds are kept in
+        solving_statistics
+        """
+        super(TEGModel, self).optimize()
+        rounds, added, ct = 0, 0, time.time()
+        while self.lazy is True and self.model.SolCount > 0:
+            violated = [
+                (driver, edge, start) for driver, edge, start in self.iter_violated_waiting_time_constraints()
+                if not self.has_constraint("%s:%s:%s:%s" % (labels.LOWER_WAITING_TIME, id(driver), str(edge), start))
+            ]
+            if not violated:
+                break
+            for driver, edge, start in violated:
+                self.add_waiting_time_constraints(driver, edge, start)
+            self.model.update()
+            rounds, added = rounds + 1, added + 2 * len(violated)
+            log.info("separation round %s: %s waiting time constraints added", rounds, 2 * len(violated))
+            super(TEGModel, self).optimize()
+        if self.lazy is True:
+            self.solving_statistics.update(separation_rounds=rounds, lazy_constraints=added,
+                                           separation_time=time.time() - ct)
+
     def build_constraints(self, notify=True):
         if notify:
             log.info("ADDING Constraints ...")
 
+        if self.matrix is True:
+            self.build_constraints_from_matrix()
+            if notify:
+                log.info("Constraints ADDED: %s" % ",".join("%s: %s" % (n, s)
+                                                            for n, s in self.build_statistics.iteritems()))
+            return
+
         for driver in self.drivers_graph.get_all_drivers():
-            self.add_constraint(
-                quicksum(
-                    quicksum(
-                        self.x[(s, self.TEGgraph.build_node(driver.end, time)), driver]
-                        for s in self.TEGgraph.predecessors_iter(self.TEGgraph.build_node(driver.end, time))
-                    )
-                    for time in self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end)
-                ) == 1,
-                name="%s:%s" % (labels.ENDING_TIME, id(driver))
-            )
-            self.add_constraint(
-                quicksum(
-                    quicksum(
-                        self.x[(self.TEGgraph.build_node(driver.end, time), s), driver]
-                        for s in self.TEGgraph.successors_iter(self.TEGgraph.build_node(driver.end, time))
-                    )
-                    for time in self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end)
-                ) == 0,
-                name="%s:%s" % (labels.ENDING_NODE, id(driver))
-            )
+            self.add_constraint(self.get_ending_expression(driver) == 1,
+                                name="%s:%s" % (labels.ENDING_TIME, id(driver)))
+            self.add_constraint(self.get_ending_expression(driver, leaving=True) == 0,
+                                name="%s:%s" % (labels.ENDING_NODE, id(driver)))
             for node in self.graph.nodes_iter():
                 if node != driver.end:
                     for i in self.drivers_structure.iter_possible_time_on_node(driver, node):
-                        node_ = self.TEGgraph.build_node(node, i)
                         self.add_constraint(
-                            quicksum(
-                                self.x[(node_, succ), driver] for succ in self.TEGgraph.successors_iter(node_)) -
-                            quicksum(
-                                self.x[(pred, node_), driver] for pred in self.TEGgraph.predecessors_iter(node_)) ==
+                            self.get_flow_expression(driver, node, i) ==
                             1 * (node == driver.start and i == driver.time),
                             name="%s:%s:%s:%s" % (labels.TRANSFERT, id(driver), str(node), i)
                         )
             for edge in self.graph.edges_iter():
                 self.add_constraint(
-                    quicksum(self.x[self.TEGgraph.build_edge(edge, i, j), driver]
+                    quicksum(self.x.get(driver, edge, i, j)
                              for i, j in self.drivers_structure.iter_time_intervals(driver, edge)) <= 1,
                     name="%s:%s:%s" % (labels.EDGE_TIME_UNICITY, id(driver), str(edge))
                 )
-                for i in self.drivers_structure.iter_starting_times(driver, edge):
-                    self.add_constraint(
-                        quicksum(self.x[self.TEGgraph.build_edge(edge, i, j), driver] * (j - i)
-                                 for j in self.drivers_structure.iter_ending_times(driver, edge, starting_time=i)) <=
-                        self.graph.get_congestion_function(*edge)(
-                            quicksum(
-                                quicksum(self.x[self.TEGgraph.build_edge(edge, ii, jj), d]
-                                         for ii, jj in self.drivers_structure.iter_time_intervals(d, edge) if ii < i <= jj)
-                                for d in self.drivers_graph.get_all_drivers()
-                            )
-                        ),
-                        name="%s:%s:%s:%s" % (labels.LOWER_WAITING_TIME, id(driver), str(edge), i)
-                    )
-                    self.add_constraint(
-                        quicksum(self.x[self.TEGgraph.build_edge(edge, i, j), driver] * (j - i)
-                                 for j in self.drivers_structure.iter_ending_times(driver, edge, starting_time=i)) +
-                        self.bigM() * (1 - quicksum(
-                            self.x[self.TEGgraph.build_edge(edge, i, j), driver]
-                            for j in self.drivers_structure.iter_ending_times(driver, edge, starting_time=i))) >=
-                        self.graph.get_congestion_function(*edge)(
-                            quicksum(
-                                quicksum(self.x[self.TEGgraph.build_edge(edge, ii, jj), d]
-                                         for ii, jj in self.drivers_structure.iter_time_intervals(d, edge) if ii < i <= jj)
-                                for d in self.drivers_graph.get_all_drivers()
-                            )
-                        ),
-                        name="%s:%s:%s:%s" % (labels.UPPER_WAITING_TIME, id(driver), str(edge), i)
-                    )
+                if not self.lazy:
+                    for i in self.drivers_structure.iter_starting_times(driver, edge):
+                        self.add_waiting_time_constraints(driver, edge, i)
 
         if notify:
             log.info("Constraints ADDED: %s" % ",".join("%s: %s added" % (n, c) for n, c in self.count.iteritems()
@@ -590,10 +795,10 @@ class TEGModel(EdgeCharacterizationModel):
     def set_objective(self):
         self.model.setObjective(
             quicksum(
-                time * self.x[(s, self.TEGgraph.build_node(driver.end, time)), driver]
+                time * variable
                 for driver in self.drivers_graph.get_all_drivers()
                 for time in self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end)
-                for s in self.TEGgraph.predecessors_iter(self.TEGgraph.build_node(driver.end, time))
+                for variable in self.x.iter_entering(driver, driver.end, time)
             ),
             GRB.MINIMIZE
         )
@@ -612,10 +817,10 @@ class TEGModel(EdgeCharacterizationModel):
     def set_optimal_solution(self):
         self.opt_solution = {}
         paths = {}
-        for (edge, driver), var in self.x.iteritems():
+        for (driver, edge, _, _), var in self.x.iteritems():
             paths.setdefault(driver, {})
-            if isinstance(var, Var) and var.X > 0:
-                paths[driver][self.TEGgraph.get_original_edge(edge)] = var.X
+            if var.X > 0:
+                paths[driver][edge] = var.X
 
         # If the solution is continuous, we split the drivers into smaller drivers
         if self.binary is False:
@@ -633,6 +838,53 @@ class TEGModel(EdgeCharacterizationModel):
                 self.graph.generate_path_from_edges(driver.start, driver.end, edges)
             )
 
+    def iter_columns_from_solution(self, solution):
+        """
+        Iterate the (driver, edge, starting time, ending time) driven in solution.
+        The times are the ones of the drivers' paths simulation, i.e. the ones of the model.
+
+        :param solution: dictionary driver -> path (tuple of nodes), or driver -> complete time path
+                         ((edge, starting time), ...) as yielded by iter_complete_optimal_solution
+        """
+        paths = {}
+        for driver, path in solution.iteritems():
+            if len(path) > 0 and not self.graph.has_node(path[0]):
+                path = (path[0][0][0],) + tuple(edge[1] for edge, _ in path)
+            paths[driver] = tuple(path)
+        simulator = self.simulator(self.graph, self.drivers_graph, paths)
+        simulator.simulate()
+        for driver, path in paths.iteritems():
+            starting_times = simulator.get_starting_times(driver)
+            edges = list(self.graph.iter_edges_in_path(path))
+            for k, edge in enumerate(edges):
+                end = starting_times[edges[k + 1]] if k + 1 < len(edges) else simulator.get_ending_time(driver)
+                yield driver, edge, starting_times[edge], end
+
+    def set_initial_solution(self, solution):
+        """
+        Give solution to the solver as MIP start: its variables start at 1, every other one at 0.
+        The columns of solution without variable are ignored: the solver then completes the start.
+
+        :param solution: see iter_columns_from_solution
+        :return: number of columns of solution without variable
+        """
+        columns = set(self.iter_columns_from_solution(solution))
+        variables, values = [], []
+        for key, variable in self.x.iteritems():
+            variables.append(variable)
+            values.append(1 * (key in columns))
+        missing = len(columns) - sum(values)
+        if missing > 0:
+            log.warning("%s columns of the initial solution have no variable: the MIP start is partial", missing)
+        self.set_start(variables, values)
+        return missing
+
+    def build_model(self):
+        built = self.built
+        super(TEGModel, self).build_model()
+        if built is False and self.initial_solution is not None:
+            self.set_initial_solution(self.initial_solution)
+
     def set_horizon(self, horizon):
         super(TEGModel, self).set_horizon(horizon)
         self.TEGgraph.horizon = horizon
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Piecewise linear approximation of the congestion functions.
+
+A congestion function f is approximated on [0, maximum traffic] by the linear interpolation of its values at a few
+breakpoints. Without a number of breakpoints, the breakpoints are the integers: the approximation is then exact on
+every integer traffic, i.e. on every solution of a binary model, but it needs one breakpoint per possible traffic.
+TEGModel computes it once per edge, and expresses f(traffic) with it as a linear expression (see
+TEGModel.get_congestion_expression).
+
+An approximation is written in a MILP with variables and rows depending on the formulation (see iter_rows). They
+are described by the positions of the variables, so that TEGModel adds them one by one and TEGMatrix assembles
+them in bulk from the same description.
+"""
+import logging
+
+import numpy as np
+
+import labels
+
+__all__ = ["PiecewiseLinearFunction"]
+
+log = logging.getLogger(__name__)
+
+
+class PiecewiseLinearFunction(object):
+    """
+    >>> f = PiecewiseLinearFunction.from_function(lambda x: x ** 4 + 1, 3)
+    >>> f.breakpoints.tolist(), f.values.tolist()
+    ([0.0, 1.0, 2.0, 3.0], [1.0, 2.0, 17.0, 82.0])
+    >>> f(1.5), f.is_linear()
+    (9.5, False)
+    """
+    # formulations of the approximation in a MILP, see iter_rows
+    SOS2 = "sos2"
+    INCREMENTAL = "incremental"
+    FORMULATIONS = (SOS2, INCREMENTAL)
+
+    def __init__(self, breakpoints, values):
+        """
+        :param breakpoints: increasing array
+        :param values: value of the function at each breakpoint
+        """
+        if len(breakpoints) == 0 or len(breakpoints) != len(values):
+            message = "A piecewise linear function needs as many values as breakpoints, and at least one"
+            log.error(message)
+            raise ValueError(message)
+        self.breakpoints = np.asarray(breakpoints, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.slopes = np.diff(self.values) / np.diff(self.breakpoints)
+
+    @classmethod
+    def from_function(cls, func, maximum, number_of_breakpoints=None):
+        """
+        :param func: function of a number
+        :param maximum: the function is approximated on [0, maximum]
+        :param number_of_breakpoints: evenly spaced breakpoints, at least 2. If None, or if there are fewer integers
+                                      in [0, maximum], every integer in [0, maximum]
+        """
+        integers = int(np.ceil(maximum)) + 1
+        if number_of_breakpoints is None or number_of_breakpoints >= integers:
+            breakpoints = np.arange(integers, dtype=np.float64)
+        elif number_of_breakpoints < 2:
+            message = "At least 2 breakpoints are needed, not %s" % number_of_breakpoints
+            log.error(message)
+            raise ValueError(message)
+        else:
+            breakpoints = np.linspace(0, maximum, number_of_breakpoints)
+        return cls(breakpoints, [func(breakpoint) for breakpoint in breakpoints.tolist()])
+
+    def number_of_breakpoints(self):
+        return len(self.breakpoints)
+
+    def is_linear(self, tolerance=1e-9):
+        """
+        Return True if the function is linear on its whole domain: it is then f(0) + slope * traffic
+        """
+        return len(self.slopes) == 0 or bool(np.all(np.abs(self.slopes - self.slopes[0]) <= tolerance))
+
+    def get_slope(self):
+        """
+        Slope of a linear function (see is_linear)
+        """
+        return self.slopes[0].item() if len(self.slopes) > 0 else 0.
+
+    def __call__(self, x):
+        return np.interp(x, self.breakpoints, self.values).item()
+
+    def number_of_variables(self, formulation):
+        """
+        SOS2 has a weight l_k per breakpoint, INCREMENTAL a filling d_k per segment, then an order z_k per segment
+        but the last one
+        """
+        n = self.number_of_breakpoints()
+        return n if formulation == self.SOS2 else 2 * n - 3
+
+    def get_expression(self, formulation):
+        """
+        f(traffic) = constant + sum coefficients[k] * variable k
+
+        :return: constant, dictionary position of the variable -> coefficient
+        """
+        if formulation == self.SOS2:
+            return 0., dict(enumerate(self.values.tolist()))
+        return self.values[0].item(), dict(enumerate(np.diff(self.values).tolist()))
+
+    def iter_rows(self, formulation):
+        """
+        Iterate the rows defining the variables of formulation, with b the breakpoints:
+            - SOS2: sum l_k = 1 and traffic = sum l_k * b_k. At most two consecutive l_k are positive (SOS2 constraint)
+            - INCREMENTAL: traffic = b_0 + sum d_k * (b_k+1 - b_k) and 0 <= d_k+1 <= z_k <= d_k <= 1, z_k binary
+        as (label, suffix, coefficients, traffic coefficient, sense, rhs), meaning:
+            sum coefficients[k] * variable k + traffic coefficient * traffic (sense) rhs
+        The sense is '<', '>' or '=', and the row is named label:edge:time, followed by the suffix if any.
+        """
+        n, breakpoints = self.number_of_breakpoints(), self.breakpoints.tolist()
+        if formulation == self.SOS2:
+            yield labels.CONGESTION_CONVEXITY, (), {k: 1 for k in xrange(n)}, 0, '=', 1
+            yield labels.CONGESTION_TRAFFIC, (), {k: - b for k, b in enumerate(breakpoints)}, 1, '=', 0
+            return
+        yield labels.CONGESTION_TRAFFIC, (), {k: - w for k, w in enumerate(np.diff(breakpoints).tolist())}, 1, '=', \
+            breakpoints[0]
+        for k in xrange(n - 2):
+            # z_k is the variable n - 1 + k
+            yield labels.CONGESTION_ORDER, (2 * k,), {k + 1: 1, n - 1 + k: -1}, 0, '<', 0
+            yield labels.CONGESTION_ORDER, (2 * k + 1,), {n - 1 + k: 1, k: -1}, 0, '<', 0
@@ -2,16 +2,29 @@
 """
 In this file, we introduce some algorithm in order to simplify the problem before solving it
 """
+import logging
+import math
 import sys
+import time
 
+import networkx as nx
+
+from optimizedGPS import labels
+from optimizedGPS.structure import GPSGraph
 from optimizedGPS.structure.DriversStructure import DriversStructure
 
+log = logging.getLogger(__name__)
+
 
 class PreSolver(object):
-    def __init__(self, graph, drivers_graph, drivers_structure=None, horizon=sys.maxint):
+    def __init__(self, graph, drivers_graph, drivers_structure=None, horizon=sys.maxint, processes=1):
+        """
+        :param processes: number of processes presolving the drivers in parallel. If None, the number of cpus
+        """
         self.graph = graph
         self.drivers_graph = drivers_graph
         self.drivers_structure = drivers_structure or DriversStructure(graph, drivers_graph, horizon=horizon)
+        self.processes = processes
 
     def get_graph(self):
         return self.graph
@@ -47,21 +60,341 @@ class PreSolver(object):
 
 class HorizonPresolver(PreSolver):
     """
-    Compute the minimum horizon
+    Compute the minimum horizon, in two tiers:
+       1. an analytic bound: every driver follows his shortest path when every edge holds the total traffic of the
+       drivers. The congestion functions being non-decreasing, he reaches his end sooner in this solution.
+       The shortest times are computed once per starting node.
+       2. if refine is True, the maximum ending time of RealGPS's solution, if it is lower. It costs a full
+       RealGPS solve, so it is only done on demand
     """
-    def solve(self):
+    def __init__(self, graph, drivers_graph, drivers_structure=None, horizon=sys.maxint, processes=1, refine=False):
+        """
+        :param refine: if True, the analytic bound is refined by solving RealGPS
+        """
+        super(HorizonPresolver, self).__init__(graph, drivers_graph, drivers_structure=drivers_structure,
+                                               horizon=horizon, processes=processes)
+        self.refine = refine
+        # bound and computing time of each tier, and the chosen tier
+        self.statistics = {}
+
+    def compute_analytic_bound(self):
+        """
+        Return the latest ending time of the drivers following their shortest path under the maximum traffic,
+        infinity if one of them can't reach his end
+        """
+        drivers = list(self.drivers_graph.get_all_drivers())
+        traffic = sum(driver.traffic_weight for driver in drivers)
+        congested_graph = nx.DiGraph()
+        for source, target in self.graph.edges_iter():
+            congested_graph.add_edge(source, target, time=self.graph.get_congestion_function(source, target)(traffic))
+        bound, times = 0, {}
+        for driver in drivers:
+            if driver.start not in times:
+                times[driver.start] = nx.single_source_dijkstra_path_length(congested_graph, driver.start,
+                                                                            weight='time') \
+                    if driver.start in congested_graph else {driver.start: 0}
+            bound = max(bound, driver.time + times[driver.start].get(driver.end, float('inf')))
+        return bound if bound == float('inf') else int(math.ceil(bound))
+
+    def compute_refined_bound(self):
         from optimizedGPS.problems.Heuristics import RealGPS
         problem = RealGPS(self.graph, self.drivers_graph)
         problem.solve()
-        self.drivers_structure.horizon = problem.opt_simulator.get_maximum_ending_time()
+        return problem.opt_simulator.get_maximum_ending_time()
+
+    def solve(self):
+        ct = time.time()
+        horizon = self.compute_analytic_bound()
+        self.statistics.update(analytic_bound=horizon, analytic_time=time.time() - ct, tier='analytic')
+        if self.refine:
+            ct = time.time()
+            refined_horizon = self.compute_refined_bound()
+            self.statistics.update(refined_bound=refined_horizon, refined_time=time.time() - ct)
+            if refined_horizon < horizon:
+                horizon = refined_horizon
+                self.statistics['tier'] = 'refined'
+        if horizon == float('inf'):
+            # some drivers can't reach their end: the horizon stays the given one
+            self.statistics['tier'] = None
+        else:
+            self.drivers_structure.horizon = horizon
+        log.info("horizon %s chosen from the %s bound: %s", self.drivers_structure.horizon, self.statistics['tier'],
+                 self.statistics)
 
     def get_horizon(self):
         return self.drivers_structure.horizon
 
+    def get_statistics(self):
+        return self.statistics
+
 
 class SafetyIntervalsPresolver(PreSolver):
     """
     Compute the smallest possible safety intervals
     """
     def solve(self):
-        self.drivers_structure.compute_optimal_safety_intervals()
+        self.drivers_structure.compute_optimal_safety_intervals(processes=self.processes)
+
+
+class GlobalPreSolver(PreSolver):
+    """
+    Remove for each driver the edges he can't drive on in a good enough solution.
+
+    Driving on edge (u, v), driver reaches his end at the soonest after the traffic-free time from his start to u, on
+    (u, v) and from v to his end. If this time is greater than the horizon, or than the latest ending time of driver
+    in a solution whose sum of ending times is lower than a known one, the edge is unreachable for driver.
+    The traffic-free times from a driver's start and to his end are computed once per starting and ending node.
+    """
+    def __init__(self, graph, drivers_graph, drivers_structure=None, horizon=sys.maxint, processes=1,
+                 upper_bound=None):
+        """
+        :param upper_bound: sum of the ending times of a known solution. If None, the one of RealGPS
+        """
+        super(GlobalPreSolver, self).__init__(graph, drivers_graph, drivers_structure=drivers_structure,
+                                              horizon=horizon, processes=processes)
+        self.upper_bound = upper_bound
+        self.free_flow_graph, self.reversed_free_flow_graph = None, None
+        # traffic-free time from each computed starting node, and to each computed ending node
+        self.forward_times, self.backward_times = {}, {}
+        self.solved = False
+
+    def get_free_flow_graph(self):
+        if self.free_flow_graph is None:
+            self.free_flow_graph = nx.DiGraph()
+            self.free_flow_graph.add_nodes_from(self.graph.nodes_iter())
+            for source, target in self.graph.edges_iter():
+                self.free_flow_graph.add_edge(source, target, time=self.graph.get_minimum_waiting_time(source, target))
+            self.reversed_free_flow_graph = self.free_flow_graph.reverse(copy=True)
+        return self.free_flow_graph
+
+    def get_forward_times(self, node):
+        """
+        Return for each node the traffic-free time to reach it from node
+        """
+        if node not in self.forward_times:
+            self.forward_times[node] = nx.single_source_dijkstra_path_length(
+                self.get_free_flow_graph(), node, weight='time')
+        return self.forward_times[node]
+
+    def get_backward_times(self, node):
+        """
+        Return for each node the traffic-free time to reach node from it
+        """
+        if node not in self.backward_times:
+            self.get_free_flow_graph()
+            self.backward_times[node] = nx.single_source_dijkstra_path_length(
+                self.reversed_free_flow_graph, node, weight='time')
+        return self.backward_times[node]
+
+    def compute_upper_bound(self):
+        from optimizedGPS.problems.Heuristics import RealGPS
+        problem = RealGPS(self.graph, self.drivers_graph)
+        problem.solve()
+        return problem.opt_simulator.get_sum_ending_time()
+
+    def get_drivers_bounds(self):
+        """
+        For each driver, the latest ending time he can have: the horizon, and the upper bound minus the soonest
+        ending times of the other drivers
+
+        :return: dict
+        """
+        soonest_ending_times = {
+            driver: driver.time + self.get_forward_times(driver.start).get(driver.end, float('inf'))
+            for driver in self.drivers_graph.get_all_drivers()
+        }
+        horizon = self.drivers_structure.horizon
+        total = sum(soonest_ending_times.itervalues())
+        if total == float('inf'):
+            # some drivers can't reach their end: the upper bound can't be compared to their ending times
+            return {driver: horizon for driver in soonest_ending_times}
+        if self.upper_bound is None:
+            self.upper_bound = self.compute_upper_bound()
+        return {
+            driver: min(horizon, self.upper_bound - (total - soonest_ending_time))
+            for driver, soonest_ending_time in soonest_ending_times.iteritems()
+        }
+
+    def iter_unusable_edges_for_driver(self, driver, bound):
+        """
+        Iterate the edges on which driver can't drive if he has to reach his end before bound
+        """
+        forward_times, backward_times = self.get_forward_times(driver.start), self.get_backward_times(driver.end)
+        for source, target, data in self.get_free_flow_graph().edges_iter(data=True):
+            if source not in forward_times or target not in backward_times or \
+                    driver.time + forward_times[source] + data['time'] + backward_times[target] > bound:
+                yield source, target
+
+    def solve(self):
+        for driver, bound in self.get_drivers_bounds().iteritems():
+            for edge in self.iter_unusable_edges_for_driver(driver, bound):
+                self.set_unreachable_edge_to_driver(driver, edge)
+        self.solved = True
+
+    def map_reachable_edges_for_drivers(self):
+        if not self.solved:
+            self.solve()
+        return super(GlobalPreSolver, self).map_reachable_edges_for_drivers()
+
+    def iter_unused_edges(self):
+        """
+        Iterate the edges that no driver can reach
+        """
+        if not self.solved:
+            self.solve()
+        drivers = list(self.drivers_graph.get_all_drivers())
+        for edge in self.graph.edges_iter():
+            if not any(self.is_edge_reachable_by_driver(driver, edge) for driver in drivers):
+                yield edge
+
+
+def constant_function(value):
+    return lambda traffic: value
+
+
+class GraphReductionPresolver(GlobalPreSolver):
+    """
+    Build a reduced copy of graph, containing only the edges that at least one driver can use (see GlobalPreSolver).
+
+    In this copy, a node which is no driver's start or end, and has one predecessor u and one successor v, is removed
+    and the chain u -> node -> v replaced by one edge (u, v), when the driving times on both edges don't depend on
+    the traffic: the driving time on the new edge is their sum, whatever the traffic.
+    If the driving times depend on the traffic, the chain is kept: the traffic on the new edge would be the one on
+    both edges, which changes the driving time.
+    The paths found on the reduced graph are mapped back to graph by `map_path`.
+    """
+    def __init__(self, graph, drivers_graph, drivers_structure=None, horizon=sys.maxint, processes=1,
+                 upper_bound=None, presolved=False):
+        """
+        :param presolved: if True, the unreachable edges of drivers_structure are already computed (by
+                          GlobalPreSolver, or read from a cache): they are not computed again
+        """
+        super(GraphReductionPresolver, self).__init__(
+            graph, drivers_graph, drivers_structure=drivers_structure, horizon=horizon, processes=processes,
+            upper_bound=upper_bound)
+        self.solved = presolved
+        self.reduced_graph = None
+        # for each edge of the reduced graph replacing a chain, the path of this chain in graph
+        self.chains = {}
+
+    def get_maximum_traffic(self):
+        """
+        Return the largest possible traffic on an edge, None if the traffics are not integers
+        """
+        weights = [driver.traffic_weight for driver in self.drivers_graph.get_all_drivers()]
+        if any(weight != int(weight) for weight in weights):
+            return None
+        return int(math.ceil(sum(weights)))
+
+    def get_constant_driving_time(self, edge, maximum_traffic):
+        """
+        Return the driving time on edge of the reduced graph if it is the same for every possible traffic,
+        None otherwise
+        """
+        if maximum_traffic is None:
+            return None
+        cong_function = self.reduced_graph.get_congestion_function(*edge)
+        driving_time = cong_function(0)
+        if all(cong_function(traffic) == driving_time for traffic in xrange(1, maximum_traffic + 1)):
+            return driving_time
+        return None
+
+    def build_reduced_graph(self):
+        self.reduced_graph = GPSGraph(name=self.graph.name)
+        for node in set(driver.start for driver in self.drivers_graph.get_all_drivers()) | \
+                set(driver.end for driver in self.drivers_graph.get_all_drivers()):
+            self.reduced_graph.add_node(node, attr_dict=dict(self.graph.node[node]))
+        used_edges = set(edge for edges in self.map_reachable_edges_for_drivers().itervalues() for edge in edges)
+        for source, target in self.graph.edges_iter():
+            if (source, target) in used_edges:
+                for node in (source, target):
+                    if not self.reduced_graph.has_node(node):
+                        self.reduced_graph.add_node(node, attr_dict=dict(self.graph.node[node]))
+                self.reduced_graph.add_edge(source, target, attr_dict=dict(self.graph.get_edge_data(source, target)))
+
+    def contract_chains(self):
+        """
+        Replace the chains u -> node -> v by one edge when possible (see the class' description)
+
+        :return: the number of removed nodes
+        """
+        ends = set(driver.start for driver in self.drivers_graph.get_all_drivers()) | \
+            set(driver.end for driver in self.drivers_graph.get_all_drivers())
+        maximum_traffic = self.get_maximum_traffic()
+        removed = 0
+        for node in sorted(self.reduced_graph.nodes()):
+            if node in ends or self.reduced_graph.in_degree(node) != 1 or self.reduced_graph.out_degree(node) != 1:
+                continue
+            source, target = self.reduced_graph.predecessors(node)[0], self.reduced_graph.successors(node)[0]
+            if source == target or node in (source, target) or self.reduced_graph.has_edge(source, target):
+                continue
+            driving_times = [self.get_constant_driving_time(edge, maximum_traffic)
+                             for edge in ((source, node), (node, target))]
+            if None in driving_times:
+                continue
+            data = dict(self.reduced_graph.get_edge_data(source, node))
+            data[labels.DISTANCE] += self.reduced_graph.get_edge_property(node, target, labels.DISTANCE)
+            data[labels.CONGESTION_FUNC] = constant_function(sum(driving_times))
+            self.chains[source, target] = self.get_chain((source, node)) + self.get_chain((node, target))[1:]
+            self.chains.pop((source, node), None)
+            self.chains.pop((node, target), None)
+            self.reduced_graph.remove_node(node)
+            self.reduced_graph.add_edge(source, target, attr_dict=data)
+            removed += 1
+        return removed
+
+    def get_chain(self, edge):
+        """
+        Return the path in graph represented by edge of the reduced graph
+        """
+        return self.chains.get(edge, edge)
+
+    def solve(self):
+        if not self.solved:
+            super(GraphReductionPresolver, self).solve()
+        self.build_reduced_graph()
+        self.contract_chains()
+
+    def get_reduced_graph(self):
+        if self.reduced_graph is None:
+            self.solve()
+        return self.reduced_graph
+
+    def get_reduced_drivers_structure(self):
+        """
+        Return a DriversStructure on the reduced graph: an edge replacing a chain is unreachable for a driver if one
+        edge of the chain is, and its intervals start with the first edge's ones and end with the last edge's ones
+        """
+        reduced_graph = self.get_reduced_graph()
+        drivers_structure = DriversStructure(reduced_graph, self.drivers_graph, horizon=self.drivers_structure.horizon)
+        for driver in self.drivers_graph.get_all_drivers():
+            for edge in reduced_graph.edges_iter():
+                edges = list(self.graph.iter_edges_in_path(self.get_chain(edge)))
+                if not all(self.is_edge_reachable_by_driver(driver, e) for e in edges):
+                    drivers_structure.set_unreachable_edge_to_driver(driver, edge)
+                    continue
+                drivers_structure.add_safety_interval(
+                    driver, edge, self.drivers_structure.get_safety_interval(driver, edges[0])[0],
+                    self.drivers_structure.get_safety_interval(driver, edges[-1])[1])
+                drivers_structure.add_presence_interval(
+                    driver, edge, self.drivers_structure.get_presence_interval(driver, edges[0])[0],
+                    self.drivers_structure.get_presence_interval(driver, edges[-1])[1])
+        return drivers_structure
+
+    def map_path(self, path):
+        """
+        Return the path in graph corresponding to path in the reduced graph
+        """
+        if len(path) < 2:
+            return tuple(path)
+        mapped = (path[0],)
+        for edge in self.reduced_graph.iter_edges_in_path(path):
+            mapped += tuple(self.get_chain(edge)[1:])
+        return mapped
+
+    def map_solution(self, solution):
+        """
+        :param solution: dictionary driver -> path in the reduced graph
+        :return: dictionary driver -> path in graph
+        """
+        return {driver: self.map_path(path) for driver, path in solution.iteritems()}
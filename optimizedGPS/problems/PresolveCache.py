@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Disk cache of the presolvers' results.
+
+An instance is identified by a fingerprint: a sha1 hash of the graph's edges and their properties, of the congestion
+functions, of the drivers, of the horizon and of the state of the DriversStructure given to the solver.
+The presolved horizon, unreachable edges, safety and presence intervals are stored as one compressed .npz file per
+fingerprint: solving the same instance again reads them instead of presolving.
+
+Drivers are stored in the order of their tuples, and edges in their sorted order, so that an equal instance built
+from other Driver objects has the same fingerprint and the same arrays.
+"""
+import hashlib
+import logging
+import math
+import os
+
+import numpy as np
+
+from optimizedGPS import labels
+
+__all__ = ["PresolveCache"]
+
+log = logging.getLogger(__name__)
+
+
+class PresolveCache(object):
+    """
+    >>> cache = PresolveCache("output/presolve")  # doctest: +SKIP
+    >>> Solver(graph, drivers_graph, TEGModel, cache=cache).solve()  # doctest: +SKIP
+    >>> cache.hits, cache.misses  # doctest: +SKIP
+    """
+    # increase it when the presolvers' results change: the files written before are then ignored
+    VERSION = 1
+
+    def __init__(self, directory):
+        """
+        :param directory: path to the directory where the results are stored. Created if it doesn't exist
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get_drivers(cls, drivers_graph):
+        return sorted(drivers_graph.get_all_drivers(), key=lambda driver: driver.to_tuple())
+
+    @classmethod
+    def get_edges(cls, graph):
+        return sorted(graph.edges_iter())
+
+    @classmethod
+    def get_state(cls, drivers_structure, graph, drivers_graph, prefix):
+        """
+        Return the horizon, unreachable edges, safety and presence intervals of drivers_structure, for every driver
+        of drivers_graph and edge of graph. The names of the arrays start with prefix.
+        """
+        drivers, edges = cls.get_drivers(drivers_graph), cls.get_edges(graph)
+        drivers_structure.index(drivers, edges)
+        rows = np.array([drivers_structure.drivers_index[driver] for driver in drivers], dtype=np.int64)
+        columns = np.array([drivers_structure.edges_index[edge] for edge in edges], dtype=np.int64)
+        rows, columns = rows[:, None], columns[None, :]
+        return {
+            prefix + 'horizon': np.array(drivers_structure.horizon),
+            prefix + 'unreachable_edges': drivers_structure.unreachable_edges[rows, columns],
+            prefix + 'safety_intervals': drivers_structure.safety_intervals[rows, columns],
+            prefix + 'presence_intervals': drivers_structure.presence_intervals[rows, columns]
+        }
+
+    @classmethod
+    def set_state(cls, drivers_structure, graph, drivers_graph, state, prefix):
+        """
+        Write in drivers_structure the arrays returned by get_state
+        """
+        drivers, edges = cls.get_drivers(drivers_graph), cls.get_edges(graph)
+        drivers_structure.index(drivers, edges)
+        rows = np.array([drivers_structure.drivers_index[driver] for driver in drivers], dtype=np.int64)
+        columns = np.array([drivers_structure.edges_index[edge] for edge in edges], dtype=np.int64)
+        rows, columns = rows[:, None], columns[None, :]
+        drivers_structure.horizon = state[prefix + 'horizon'].item()
+        drivers_structure.unreachable_edges[rows, columns] = state[prefix + 'unreachable_edges']
+        drivers_structure.safety_intervals[rows, columns] = state[prefix + 'safety_intervals']
+        drivers_structure.presence_intervals[rows, columns] = state[prefix + 'presence_intervals']
+
+    def get_key(self, graph, drivers_graph, drivers_structure, presolvers, horizon, settings=None):
+        """
+        Return the fingerprint of the instance.
+        The congestion functions are compared on every integer traffic up to the drivers' total weight.
+
+        :param presolvers: names of the presolvers
+        :param horizon: horizon given to the solver
+        :param settings: dictionary of the other parameters changing the presolvers' results
+        :return: hexadecimal string
+        """
+        sha = hashlib.sha1()
+
+        def update(value):
+            sha.update(repr(value))
+            sha.update('\0')
+
+        drivers, edges = self.get_drivers(drivers_graph), self.get_edges(graph)
+        max_traffic = int(math.ceil(sum(driver.traffic_weight for driver in drivers)))
+        update(self.VERSION)
+        update(sorted(presolvers))
+        update(horizon)
+        update(sorted((settings or {}).iteritems()))
+        update([driver.to_tuple() for driver in drivers])
+        for source, target in edges:
+            data = graph.get_edge_data(source, target)
+            update(((source, target), sorted((k, v) for k, v in data.iteritems() if k != labels.CONGESTION_FUNC)))
+            congestion_function = graph.get_congestion_function(source, target)
+            update([congestion_function(traffic) for traffic in xrange(max_traffic + 1)])
+
+        # the solver's drivers_structure may already be restricted (see TEGColumnGenerationAlgorithm)
+        state = self.get_state(drivers_structure, graph, drivers_graph, '')
+        for name in sorted(state):
+            update(name)
+            sha.update(np.ascontiguousarray(state[name]).tostring())
+        positions = {driver: i for i, driver in enumerate(drivers)}
+        edges_positions = {edge: j for j, edge in enumerate(edges)}
+        for name in ('starting_times', 'ending_times'):
+            update(name)
+            update(sorted(
+                (positions[drivers_structure.drivers[i]], edges_positions[drivers_structure.edges[j]], list(times))
+                for (i, j), times in getattr(drivers_structure, name).iteritems()
+                if drivers_structure.drivers[i] in positions and drivers_structure.edges[j] in edges_positions
+            ))
+        return sha.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, "%s.npz" % key)
+
+    def load(self, key):
+        """
+        :return: the arrays stored under key, None if there are none
+        """
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with np.load(path) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def save(self, key, state):
+        """
+        Store state under key. The file is written under another name then renamed, so that a concurrent reader
+        never reads a partial file.
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = self.get_path(key)
+        temporary = "%s.%s.tmp" % (path, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, **state)
+        os.rename(temporary, path)
+        log.debug("presolved state stored in %s", path)
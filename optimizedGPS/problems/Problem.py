@@ -9,12 +9,7 @@ import sys
 import time
 from collections import defaultdict
 
-try:
-    import gurobipy as gb
-    from gurobipy import GurobiError
-except ImportError:
-    gb, GurobiError = None, None
-
+from SolverBackend import GRB, GUROBI, SOLVER_ERRORS, new_model, get_default_backend
 from simulator import FromEdgeDescriptionSimulator
 from optimizedGPS import options
 from optimizedGPS.structure import DriversStructure
@@ -212,6 +207,12 @@ class Problem(object):
             value += waiting_times[driver][edge]
         return value
 
+    def get_optimal_traffic_index(self, limits=None):
+        """
+        Return the traffic index (see TrafficIndex) of the optimal solution. Should be used after solving
+        """
+        return self.opt_simulator.get_traffic_index(limits=limits)
+
     def get_optimal_traffic(self, excluded_drivers=()):
         """
         Return the traffic corresponding to the optimal solution
@@ -293,17 +294,27 @@ class Model(Problem):
     """ Initialize the models' classes
     """
     def __init__(self, graph, drivers_graph, drivers_structure=None, timeout=sys.maxint, horizon=sys.maxint,
-                 solving_type=SolvinType.SOLVER, binary=True, **params):
+                 solving_type=SolvinType.SOLVER, binary=True, backend=None, **params):
+        """
+        :param backend: solver backend, 'gurobi' or 'highs' (see SolverBackend).
+                        If None, gurobi if gurobipy is installed, highs otherwise
+        :param params: parameters of the solver
+        """
         super(Model, self).__init__(graph, drivers_graph, drivers_structure=drivers_structure, horizon=horizon,
                                     timeout=timeout, solving_type=solving_type)
-        self.model = gb.Model()
+        self.backend = backend or get_default_backend()
+        self.model = new_model(self.backend)
         params['TimeLimit'] = timeout
         params['LogToConsole'] = 0
         self.set_parameters(**params)
 
         self.count = {}
+        self.constraints = {}  # every constraint added by add_constraint, by name
         self.built = False  # True if the model has already been built
         self.binary = binary
+        self.warm_start = False  # True if a MIP start has been given to the solver
+        # time and value of the first solution found by the solver, solving time if the solution is optimal
+        self.solving_statistics = {}
 
         self.initialize(**params)
 
@@ -321,7 +332,7 @@ class Model(Problem):
 
     def set_parameters(self, **kwargs):
         """
-        Set Gurobi parameters
+        Set the solver's parameters
         """
         for key, value in kwargs.iteritems():
             if key != "horizon":
@@ -352,9 +363,29 @@ class Model(Problem):
 
         name = str(name)
         self.count.setdefault(name.split(':')[0], 0)
-        self.model.addConstr(constraint, name)
+        self.constraints[name] = self.model.addConstr(constraint, name)
         self.count[name.split(':')[0]] += 1
 
+    def add_matrix_constraints(self, matrix, variables, senses, rhs, names):
+        """
+        Add in bulk the constraints matrix * variables (senses) rhs, and register them as add_constraint does
+
+        :param matrix: scipy.sparse matrix, one column per variable
+        :param variables: list of variables
+        :param senses: array of '<', '>' or '=' for each row
+        :param rhs: array of right hand sides
+        :param names: name of each row. The family counted is the part before ":"
+        """
+        # addMConstrs has been renamed addMConstr in gurobi 9.5
+        add_matrix_constraints = getattr(self.model, 'addMConstr', None) or self.model.addMConstrs
+        constraints = add_matrix_constraints(matrix, variables, senses, rhs)
+        constraints = constraints.tolist() if hasattr(constraints, 'tolist') else list(constraints)
+        self.model.update()
+        self.model.setAttr('ConstrName', constraints, names)
+        for name, constraint in zip(names, constraints):
+            self.constraints[name] = constraint
+            self.count[name.split(':')[0]] = self.count.get(name.split(':')[0], 0) + 1
+
     def build_constraints(self):
         """
         Set the constraints of the problem
@@ -380,10 +411,41 @@ class Model(Problem):
         else:
             log.info("** Model has already been BUILT **")
 
+    def set_start(self, variables, values):
+        """
+        Give a MIP start to the solver: the value of each variable in the first solution it tries.
+        The gurobi backend completes partial starts, the highs one ignores them.
+        """
+        self.model.setAttr(GRB.Attr.Start, list(variables), list(values))
+        self.warm_start = True
+
+    def optimize(self):
+        """
+        Optimize the model, and set solving_statistics
+        """
+        statistics = self.solving_statistics = {
+            'warm_start': self.warm_start, 'first_incumbent_time': None, 'first_incumbent_value': None,
+            'optimality_time': None
+        }
+
+        def callback(model, where):
+            if where == GRB.Callback.MIPSOL and statistics['first_incumbent_time'] is None:
+                statistics['first_incumbent_time'] = model.cbGet(GRB.Callback.RUNTIME)
+                statistics['first_incumbent_value'] = model.cbGet(GRB.Callback.MIPSOL_OBJ)
+
+        self.model.optimize(callback if self.backend == GUROBI else None)
+        # continuous problems, and the highs backend, don't call the callback: their first solution is the last one
+        if statistics['first_incumbent_time'] is None and self.model.SolCount > 0:
+            statistics['first_incumbent_time'], statistics['first_incumbent_value'] = \
+                self.model.Runtime, self.model.ObjVal
+        if self.model.Status == GRB.OPTIMAL:
+            statistics['optimality_time'] = self.model.Runtime
+        log.info("solving statistics: %s", statistics)
+
     def solve_with_solver(self):
         t = time.time()
         self.build_model()
-        self.model.optimize()
+        self.optimize()
         self.running_time = time.time() - t
         self.set_optimal_solution()
         self.set_status(options.SUCCESS)
@@ -397,12 +459,30 @@ class Model(Problem):
     def get_objectif(self):
         try:
             return self.model.ObjVal
-        except GurobiError:
+        except SOLVER_ERRORS:
             log.warning("problem has not been solved yet")
             return sys.maxint
 
     def has_constraint(self, constr_name):
-        return self.model.getConstrByName(constr_name) is not None
+        return constr_name in self.constraints
+
+    def get_constraint(self, constr_name):
+        """
+        Return the constraint added with this name, None if there is none
+        """
+        return self.constraints.get(constr_name)
+
+    def set_coefficient(self, constr_name, variable, value):
+        """
+        Change in place the coefficient of variable in the constraint constr_name
+
+        :return: False if there is no such constraint, True otherwise
+        """
+        constraint = self.constraints.get(constr_name)
+        if constraint is None:
+            return False
+        self.model.chgCoeff(constraint, variable, value)
+        return True
 
     def has_variable(self, *args):
         return False
@@ -414,6 +494,6 @@ class Model(Problem):
         :param constr_name: name of the constraint
         """
         try:
-            return self.model.getConstrByName(constr_name).Pi
-        except (AttributeError, GurobiError):
+            return self.constraints[constr_name].Pi
+        except (KeyError,) + SOLVER_ERRORS:
             return 0
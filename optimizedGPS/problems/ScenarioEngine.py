@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Monte Carlo study of the algorithms: the same graph is used with many randomly generated demands (one per seed),
+and every algorithm is run on each of these scenarios.
+"""
+
+import logging
+import math
+import multiprocessing
+import time
+from functools import partial
+
+from optimizedGPS import options
+
+__all__ = ["ScenarioEngine"]
+
+log = logging.getLogger(__name__)
+
+# Read-only data shared by the worker processes. Set once per worker by `_initialize_worker`.
+_shared = {}
+
+
+def _initialize_worker(graph, demand_generator, algorithms):
+    """
+    Store the read-only data in the worker. On Unix the workers are forked, so the graph (and its congestion
+    functions) is inherited and never pickled.
+    """
+    _shared['graph'] = graph
+    _shared['demand_generator'] = demand_generator
+    _shared['algorithms'] = algorithms
+
+
+def _run_shared_scenario(seed):
+    return run_scenario(_shared['graph'], _shared['demand_generator'], _shared['algorithms'], seed)
+
+
+def run_scenario(graph, demand_generator, algorithms, seed):
+    """
+    Generate the demand for the given seed and run every algorithm on it.
+
+    :param graph: GPSGraph instance
+    :param demand_generator: function taking the graph and a seed as arguments and returning a DriversGraph
+    :param algorithms: list of options.ALGO
+    :param seed: seed given to demand_generator
+    :return: seed, and for each algorithm's name a dictionary of metrics
+    """
+    drivers_graph = demand_generator(graph, seed=seed)
+    metrics = {}
+    for algo in algorithms:
+        try:
+            a = algo.algo(graph, drivers_graph, *algo.args, **algo.kwargs)
+            start = time.time()
+            a.solve()
+            running_time = time.time() - start
+            simulator = getattr(a, 'opt_simulator', None)
+            metrics[algo.algo.__name__] = {
+                'value': a.get_optimal_value(),
+                'running_time': running_time,
+                'status': a.get_status(),
+                'drivers': drivers_graph.number_of_drivers(),
+                'maximum_ending_time': simulator.get_maximum_ending_time() if simulator is not None else None
+            }
+        except Exception as e:
+            log.warning("algorithm %s failed on scenario %s: %s", algo.algo.__name__, seed, e)
+            metrics[algo.algo.__name__] = {
+                'value': None,
+                'running_time': None,
+                'status': options.FAILED,
+                'drivers': drivers_graph.number_of_drivers(),
+                'maximum_ending_time': None
+            }
+    return seed, metrics
+
+
+class ScenarioEngine(object):
+    """
+    Run every algorithm on every scenario of a seed range, using a pool of processes.
+
+    >>> from optimizedGPS.data.data_generator import generate_grid_data  # doctest: +SKIP
+    >>> from optimizedGPS.problems import RealGPS  # doctest: +SKIP
+    >>> engine = ScenarioEngine(generate_grid_data(5, 5), seeds=xrange(1000), total_drivers=20)  # doctest: +SKIP
+    >>> engine.append_algorithm(RealGPS)  # doctest: +SKIP
+    >>> for seed, metrics in engine.iter_scenarios():  # metrics are yielded as soon as a scenario is finished
+    ...     print seed, metrics["RealGPS"]["value"]  # doctest: +SKIP
+    >>> print engine.get_statistics()  # doctest: +SKIP
+    """
+    def __init__(self, graph, demand_generator=None, seeds=xrange(10), processes=None, **demand_kwargs):
+        """
+        :param graph: GPSGraph instance, shared by every scenario
+        :param demand_generator: function taking the graph and a seed as arguments and returning a DriversGraph.
+                                 If None, we use generate_random_drivers with the given demand_kwargs
+        :param seeds: one scenario is generated for each seed
+        :param processes: number of processes in the pool. If None, the number of cpus.
+                          If 1 every scenario is run in the current process
+        """
+        from optimizedGPS.data.data_generator import generate_random_drivers
+        self.graph = graph
+        self.demand_generator = demand_generator or partial(generate_random_drivers, **demand_kwargs)
+        self.seeds = list(seeds)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.algorithms = []
+
+        self.results = {}  # for each seed, the metrics of every algorithm
+        self.running_time = 0
+
+    def append_algorithm(self, algorithm, *arguments, **kwargs):
+        self.algorithms.append(options.ALGO(algorithm, arguments, kwargs))
+
+    def get_algorithms(self):
+        return map(lambda el: el.algo.__name__, self.algorithms)
+
+    def reinitialize(self):
+        self.results = {}
+        self.running_time = 0
+
+    def iter_scenarios(self):
+        """
+        Run every scenario and yield (seed, metrics) as soon as a scenario is finished.
+        The results are stored as well in self.results
+        """
+        self.reinitialize()
+        ct = time.time()
+        if self.processes == 1 or len(self.seeds) <= 1:
+            results = (run_scenario(self.graph, self.demand_generator, self.algorithms, seed) for seed in self.seeds)
+            for seed, metrics in results:
+                self.results[seed] = metrics
+                yield seed, metrics
+        else:
+            pool = multiprocessing.Pool(
+                processes=min(self.processes, len(self.seeds)),
+                initializer=_initialize_worker,
+                initargs=(self.graph, self.demand_generator, self.algorithms)
+            )
+            try:
+                for seed, metrics in pool.imap_unordered(_run_shared_scenario, self.seeds):
+                    self.results[seed] = metrics
+                    yield seed, metrics
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        self.running_time = time.time() - ct
+        log.info("%s scenarios run in %s seconds", len(self.results), self.running_time)
+
+    def run(self):
+        """
+        Run every scenario and return the aggregated statistics
+        """
+        for _ in self.iter_scenarios():
+            pass
+        return self.get_statistics()
+
+    def get_statistics(self):
+        """
+        For each algorithm, aggregate the metrics over every run scenario:
+          - number of scenarios for each status
+          - mean, standard deviation, minimum and maximum of the value and running time,
+            over the successful scenarios
+
+        :return: dict
+        """
+        stats = {}
+        for algo in self.get_algorithms():
+            metrics = [m[algo] for m in self.results.itervalues() if algo in m]
+            succeeded = filter(lambda m: m['status'] in [options.SUCCESS, options.TIMEOUT], metrics)
+            stats[algo] = {
+                'status': {
+                    options.STATUS[status]: len(filter(lambda m: m['status'] == status, metrics))
+                    for status in set(map(lambda m: m['status'], metrics))
+                },
+                'value': self.describe(map(lambda m: m['value'], succeeded)),
+                'running_time': self.describe(map(lambda m: m['running_time'], succeeded))
+            }
+        return stats
+
+    @classmethod
+    def describe(cls, values):
+        """
+        Return mean, standard deviation, minimum and maximum of values. Every statistic is None if values is empty
+        """
+        if len(values) == 0:
+            return {'mean': None, 'std': None, 'min': None, 'max': None}
+        mean = sum(values) / float(len(values))
+        return {
+            'mean': mean,
+            'std': math.sqrt(sum((v - mean) ** 2 for v in values) / float(len(values))),
+            'min': min(values),
+            'max': max(values)
+        }
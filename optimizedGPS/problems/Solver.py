@@ -4,23 +4,65 @@ We merge here every steps of the solving procedure:
    2. Separate the problem considering the drivers' graph
    3. Use an algorithm
 """
+import logging
+import multiprocessing
 import sys
 
-from optimizedGPS.problems.PreSolver import HorizonPresolver, SafetyIntervalsPresolver
-from optimizedGPS.problems.Problem import Problem
+from optimizedGPS.problems.PreSolver import HorizonPresolver, SafetyIntervalsPresolver, GlobalPreSolver, \
+    GraphReductionPresolver
+from optimizedGPS.problems.PresolveCache import PresolveCache
+from optimizedGPS.problems.Problem import Problem, SolvinType
 from optimizedGPS import options
 
+log = logging.getLogger(__name__)
+
+# Read-only data shared by the worker processes solving the independent sets of drivers.
+# Set once per worker by `_initialize_worker`.
+_shared = {}
+
+
+def _initialize_worker(solver):
+    """
+    The workers are forked: the solver, and its graph and drivers_structure, are inherited and never pickled
+    """
+    _shared['solver'] = solver
+
+
+def _solve_shared_component(i):
+    return i, _shared['solver'].solve_component(_shared['solver'].components[i])
+
 
 class Solver(Problem):
     DEFAULT_PRESOLVERS = {"HorizonPresolver"}
 
     def __init__(self, graph, drivers_graph, algorithm, drivers_structure=None, presolvers=None, timeout=sys.maxint,
-                 horizon=options.HORIZON, **kwargs):
+                 horizon=options.HORIZON, presolve_processes=1, decompose=False, decomposition_processes=1, cache=None,
+                 refine_horizon=False, **kwargs):
+        """
+        :param presolve_processes: number of processes used by the presolvers
+        :param cache: PresolveCache instance. If given, the presolvers' results are read from it when this instance
+                      has already been presolved, and stored in it otherwise
+        :param refine_horizon: if True, HorizonPresolver refines its analytic bound by solving RealGPS
+        :param decompose: if True, the drivers are separated into independent sets after presolving, and algorithm
+                          solves each of them separately
+        :param decomposition_processes: number of processes solving the independent sets. If None, the number of cpus
+        """
         super(Solver, self).__init__(graph, drivers_graph, drivers_structure=drivers_structure, timeout=timeout,
                                      horizon=horizon)
         self.presolvers = presolvers if presolvers is not None else self.DEFAULT_PRESOLVERS
-        self.algorithm = algorithm(graph=graph, drivers_graph=drivers_graph, drivers_structure=self.drivers_structure,
-                                   horizon=horizon, timeout=timeout, **kwargs)
+        self.presolve_processes = presolve_processes
+        self.decompose = decompose
+        self.decomposition_processes = decomposition_processes or multiprocessing.cpu_count()
+        self.cache = cache
+        self.refine_horizon = refine_horizon
+        self.components = None  # independent sets of drivers, if decomposed
+        self.reduction = None  # GraphReductionPresolver, if the algorithm is run on a reduced graph
+        self.algorithm_class, self.algorithm_kwargs = algorithm, kwargs
+        self.algorithm = self.build_algorithm(graph, drivers_graph)
+
+    def build_algorithm(self, graph, drivers_graph):
+        return self.algorithm_class(graph=graph, drivers_graph=drivers_graph, drivers_structure=self.drivers_structure,
+                                    horizon=self.horizon, timeout=self.timeout, **self.algorithm_kwargs)
 
     def presolve(self):
         """
@@ -29,24 +71,115 @@ class Solver(Problem):
             2- determine safety and presence intervals for each driver
             3- separate drivers into smaller independent sets of drivers if possible
         """
-        if HorizonPresolver.__name__ in self.presolvers:
-            presolver = HorizonPresolver(self.graph, self.drivers_graph, self.drivers_structure,
-                                         horizon=self.horizon)
-            presolver.solve()
-            self.set_horizon(min(presolver.get_horizon(), self.horizon))
+        key, state = None, None
+        if self.cache is not None:
+            key = self.cache.get_key(self.graph, self.drivers_graph, self.drivers_structure, self.presolvers,
+                                     self.horizon, settings={'refine_horizon': self.refine_horizon})
+            state = self.cache.load(key)
+
+        if state is not None:
+            PresolveCache.set_state(self.drivers_structure, self.graph, self.drivers_graph, state, 'graph_')
+            self.set_horizon(self.drivers_structure.horizon)
+        else:
+            if HorizonPresolver.__name__ in self.presolvers:
+                presolver = HorizonPresolver(self.graph, self.drivers_graph, self.drivers_structure,
+                                             horizon=self.horizon, refine=self.refine_horizon)
+                presolver.solve()
+                self.set_horizon(min(presolver.get_horizon(), self.horizon))
+
+            if GlobalPreSolver.__name__ in self.presolvers:
+                presolver = GlobalPreSolver(self.graph, self.drivers_graph, self.drivers_structure,
+                                            horizon=self.horizon)
+                presolver.solve()
 
         self.algorithm.set_horizon(self.horizon)
 
-        if SafetyIntervalsPresolver.__name__ in self.presolvers:
-            presolver = SafetyIntervalsPresolver(self.graph, self.drivers_graph, self.drivers_structure,
-                                                 horizon=self.horizon)
-            presolver.solve()
+        if GraphReductionPresolver.__name__ in self.presolvers:
+            # the algorithm is now run on the reduced graph, and its solution mapped back to graph
+            # the reachable edges were read from the cache, or already computed by GlobalPreSolver
+            presolved = state is not None or GlobalPreSolver.__name__ in self.presolvers
+            self.reduction = GraphReductionPresolver(self.graph, self.drivers_graph, self.drivers_structure,
+                                                     horizon=self.horizon, presolved=presolved)
+            self.reduction.solve()
+            self.drivers_structure = self.reduction.get_reduced_drivers_structure()
+            self.algorithm = self.build_algorithm(self.reduction.get_reduced_graph(), self.drivers_graph)
+            log.info("graph reduced from %s to %s edges", self.graph.number_of_edges(),
+                     self.algorithm.graph.number_of_edges())
+
+        if state is not None:
+            PresolveCache.set_state(self.drivers_structure, self.algorithm.graph, self.drivers_graph, state,
+                                    'algorithm_')
+        else:
+            if SafetyIntervalsPresolver.__name__ in self.presolvers:
+                presolver = SafetyIntervalsPresolver(self.algorithm.graph, self.drivers_graph, self.drivers_structure,
+                                                     horizon=self.horizon, processes=self.presolve_processes)
+                presolver.solve()
+            if key is not None:
+                # the state of graph before its reduction, and the one given to the algorithm
+                state = PresolveCache.get_state(self.reduction.drivers_structure if self.reduction is not None
+                                                else self.drivers_structure, self.graph, self.drivers_graph, 'graph_')
+                state.update(PresolveCache.get_state(self.drivers_structure, self.algorithm.graph,
+                                                     self.drivers_graph, 'algorithm_'))
+                self.cache.save(key, state)
+
+        if self.decompose:
+            interactions = self.drivers_structure.compute_drivers_interactions()
+            self.components = self.drivers_graph.get_independent_drivers()
+            log.info("%s drivers separated into %s independent sets (%s interactions), the largest one has %s drivers",
+                     self.drivers_graph.number_of_drivers(), len(self.components), interactions,
+                     len(self.components[0]) if self.components else 0)
+
+    @classmethod
+    def solve_algorithm(cls, algorithm):
+        if algorithm.solving_type == SolvinType.HEURISTIC:
+            algorithm.solve_with_heuristic()
+        else:
+            algorithm.build_model()
+            algorithm.solve_with_solver()
+
+    def solve_component(self, drivers):
+        """
+        Solve the problem restricted to drivers with a new instance of the algorithm
+
+        :return: the path of each driver
+        """
+        algorithm = self.build_algorithm(self.algorithm.graph, self.drivers_graph.get_sub_drivers_graph(drivers))
+        self.solve_algorithm(algorithm)
+        solution = dict(algorithm.iter_optimal_solution())
+        return [solution.get(driver, ()) for driver in drivers]
+
+    def iter_solved_components(self):
+        """
+        Solve every independent set of drivers, in parallel if several processes are allowed, and yield the set's
+        index and the path of each of its drivers as soon as it is solved
+        """
+        processes = min(self.decomposition_processes, len(self.components))
+        if processes <= 1:
+            for i, drivers in enumerate(self.components):
+                yield i, self.solve_component(drivers)
+            return
+        pool = multiprocessing.Pool(processes=processes, initializer=_initialize_worker, initargs=(self,))
+        try:
+            for i, paths in pool.imap_unordered(_solve_shared_component, xrange(len(self.components))):
+                yield i, paths
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
     def solve_with_solver(self):
         self.presolve()
-        self.algorithm.build_model()
-        self.algorithm.solve_with_solver()
         self.opt_solution = {}
-        for driver, path in self.algorithm.iter_optimal_solution():
-            self.set_optimal_path_to_driver(driver, path)
+        if self.components is not None and len(self.components) > 1:
+            for i, paths in self.iter_solved_components():
+                for driver, path in zip(self.components[i], paths):
+                    self.set_optimal_path_to_driver(driver, path)
+        else:
+            self.solve_algorithm(self.algorithm)
+            for driver, path in self.algorithm.iter_optimal_solution():
+                self.set_optimal_path_to_driver(driver, path)
+        if self.reduction is not None:
+            self.opt_solution = self.reduction.map_solution(self.opt_solution)
         self.set_status(options.SUCCESS)
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Solver backends of Model.
+
+The models are written against the part of gurobipy's interface they need: addVar, addConstr, addMConstr, chgCoeff,
+setObjective, optimize, and the attributes X, RC, Pi, Sense and ObjVal. Two backends implement it:
+   - gurobi: gurobipy.Model itself
+   - highs: HighsModel, which stores the problem as sparse matrices and solves it with scipy's HiGHS interface,
+     scipy.optimize.milp for mixed integer problems, scipy.optimize.linprog for continuous ones. Only the continuous
+     problems have dual values and reduced costs, as with gurobi.
+     milp and linprog's HiGHS methods need scipy >= 1.9, which doesn't support Python 2: this package being Python 2
+     only, HighsModel can build and export models here (see get_matrix) but can't solve them until it is ported to
+     Python 3.
+
+GRB, quicksum and Var should be imported from this module rather than from gurobipy: they work with both backends.
+With gurobipy installed, the sum of an empty iterable is a gurobipy expression: HighsModel reads it as a constant.
+"""
+import logging
+import numbers
+import time
+
+import numpy as np
+
+try:
+    import gurobipy as gb
+    from gurobipy import GurobiError
+except ImportError:
+    gb, GurobiError = None, None
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+try:
+    from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+except ImportError:
+    Bounds, LinearConstraint, linprog, milp = None, None, None, None
+
+__all__ = ["GRB", "Var", "quicksum", "HighsModel", "new_model", "get_default_backend", "is_available"]
+
+log = logging.getLogger(__name__)
+
+GUROBI = 'gurobi'
+HIGHS = 'highs'
+BACKENDS = (GUROBI, HIGHS)
+
+
+class _GRB(object):
+    """ The constants of gurobipy.GRB used by the models, with the same values """
+    BINARY, CONTINUOUS, INTEGER = 'B', 'C', 'I'
+    LESS_EQUAL, GREATER_EQUAL, EQUAL = '<', '>', '='
+    MINIMIZE, MAXIMIZE = 1, -1
+    INFINITY = 1e100
+    LOADED, OPTIMAL, INFEASIBLE, UNBOUNDED, TIME_LIMIT, NUMERIC = 1, 2, 3, 5, 9, 12
+    SOS_TYPE1, SOS_TYPE2 = 1, 2
+
+    class Attr(object):
+        X, RC, Pi, Sense, ObjVal, Start = 'X', 'RC', 'Pi', 'Sense', 'ObjVal', 'Start'
+
+    class Callback(object):
+        MIPSOL, RUNTIME, MIPSOL_OBJ = 4, 1000, 4001
+
+
+GRB = gb.GRB if gb is not None else _GRB
+
+# errors raised when reading an attribute which is not available, for instance before solving
+SOLVER_ERRORS = (AttributeError, GurobiError) if gb is not None else (AttributeError,)
+
+
+def is_available(backend):
+    """
+    Return True if backend can solve problems here
+    """
+    if backend == GUROBI:
+        return gb is not None
+    if backend == HIGHS:
+        return milp is not None and sparse is not None
+    return False
+
+
+def get_default_backend():
+    """
+    gurobi if gurobipy is installed, highs otherwise
+    """
+    return GUROBI if gb is not None else HIGHS
+
+
+def new_model(backend=None):
+    """
+    :param backend: one of BACKENDS. If None, see get_default_backend
+    :return: an empty model of backend
+    """
+    backend = backend or get_default_backend()
+    if backend not in BACKENDS:
+        message = "Unknown solver backend %s, should be one of %s" % (backend, ", ".join(BACKENDS))
+        log.error(message)
+        raise ValueError(message)
+    if backend == GUROBI:
+        if gb is None:
+            message = "gurobipy is required by the gurobi backend"
+            log.error(message)
+            raise ImportError(message)
+        return gb.Model()
+    return HighsModel()
+
+
+def _is_empty_gurobi_expression(value):
+    return gb is not None and isinstance(value, gb.LinExpr) and value.size() == 0
+
+
+class LinearOperand(object):
+    """
+    Arithmetic shared by Variable and LinearExpression: every operation returns a new LinearExpression,
+    and the comparisons return a TempConstraint
+    """
+    __slots__ = ()
+
+    def to_expression(self):
+        """
+        Return a new LinearExpression equal to self
+        """
+        raise NotImplementedError()
+
+    def __add__(self, other):
+        return self.to_expression().add(other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self.to_expression().add(other, -1)
+
+    def __rsub__(self, other):
+        return self.to_expression().multiply(-1).add(other)
+
+    def __mul__(self, other):
+        return self.to_expression().multiply(other)
+
+    __rmul__ = __mul__
+
+    def __div__(self, other):
+        return self.to_expression().multiply(1. / other)
+
+    __truediv__ = __div__
+
+    def __neg__(self):
+        return self.to_expression().multiply(-1)
+
+    def __le__(self, other):
+        return TempConstraint(self.to_expression().add(other, -1), _GRB.LESS_EQUAL)
+
+    def __ge__(self, other):
+        return TempConstraint(self.to_expression().add(other, -1), _GRB.GREATER_EQUAL)
+
+    def __eq__(self, other):
+        return TempConstraint(self.to_expression().add(other, -1), _GRB.EQUAL)
+
+    __hash__ = object.__hash__
+
+
+class LinearExpression(LinearOperand):
+    """
+    constant + sum of coefficient * variable, the variables being stored by index
+    """
+    __slots__ = ('terms', 'constant')
+
+    def __init__(self, terms=None, constant=0.0):
+        """
+        :param terms: dictionary variable's index -> coefficient
+        """
+        self.terms = terms if terms is not None else {}
+        self.constant = constant
+
+    def to_expression(self):
+        return LinearExpression(dict(self.terms), self.constant)
+
+    def add(self, value, factor=1):
+        """
+        Add in place factor * value, and return self
+        """
+        if isinstance(value, Variable):
+            self.terms[value.index] = self.terms.get(value.index, 0) + factor
+        elif isinstance(value, LinearExpression):
+            for index, coefficient in value.terms.iteritems():
+                self.terms[index] = self.terms.get(index, 0) + factor * coefficient
+            self.constant += factor * value.constant
+        elif isinstance(value, numbers.Number):
+            self.constant += factor * value
+        elif _is_empty_gurobi_expression(value):
+            self.constant += factor * value.getConstant()
+        else:
+            message = "Unsupported operand in a linear expression: %s" % type(value)
+            log.error(message)
+            raise TypeError(message)
+        return self
+
+    def multiply(self, value):
+        """
+        Multiply in place by the number value, and return self
+        """
+        if not isinstance(value, numbers.Number):
+            message = "Only numbers can multiply a linear expression, not %s" % type(value)
+            log.error(message)
+            raise TypeError(message)
+        for index in self.terms:
+            self.terms[index] *= value
+        self.constant *= value
+        return self
+
+    def size(self):
+        return len(self.terms)
+
+    def getConstant(self):
+        return self.constant
+
+    def getValue(self, solution):
+        """
+        :param solution: value of every variable (array)
+        """
+        return self.constant + sum(coefficient * solution[index] for index, coefficient in self.terms.iteritems())
+
+
+class Variable(LinearOperand):
+    __slots__ = ('model', 'index', 'VarName', 'Start')
+
+    def __init__(self, model, index, name):
+        self.model = model
+        self.index = index
+        self.VarName = name
+        self.Start = None  # value in the MIP start, None if undefined
+
+    def to_expression(self):
+        return LinearExpression({self.index: 1.0})
+
+    @property
+    def X(self):
+        return self.model.get_solution_value('X', self.index)
+
+    @property
+    def RC(self):
+        return self.model.get_solution_value('RC', self.index)
+
+    def getAttr(self, name):
+        return getattr(self, name)
+
+    def __repr__(self):
+        return "<Variable %s>" % self.VarName
+
+
+class TempConstraint(object):
+    """
+    expression (sense) 0, as returned by the comparisons of LinearOperand
+    """
+    __slots__ = ('expression', 'sense')
+
+    def __init__(self, expression, sense):
+        self.expression = expression
+        self.sense = sense
+
+
+class Constraint(object):
+    """
+    Row of HighsModel: sum of terms (sense) rhs
+    """
+    __slots__ = ('model', 'index', 'terms', 'Sense', 'RHS', 'ConstrName')
+
+    def __init__(self, model, index, terms, sense, rhs, name):
+        self.model = model
+        self.index = index
+        self.terms = terms
+        self.Sense = sense
+        self.RHS = rhs
+        self.ConstrName = name
+
+    @property
+    def Pi(self):
+        return self.model.get_solution_value('Pi', self.index)
+
+    def getAttr(self, name):
+        return getattr(self, name)
+
+    def __repr__(self):
+        return "<Constraint %s>" % self.ConstrName
+
+
+# gurobi's variables, or the highs ones
+Var = (gb.Var, Variable) if gb is not None else Variable
+
+
+def quicksum(iterable):
+    """
+    Sum of linear operands and numbers (see gurobipy.quicksum)
+    """
+    items = list(iterable)
+    if gb is not None and not any(isinstance(item, LinearOperand) for item in items):
+        return gb.quicksum(items)
+    expression = LinearExpression()
+    for item in items:
+        expression.add(item)
+    return expression
+
+
+class HighsModel(object):
+    """
+    Subset of gurobipy.Model solved with HiGHS:
+
+    >>> model = HighsModel()
+    >>> x, y = model.addVar(vtype=GRB.BINARY, name="x"), model.addVar(vtype=GRB.BINARY, name="y")
+    >>> constraint = model.addConstr(x + y >= 1, "cover")
+    >>> model.setObjective(2 * x + 3 * y, GRB.MINIMIZE)
+    >>> model.optimize()  # doctest: +SKIP
+    >>> model.ObjVal, x.X  # doctest: +SKIP
+    (2.0, 1.0)
+    """
+    # tolerance under which a variable's value is read as 0
+    ZERO = 1e-9
+
+    def __init__(self):
+        self.variables, self.lower_bounds, self.upper_bounds, self.vtypes = [], [], [], []
+        self.constraints = []
+        self.objective, self.ModelSense = LinearExpression(), _GRB.MINIMIZE
+        self.params = {'TimeLimit': float('inf'), 'MIPGap': 1e-4, 'LogToConsole': 0}
+        self.Status = _GRB.LOADED
+        self.Runtime = 0
+        self.solution = None  # name -> array, for X, RC and Pi
+
+    @property
+    def NumVars(self):
+        return len(self.variables)
+
+    @property
+    def NumConstrs(self):
+        return len(self.constraints)
+
+    @property
+    def SolCount(self):
+        return 1 * (self.solution is not None)
+
+    @property
+    def ObjVal(self):
+        if self.solution is None:
+            raise AttributeError("Unable to retrieve attribute 'ObjVal': the model has no solution")
+        return self.objective.getValue(self.solution['X'])
+
+    def setParam(self, name, value):
+        """
+        TimeLimit, MIPGap and LogToConsole are given to HiGHS, the other parameters are ignored
+        """
+        if name not in self.params:
+            log.debug("parameter %s is ignored by the highs backend", name)
+        self.params[name] = value
+
+    def update(self):
+        """
+        The variables and constraints are available as soon as they are added
+        """
+        pass
+
+    def addVar(self, lb=0.0, ub=_GRB.INFINITY, obj=0.0, vtype=_GRB.CONTINUOUS, name=''):
+        variable = Variable(self, len(self.variables), name)
+        self.variables.append(variable)
+        self.lower_bounds.append(lb)
+        self.upper_bounds.append(ub)
+        self.vtypes.append(vtype)
+        if obj != 0:
+            self.objective.add(variable, obj)
+        return variable
+
+    def add_row(self, terms, sense, rhs, name):
+        constraint = Constraint(self, len(self.constraints), terms, sense, rhs, name)
+        self.constraints.append(constraint)
+        return constraint
+
+    def addConstr(self, constraint, name=''):
+        """
+        :param constraint: comparison of linear expressions
+        """
+        if not isinstance(constraint, TempConstraint):
+            message = "Constraint %s is not a comparison of linear expressions" % name
+            log.error(message)
+            raise TypeError(message)
+        expression = constraint.expression
+        return self.add_row(expression.terms, constraint.sense, - expression.constant, name)
+
+    def addMConstr(self, A, x, sense, b, name=''):
+        """
+        Add the constraints A * x (sense) b
+
+        :param A: scipy.sparse matrix
+        :param x: list of variables, one per column of A
+        :param sense: sense of every row, or one sense for all of them
+        :param b: right hand side of every row
+        :return: list of constraints
+        """
+        matrix = sparse.csr_matrix(A)
+        columns = np.array([variable.index for variable in x], dtype=np.int64)
+        senses = np.broadcast_to(np.asarray(sense), (matrix.shape[0],))
+        constraints = []
+        for row in xrange(matrix.shape[0]):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            terms = dict(zip(columns[matrix.indices[start:end]].tolist(), matrix.data[start:end].tolist()))
+            constraints.append(self.add_row(terms, str(senses[row]), float(b[row]), name))
+        return constraints
+
+    def getAttr(self, name, objects):
+        return [getattr(obj, name) for obj in objects]
+
+    def setAttr(self, name, objects, values):
+        for obj, value in zip(objects, values):
+            setattr(obj, name, value)
+
+    def chgCoeff(self, constraint, variable, value):
+        if value == 0:
+            constraint.terms.pop(variable.index, None)
+        else:
+            constraint.terms[variable.index] = value
+
+    def setObjective(self, expression, sense=None):
+        self.objective = LinearExpression().add(expression)
+        if sense is not None:
+            self.ModelSense = sense
+
+    def get_matrix(self):
+        """
+        :return: the constraints' matrix (csr), one row per constraint and one column per variable,
+                 the senses and the right hand sides of the rows
+        """
+        rows, columns, values = [], [], []
+        for constraint in self.constraints:
+            rows.extend([constraint.index] * len(constraint.terms))
+            columns.extend(constraint.terms.iterkeys())
+            values.extend(constraint.terms.itervalues())
+        matrix = sparse.coo_matrix((values, (rows, columns)), shape=(len(self.constraints), len(self.variables)))
+        senses = np.array([constraint.Sense for constraint in self.constraints], dtype='S1')
+        rhs = np.array([constraint.RHS for constraint in self.constraints], dtype=np.float64)
+        return matrix.tocsr(), senses, rhs
+
+    def get_costs(self):
+        costs = np.zeros(len(self.variables))
+        for index, coefficient in self.objective.terms.iteritems():
+            costs[index] = coefficient
+        return costs
+
+    def get_bounds(self):
+        lower_bounds = np.array(self.lower_bounds, dtype=np.float64)
+        upper_bounds = np.array(self.upper_bounds, dtype=np.float64)
+        upper_bounds[upper_bounds >= _GRB.INFINITY] = np.inf
+        lower_bounds[lower_bounds <= - _GRB.INFINITY] = - np.inf
+        binaries = np.array([vtype == _GRB.BINARY for vtype in self.vtypes], dtype=bool)
+        lower_bounds[binaries] = np.maximum(lower_bounds[binaries], 0)
+        upper_bounds[binaries] = np.minimum(upper_bounds[binaries], 1)
+        return lower_bounds, upper_bounds
+
+    def get_solution_value(self, name, index):
+        if self.solution is None or name not in self.solution:
+            raise AttributeError("Unable to retrieve attribute '%s'" % name)
+        return self.solution[name][index].item()
+
+    def optimize(self, callback=None):
+        """
+        The callback is never called, and scipy's milp doesn't take MIP starts: the variables' Start are ignored
+        """
+        if not is_available(HIGHS):
+            message = "scipy >= 1.9, which requires Python 3, is needed to solve with the highs backend"
+            log.error(message)
+            raise ImportError(message)
+        ct = time.time()
+        matrix, senses, rhs = self.get_matrix()
+        costs = self.get_costs() * self.ModelSense  # HiGHS minimises
+        lower_bounds, upper_bounds = self.get_bounds()
+        integrality = np.array([vtype != _GRB.CONTINUOUS for vtype in self.vtypes], dtype=np.int64)
+        if any(variable.Start is not None for variable in self.variables):
+            log.info("highs: the MIP start is ignored")
+
+        if integrality.any():
+            result = self.solve_mip(matrix, senses, rhs, costs, lower_bounds, upper_bounds, integrality)
+        else:
+            result = self.solve_lp(matrix, senses, rhs, costs, lower_bounds, upper_bounds)
+        self.Runtime = time.time() - ct
+        self.Status = {0: _GRB.OPTIMAL, 1: _GRB.TIME_LIMIT, 2: _GRB.INFEASIBLE, 3: _GRB.UNBOUNDED}.get(
+            result.status, _GRB.NUMERIC)
+        log.info("highs: %s in %s seconds", result.message, self.Runtime)
+
+    def get_options(self):
+        options = {'disp': bool(self.params['LogToConsole'])}
+        if self.params['TimeLimit'] < float('inf'):
+            options['time_limit'] = float(self.params['TimeLimit'])
+        return options
+
+    def solve_mip(self, matrix, senses, rhs, costs, lower_bounds, upper_bounds, integrality):
+        lower_rows = np.where(senses == _GRB.LESS_EQUAL, - np.inf, rhs)
+        upper_rows = np.where(senses == _GRB.GREATER_EQUAL, np.inf, rhs)
+        options = self.get_options()
+        options['mip_rel_gap'] = self.params['MIPGap']
+        result = milp(costs, integrality=integrality, bounds=Bounds(lower_bounds, upper_bounds),
+                      constraints=[LinearConstraint(matrix, lower_rows, upper_rows)] if len(rhs) > 0 else None,
+                      options=options)
+        self.solution = None
+        if result.x is not None:
+            x = np.where(integrality > 0, np.round(result.x), result.x)
+            x[np.abs(x) < self.ZERO] = 0
+            self.solution = {'X': x}
+        return result
+
+    def solve_lp(self, matrix, senses, rhs, costs, lower_bounds, upper_bounds):
+        """
+        The '>' rows are given to linprog as '<' rows multiplied by -1. The dual values and the reduced costs follow
+        gurobi's conventions: Pi is the derivative of the objective along the row's right hand side, and
+        RC = c - A' * Pi
+        """
+        equal = senses == _GRB.EQUAL
+        signs = np.where(senses == _GRB.GREATER_EQUAL, -1., 1.)
+        upper = sparse.diags(signs[~equal]).dot(matrix[~equal]) if (~equal).any() else None
+        result = linprog(
+            costs, A_ub=upper, b_ub=(signs * rhs)[~equal] if upper is not None else None,
+            A_eq=matrix[equal] if equal.any() else None, b_eq=rhs[equal] if equal.any() else None,
+            bounds=np.column_stack((lower_bounds, upper_bounds)), method='highs', options=self.get_options()
+        )
+        self.solution = None
+        if result.status == 0:
+            x = np.array(result.x)
+            x[np.abs(x) < self.ZERO] = 0
+            duals = np.zeros(len(rhs))
+            if upper is not None:
+                duals[~equal] = signs[~equal] * result.ineqlin.marginals
+            if equal.any():
+                duals[equal] = result.eqlin.marginals
+            duals *= self.ModelSense
+            self.solution = {'X': x, 'Pi': duals, 'RC': self.get_costs() - matrix.T.dot(duals)}
+        return result
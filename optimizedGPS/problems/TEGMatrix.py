@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Sparse matrix assembly of TEGModel's constraints.
+
+The variables are enumerated once: the column of a variable is its position in `keys`. Each family of constraints
+(see labels.CONSTRAINTS) is assembled as coordinates (rows, columns, values), the sense and the right hand side of
+each row, and the name TEGModel.build_constraints would give to each row, so that the constraints can be added in
+bulk to the solver.
+
+A linear congestion function is f(traffic) = f(0) + (f(1) - f(0)) * traffic. The other ones are given with the
+variables of their piecewise linear approximations (see PiecewiseLinearFunction.iter_rows): these variables are
+columns after TEGModel's variables, and the rows defining them are assembled as the other families.
+The unicity and waiting time constraints are only built for the (driver, edge) and starting times having a
+variable: the other ones are always satisfied.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+import labels
+
+__all__ = ["TEGMatrix"]
+
+log = logging.getLogger(__name__)
+
+
+class ConstraintsFamily(object):
+    """ Rows of one family of constraints """
+    LESS_EQUAL = '<'
+    GREATER_EQUAL = '>'
+    EQUAL = '='
+
+    def __init__(self, label, shape, rows, columns, values, senses, rhs, names, build_time):
+        self.label = label
+        self.shape = shape
+        self.rows = rows
+        self.columns = columns
+        self.values = values
+        self.senses = senses
+        self.rhs = rhs
+        self.names = names
+        self.build_time = build_time
+
+    def number_of_rows(self):
+        return self.shape[0]
+
+    def number_of_nonzeros(self):
+        return len(self.values)
+
+    def get_matrix(self):
+        """
+        Return the matrix of the family as a scipy.sparse csr matrix
+        """
+        if sparse is None:
+            message = "scipy is required to build sparse matrices"
+            log.error(message)
+            raise ImportError(message)
+        return sparse.coo_matrix((self.values, (self.rows, self.columns)), shape=self.shape).tocsr()
+
+    def evaluate(self, solution):
+        """
+        :param solution: value of each variable (array of size number of variables)
+        :return: value of the left hand side of each row
+        """
+        lhs = np.zeros(self.shape[0])
+        np.add.at(lhs, self.rows, self.values * solution[self.columns])
+        return lhs
+
+    def get_violated_rows(self, solution, tolerance=1e-6):
+        """
+        Return the indexes of the rows which are not satisfied by solution
+        """
+        lhs = self.evaluate(solution)
+        violated = np.where(self.senses == self.LESS_EQUAL, lhs > self.rhs + tolerance,
+                            np.where(self.senses == self.GREATER_EQUAL, lhs < self.rhs - tolerance,
+                                     np.abs(lhs - self.rhs) > tolerance))
+        return np.flatnonzero(violated)
+
+
+class TEGMatrix(object):
+    """
+    >>> matrix = TEGMatrix(graph, drivers_graph, drivers_structure, model.x, model.bigM())  # doctest: +SKIP
+    >>> matrix.build()  # doctest: +SKIP
+    >>> matrix.families[labels.TRANSFERT].get_matrix()  # doctest: +SKIP
+    >>> matrix.get_statistics()  # doctest: +SKIP
+    """
+    def __init__(self, graph, drivers_graph, drivers_structure, variables, big_m, congestion=None, formulation=None):
+        """
+        :param variables: TEGVariables instance
+        :param big_m: see TEGModel.bigM
+        :param congestion: dictionary (edge, time) -> (piecewise linear approximation, its variables), for every edge
+                           whose congestion function isn't linear and starting time of a variable on it
+        :param formulation: formulation of the approximations, see PiecewiseLinearFunction.FORMULATIONS
+        """
+        self.graph = graph
+        self.drivers_graph = drivers_graph
+        self.drivers_structure = drivers_structure
+        self.x = variables
+        self.big_m = big_m
+        self.congestion = congestion or {}
+        self.formulation = formulation
+
+        self.keys, self.variables = [], []
+        for key, variable in variables.iteritems():
+            self.keys.append(key)
+            self.variables.append(variable)
+        self.columns = {key: column for column, key in enumerate(self.keys)}
+        # (edge, time) -> column of the first variable of the approximation at time
+        self.congestion_columns = {}
+        for key, (_, congestion_variables) in self.congestion.iteritems():
+            self.congestion_columns[key] = len(self.variables)
+            self.variables.extend(congestion_variables)
+        self.drivers = list(drivers_graph.get_all_drivers())
+        self.families = OrderedDict()
+
+    def number_of_variables(self):
+        return len(self.variables)
+
+    def add_family(self, label, entries, senses, rhs, names, ct):
+        """
+        :param entries: list of (row, column, value)
+        :param senses, rhs, names: for each row
+        :param ct: time at which the family's building started
+        """
+        rows, columns, values = zip(*entries) if entries else ((), (), ())
+        self.families[label] = ConstraintsFamily(
+            label, (len(names), len(self.variables)),
+            np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64), np.array(values, dtype=np.float64),
+            np.array(senses, dtype='S1'), np.array(rhs, dtype=np.float64), names, time.time() - ct
+        )
+
+    def get_linear_congestion(self, edge):
+        """
+        Return f(0) and f(1) - f(0), where f is the congestion function of edge
+        """
+        func = self.graph.get_congestion_function(*edge)
+        if func(2) - 2 * func(1) + func(0) != 0:
+            log.warning("the congestion function of edge %s is not linear: it is linearised between 0 and 1",
+                        str(edge))
+        return func(0), func(1) - func(0)
+
+    def build_ending_constraints(self):
+        """
+        Every driver reaches his end at one of his possible ending times, and doesn't leave it
+        """
+        ct = time.time()
+        ending_times = {
+            driver: self.drivers_structure.get_possible_ending_times_on_node(driver, driver.end) or ()
+            for driver in self.drivers
+        }
+        rows = {driver: row for row, driver in enumerate(self.drivers)}
+        # the ending times are shared by both families: the time spent computing them is counted in both
+        build_time = time.time() - ct
+        for label, leaving in ((labels.ENDING_TIME, False), (labels.ENDING_NODE, True)):
+            ct = time.time() - build_time
+            entries = [
+                (rows[driver], column, 1) for column, (driver, edge, start, end) in enumerate(self.keys)
+                if edge[1 - leaving] == driver.end and (start if leaving else end) in ending_times[driver]
+            ]
+            names = ["%s:%s" % (label, id(driver)) for driver in self.drivers]
+            self.add_family(label, entries, [ConstraintsFamily.EQUAL] * len(names), [1 - leaving] * len(names),
+                            names, ct)
+
+    def build_transfert_constraints(self):
+        """
+        On every node but his end, a driver leaves the node at the time he reaches it
+        """
+        ct = time.time()
+        rows, names, rhs = {}, [], []
+        for driver in self.drivers:
+            for node in self.graph.nodes_iter():
+                if node != driver.end:
+                    for i in sorted(set(self.drivers_structure.iter_possible_time_on_node(driver, node))):
+                        rows[driver, node, i] = len(names)
+                        names.append("%s:%s:%s:%s" % (labels.TRANSFERT, id(driver), str(node), i))
+                        rhs.append(1 * (node == driver.start and i == driver.time))
+        entries = []
+        for column, (driver, edge, start, end) in enumerate(self.keys):
+            if (driver, edge[0], start) in rows:
+                entries.append((rows[driver, edge[0], start], column, 1))
+            if (driver, edge[1], end) in rows:
+                entries.append((rows[driver, edge[1], end], column, -1))
+        self.add_family(labels.TRANSFERT, entries, [ConstraintsFamily.EQUAL] * len(names), rhs, names, ct)
+
+    def build_unicity_constraints(self):
+        """
+        A driver drives at most once on an edge
+        """
+        ct = time.time()
+        rows, names, entries = {}, [], []
+        for column, (driver, edge, _, _) in enumerate(self.keys):
+            if (driver, edge) not in rows:
+                rows[driver, edge] = len(names)
+                names.append("%s:%s:%s" % (labels.EDGE_TIME_UNICITY, id(driver), str(edge)))
+            entries.append((rows[driver, edge], column, 1))
+        self.add_family(labels.EDGE_TIME_UNICITY, entries, [ConstraintsFamily.LESS_EQUAL] * len(names),
+                        [1] * len(names), names, ct)
+
+    def build_waiting_time_constraints(self):
+        """
+        A driver entering an edge at i waits on it the congestion function of the traffic at i:
+            waiting time <= f(traffic) and waiting time + bigM * (1 - x) >= f(traffic)
+        They are named as in TEGModel.build_constraints
+        """
+        for label, sense in ((labels.LOWER_WAITING_TIME, ConstraintsFamily.LESS_EQUAL),
+                             (labels.UPPER_WAITING_TIME, ConstraintsFamily.GREATER_EQUAL)):
+            ct = time.time()
+            rows, names, rhs, entries = {}, [], [], []
+            congestion = {}
+            for column, (driver, edge, start, end) in enumerate(self.keys):
+                key = driver, edge, start
+                if key not in rows:
+                    rows[key] = len(names)
+                    names.append("%s:%s:%s:%s" % (label, id(driver), str(edge), start))
+                    if (edge, start) in self.congestion:
+                        # f(traffic) is the expression of the approximation's variables
+                        constant, coefficients = self.congestion[edge, start][0].get_expression(self.formulation)
+                        first = self.congestion_columns[edge, start]
+                        for k, coefficient in coefficients.iteritems():
+                            entries.append((rows[key], first + k, - coefficient))
+                    else:
+                        if edge not in congestion:
+                            congestion[edge] = self.get_linear_congestion(edge)
+                        constant = congestion[edge][0]
+                        # every driver on edge at start is in the traffic
+                        for d, s, e, _ in self.x.iter_covering(edge, start):
+                            entries.append((rows[key], self.columns[d, edge, s, e], - congestion[edge][1]))
+                    rhs.append(constant - self.big_m if sense == ConstraintsFamily.GREATER_EQUAL else constant)
+                own_value = end - start - self.big_m * (sense == ConstraintsFamily.GREATER_EQUAL)
+                entries.append((rows[key], column, own_value))
+            self.add_family(label, entries, [sense] * len(names), rhs, names, ct)
+
+    def build_congestion_constraints(self):
+        """
+        The rows defining the variables of the congestion functions' approximations, one family per label of
+        PiecewiseLinearFunction.iter_rows. They are named as in TEGModel.add_congestion_constraints
+        """
+        ct = time.time()
+        families = OrderedDict()  # label -> entries, senses, rhs, names
+        for (edge, start), (func, _) in self.congestion.iteritems():
+            first = self.congestion_columns[edge, start]
+            for label, suffix, coefficients, traffic_coefficient, sense, rhs in func.iter_rows(self.formulation):
+                entries, senses, rows_rhs, names = families.setdefault(label, ([], [], [], []))
+                row = len(names)
+                names.append(":".join([label, str(edge), str(start)] + map(str, suffix)))
+                senses.append(sense)
+                rows_rhs.append(rhs)
+                entries.extend((row, first + k, coefficient) for k, coefficient in coefficients.iteritems())
+                if traffic_coefficient != 0:
+                    for d, s, e, _ in self.x.iter_covering(edge, start):
+                        entries.append((row, self.columns[d, edge, s, e], traffic_coefficient))
+        # the families are built together: the time spent is counted in each one
+        for label, (entries, senses, rhs, names) in families.iteritems():
+            self.add_family(label, entries, senses, rhs, names, ct)
+
+    def build(self, waiting_time=True):
+        """
+        :param waiting_time: if False, the waiting time constraints, and the congestion ones, are not built
+        """
+        ct = time.time()
+        self.build_ending_constraints()
+        self.build_transfert_constraints()
+        self.build_unicity_constraints()
+        if waiting_time is True:
+            self.build_waiting_time_constraints()
+            self.build_congestion_constraints()
+        log.info("%s constraints with %s nonzeros assembled in %s seconds: %s",
+                 sum(f.number_of_rows() for f in self.families.itervalues()),
+                 sum(f.number_of_nonzeros() for f in self.families.itervalues()), time.time() - ct,
+                 self.get_statistics())
+
+    def get_solution_vector(self, columns):
+        """
+        :param columns: iterable of (driver, edge, start, end) set to 1, the other variables are 0
+        :return: array of the variables' values
+        """
+        solution = np.zeros(len(self.variables))
+        for key in columns:
+            solution[self.columns[key]] = 1
+        return solution
+
+    def get_statistics(self):
+        """
+        For each family: number of rows, of nonzeros, and time spent assembling it
+        """
+        return OrderedDict(
+            (label, {'rows': family.number_of_rows(), 'nonzeros': family.number_of_nonzeros(),
+                     'time': family.build_time})
+            for label, family in self.families.iteritems()
+        )
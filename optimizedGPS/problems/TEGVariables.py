@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Sparse storage of the variables of TEGModel.
+
+A variable is driver driving on edge from time start to time end, and is stored under
+(driver index, edge index, start, end). Drivers and edges are indexed the first time a variable is added for them.
+Secondary indexes give directly the variables a constraint needs:
+   - by (driver, edge, start): the variables of driver entering edge at start
+   - by (edge, time): the variables on edge covering time, i.e. with start < time <= end
+   - by (driver, node, time): the variables of driver leaving node at time, and the ones entering node at time
+Reading a missing variable never stores anything.
+"""
+
+__all__ = ["TEGVariables"]
+
+
+class TEGVariables(object):
+    """
+    >>> x = TEGVariables()
+    >>> x.add(driver, edge, 0, 2, var)  # doctest: +SKIP
+    >>> x.get(driver, edge, 0, 2), x.get(driver, edge, 0, 3)  # doctest: +SKIP
+    (var, 0)
+    >>> list(x.iter_covering(edge, 1))  # doctest: +SKIP
+    [(driver, 0, 2, var)]
+    """
+    def __init__(self):
+        self.drivers, self.drivers_index = [], {}
+        self.edges, self.edges_index = [], {}
+
+        self.variables = {}  # (driver index, edge index, start, end) -> variable
+        self.by_start = {}  # (driver index, edge index, start) -> {end: variable}
+        self.by_time = {}  # (edge index, time) -> list of (driver index, start, end, variable)
+        self.leaving = {}  # (driver index, node, start) -> list of variables
+        self.entering = {}  # (driver index, node, end) -> list of variables
+
+    def get_driver_index(self, driver, create=False):
+        if create is True and driver not in self.drivers_index:
+            self.drivers_index[driver] = len(self.drivers)
+            self.drivers.append(driver)
+        return self.drivers_index.get(driver)
+
+    def get_edge_index(self, edge, create=False):
+        if create is True and edge not in self.edges_index:
+            self.edges_index[edge] = len(self.edges)
+            self.edges.append(edge)
+        return self.edges_index.get(edge)
+
+    def add(self, driver, edge, start, end, variable):
+        """
+        Store variable for driver driving on edge from start to end. An existing variable is replaced
+        """
+        i, j = self.get_driver_index(driver, create=True), self.get_edge_index(edge, create=True)
+        if (i, j, start, end) in self.variables:
+            self.remove(driver, edge, start, end)
+        self.variables[i, j, start, end] = variable
+        self.by_start.setdefault((i, j, start), {})[end] = variable
+        for time in xrange(start + 1, end + 1):
+            self.by_time.setdefault((j, time), []).append((i, start, end, variable))
+        self.leaving.setdefault((i, edge[0], start), []).append(variable)
+        self.entering.setdefault((i, edge[1], end), []).append(variable)
+
+    def remove(self, driver, edge, start, end):
+        """
+        The variables are compared by identity: the solvers' variables overload ==
+        """
+        i, j = self.get_driver_index(driver), self.get_edge_index(edge)
+        variable = self.variables.pop((i, j, start, end))
+        del self.by_start[i, j, start][end]
+        for time in xrange(start + 1, end + 1):
+            self.by_time[j, time] = [entry for entry in self.by_time[j, time] if entry[:3] != (i, start, end)]
+        for index, key in ((self.leaving, (i, edge[0], start)), (self.entering, (i, edge[1], end))):
+            index[key] = [v for v in index[key] if v is not variable]
+        return variable
+
+    def has(self, driver, edge, start, end):
+        return (self.drivers_index.get(driver), self.edges_index.get(edge), start, end) in self.variables
+
+    def get(self, driver, edge, start, end, default=0):
+        """
+        Return the variable of driver on edge from start to end, default if there is none
+        """
+        return self.variables.get((self.drivers_index.get(driver), self.edges_index.get(edge), start, end), default)
+
+    def iter_ending(self, driver, edge, start):
+        """
+        Iterate the (end, variable) of driver entering edge at start
+        """
+        return self.by_start.get((self.drivers_index.get(driver), self.edges_index.get(edge), start), {}).iteritems()
+
+    def iter_covering(self, edge, time):
+        """
+        Iterate the (driver, start, end, variable) on edge such that start < time <= end
+        """
+        for i, start, end, variable in self.by_time.get((self.edges_index.get(edge), time), ()):
+            yield self.drivers[i], start, end, variable
+
+    def iter_leaving(self, driver, node, time):
+        """
+        Iterate the variables of driver entering an edge leaving node at time
+        """
+        return iter(self.leaving.get((self.drivers_index.get(driver), node, time), ()))
+
+    def iter_entering(self, driver, node, time):
+        """
+        Iterate the variables of driver leaving an edge entering node at time
+        """
+        return iter(self.entering.get((self.drivers_index.get(driver), node, time), ()))
+
+    def iteritems(self):
+        """
+        Iterate ((driver, edge, start, end), variable)
+        """
+        for (i, j, start, end), variable in self.variables.iteritems():
+            yield (self.drivers[i], self.edges[j], start, end), variable
+
+    def itervalues(self):
+        return self.variables.itervalues()
+
+    def __len__(self):
+        return len(self.variables)
@@ -3,5 +3,7 @@ from Models import TEGModel
 from simulator.Simulator import FromEdgeDescriptionSimulator
 from Algorithms import ConstantModelAlgorithm, TEGColumnGenerationAlgorithm
 from Comparator import Comparator, MultipleGraphComparator, ResultsHandler
-from PreSolver import HorizonPresolver, SafetyIntervalsPresolver
+from ScenarioEngine import ScenarioEngine
+from PresolveCache import PresolveCache
+from PreSolver import HorizonPresolver, SafetyIntervalsPresolver, GlobalPreSolver, GraphReductionPresolver
 from Heuristics import RealGPS, ShortestPathHeuristic, ShortestPathTrafficFree
@@ -25,6 +25,9 @@ UPPER_WAITING_TIME = "upper-waiting-time"
 EDGE_TIME_UNICITY = "edge_time_unicity"
 FUTURE_AFTER_PAST = "future-after-past"
 NO_INTERSECTION = "no_intersection"
+CONGESTION_TRAFFIC = "congestion-traffic"
+CONGESTION_CONVEXITY = "congestion-convexity"
+CONGESTION_ORDER = "congestion-order"
 
 DIFFERENCE_TO_SHORTEST_PATH = 'difference-to-shortest-path'
 DIFFERENCE_TO_BEST_TRAFFIC = 'difference-to-best-traffic'
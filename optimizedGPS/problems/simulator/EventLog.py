@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Columnar storage of the events of a simulation.
+
+Each visited edge of each driver is one row of four columns (driver index, edge index, entry time, exit time).
+The columns are written as .npy files in a directory, and loaded as read-only memory-mapped arrays: only the rows
+needed by a query are read from disk.
+Rows are sorted by driver then entry time. An offsets array gives for each driver the slice of his rows, and a
+second permutation (sorted by edge then entry time) gives for each edge the slice of the rows visiting it.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from optimizedGPS import options
+from optimizedGPS.structure import Driver
+
+__all__ = ["EventLog"]
+
+log = logging.getLogger(__name__)
+
+
+class EventLog(object):
+    """
+    Read-only view over the events exported from a simulator.
+    Drivers can be given either as the Driver objects of `self.drivers` or as their index.
+
+    >>> EventLog.export(simulator, "output/events")  # doctest: +SKIP
+    >>> events = EventLog.load("output/events")  # doctest: +SKIP
+    >>> events.get_traffic(edge, 4)  # doctest: +SKIP
+    """
+    # every array stored on disk: name -> dtype
+    ARRAYS = {
+        'driver': np.int64,
+        'edge': np.int64,
+        'entry': np.float64,
+        'exit': np.float64,
+        'driver_offsets': np.int64,
+        'edge_order': np.int64,
+        'edge_offsets': np.int64,
+        'starting_times': np.float64,
+        'ending_times': np.float64,
+        'weights': np.float64
+    }
+    META = "meta.json"
+
+    def __init__(self, drivers, edges, exit_nodes, arrays):
+        """
+        :param drivers: list of Driver objects. The index of a driver is its position in this list
+        :param edges: list of edges. The index of an edge is its position in this list
+        :param exit_nodes: for each driver, the node where he reached @@EXIT@@ (None if he didn't)
+        :param arrays: dictionary containing every array in ARRAYS
+        """
+        self.drivers = drivers
+        self.edges = edges
+        self.exit_nodes = exit_nodes
+        self.drivers_index = {driver: i for i, driver in enumerate(drivers)}
+        self.edges_index = {edge: i for i, edge in enumerate(edges)}
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    # ----------------------------------------------------------------------------------------
+    # ------------------------------------ WRITING -------------------------------------------
+    # ----------------------------------------------------------------------------------------
+
+    @classmethod
+    def from_simulator(cls, simulator):
+        """
+        Build the columnar arrays in memory from the simulator's events
+
+        :param simulator: Simulator instance
+        :return: EventLog instance
+        """
+        drivers = [driver for driver, path_clocks in simulator.events.iteritems() if len(path_clocks) > 0]
+        edges, edges_index = [], {}
+        rows = {'driver': [], 'edge': [], 'entry': [], 'exit': []}
+        driver_offsets, starting_times, ending_times = [0], [], []
+        exit_nodes = []
+        for i, driver in enumerate(drivers):
+            path_clocks = simulator.events[driver]
+            starting_times.append(path_clocks[0].time)
+            ending_time, exit_node = float('nan'), None
+            for j, (edge, clock) in enumerate(path_clocks):
+                if edge[-1] == options.EXIT:
+                    ending_time, exit_node = clock, edge[0]
+                    continue
+                if edge not in edges_index:
+                    edges_index[edge] = len(edges)
+                    edges.append(edge)
+                rows['driver'].append(i)
+                rows['edge'].append(edges_index[edge])
+                rows['entry'].append(clock)
+                # the driver is still on his last edge if the simulation didn't finish
+                rows['exit'].append(path_clocks[j + 1].time if j + 1 < len(path_clocks) else float('inf'))
+            driver_offsets.append(len(rows['driver']))
+            ending_times.append(ending_time)
+            exit_nodes.append(exit_node)
+
+        arrays = {name: np.array(values, dtype=cls.ARRAYS[name]) for name, values in rows.iteritems()}
+        arrays['driver_offsets'] = np.array(driver_offsets, dtype=np.int64)
+        arrays['starting_times'] = np.array(starting_times, dtype=np.float64)
+        arrays['ending_times'] = np.array(ending_times, dtype=np.float64)
+        arrays['weights'] = np.array([driver.traffic_weight for driver in drivers], dtype=np.float64)
+        # stable sort, so that the rows of an edge stay sorted by driver then by entry time
+        edge_order = np.argsort(arrays['edge'], kind='mergesort')
+        arrays['edge_order'] = edge_order.astype(np.int64)
+        arrays['edge_offsets'] = np.searchsorted(
+            arrays['edge'][edge_order], np.arange(len(edges) + 1), side='left').astype(np.int64)
+
+        return cls(drivers, edges, exit_nodes, arrays)
+
+    @classmethod
+    def export(cls, simulator, directory):
+        """
+        Write the events of simulator into directory: one .npy file per array, and a json file describing the
+        drivers and edges.
+
+        :param simulator: Simulator instance
+        :param directory: path to the directory. Created if it doesn't exist
+        :return: EventLog instance (in memory)
+        """
+        event_log = cls.from_simulator(simulator)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for name in cls.ARRAYS:
+            np.save(os.path.join(directory, "%s.npy" % name), getattr(event_log, name))
+        with open(os.path.join(directory, cls.META), "w") as f:
+            json.dump({
+                'drivers': [driver.to_tuple() for driver in event_log.drivers],
+                'edges': event_log.edges,
+                'exit_nodes': event_log.exit_nodes
+            }, f)
+        return event_log
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Load the events written by `export`. The arrays are memory-mapped and read-only by default.
+
+        :param directory: path to the directory
+        :param mmap_mode: see numpy.load
+        :return: EventLog instance
+        """
+        with open(os.path.join(directory, cls.META), "r") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, "%s.npy" % name), mmap_mode=mmap_mode)
+                  for name in cls.ARRAYS}
+        return cls(
+            [Driver(*driver) for driver in meta['drivers']],
+            [tuple(edge) for edge in meta['edges']],
+            meta['exit_nodes'],
+            arrays
+        )
+
+    # ----------------------------------------------------------------------------------------
+    # ------------------------------------ QUERIES -------------------------------------------
+    # ----------------------------------------------------------------------------------------
+
+    def get_driver_index(self, driver):
+        if isinstance(driver, (int, long, np.integer)):
+            return driver
+        if driver not in self.drivers_index:
+            message = "driver %s has not been simulated" % str(driver)
+            log.error(message)
+            raise KeyError(message)
+        return self.drivers_index[driver]
+
+    def number_of_drivers(self):
+        return len(self.drivers)
+
+    def number_of_events(self):
+        return len(self.driver)
+
+    def get_driver_rows(self, driver):
+        """
+        Return the slice of rows concerning driver
+        """
+        i = self.get_driver_index(driver)
+        return slice(int(self.driver_offsets[i]), int(self.driver_offsets[i + 1]))
+
+    def get_ending_time(self, driver):
+        """
+        Return the time at which driver reached @@EXIT@@, None if he didn't
+        """
+        ending_time = self.ending_times[self.get_driver_index(driver)]
+        return None if np.isnan(ending_time) else ending_time.item()
+
+    def get_starting_times(self, driver):
+        """
+        Return the dictionary of starting times on each visited edge by driver (see Simulator.get_starting_times)
+        """
+        rows = self.get_driver_rows(driver)
+        starting_times = {
+            self.edges[edge]: entry for edge, entry in zip(self.edge[rows].tolist(), self.entry[rows].tolist())}
+        ending_time = self.get_ending_time(driver)
+        if ending_time is not None:
+            starting_times[self.exit_nodes[self.get_driver_index(driver)], options.EXIT] = ending_time
+        return starting_times
+
+    def get_driver_waiting_times(self, driver):
+        """
+        For each edge, the waiting time of driver on it (see Simulator.get_driver_waiting_times)
+        """
+        rows = self.get_driver_rows(driver)
+        return {
+            self.edges[edge]: exit - entry
+            for edge, entry, exit in zip(self.edge[rows].tolist(), self.entry[rows].tolist(), self.exit[rows].tolist())
+        }
+
+    def get_edge_rows(self, edge):
+        """
+        Return the indexes of the rows concerning edge
+        """
+        if edge not in self.edges_index:
+            return self.edge_order[0:0]
+        i = self.edges_index[edge]
+        return self.edge_order[int(self.edge_offsets[i]):int(self.edge_offsets[i + 1])]
+
+    def get_traffic(self, edge, _time):
+        """
+        Return the traffic on edge at time (see Simulator.get_traffic)
+        """
+        rows = self.get_edge_rows(edge)
+        if len(rows) == 0:
+            return 0
+        present = (self.entry[rows] < _time) & (_time <= self.exit[rows])
+        return self.weights[self.driver[rows][present]].sum().item()
+
+    def get_sum_ending_time(self):
+        return np.nansum(self.ending_times).item()
+
+    def get_maximum_ending_time(self):
+        return np.nanmax(self.ending_times).item()
+
+    def get_sum_driving_time(self):
+        return np.nansum(self.ending_times - self.starting_times).item()
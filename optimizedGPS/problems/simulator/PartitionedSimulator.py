@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Parallel simulation of an edge description: the graph is partitioned into regions, and each region simulates the
+drivers on its edges in its own process.
+
+An edge belongs to the region of its source node. A driver entering an edge whose target is in another region is
+handed over to this region, which moves him further when he leaves the edge.
+The regions are synchronised by time windows: a driver spends at least the traffic-free time on an edge, so a
+driver handed over during a window [T, T + lookahead) arrives after the window, where lookahead is the smallest
+traffic-free time of the edges between two regions. Every region can then simulate the whole window independently.
+"""
+import logging
+import math
+import multiprocessing
+import sys
+import time
+from collections import defaultdict, deque
+
+from Simulator import FromEdgeDescriptionSimulator
+from optimizedGPS import options
+
+__all__ = ["PartitionedSimulator"]
+
+log = logging.getLogger(__name__)
+
+
+def partition_graph(graph, regions):
+    """
+    Split the nodes of graph into regions of the same size, following a breadth-first order, so that neighbour
+    nodes are mostly in the same region
+
+    :param graph: Graph instance
+    :param regions: number of regions
+    :return: dictionary node -> region (integer between 0 and regions - 1)
+    """
+    order, seen = [], set()
+    for source in sorted(graph.nodes_iter()):
+        if source in seen:
+            continue
+        seen.add(source)
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for neighbour in sorted(set(graph.successors(node)) | set(graph.predecessors(node))):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+    size = max(int(math.ceil(len(order) / float(regions))), 1)
+    return {node: i // size for i, node in enumerate(order)}
+
+
+def _run_region(connection, region):
+    """
+    Worker's loop: answer the messages sent by PartitionedSimulator until the results are asked
+    """
+    while True:
+        message = connection.recv()
+        connection.send(region.handle(message))
+        if message[0] == RegionSimulator.RESULTS:
+            break
+    connection.close()
+
+
+class RegionSimulator(FromEdgeDescriptionSimulator):
+    """
+    Simulate the drivers while they are on the edges of one region.
+    Drivers are exchanged with the other regions by their index in `drivers`.
+    """
+    WINDOW = 'window'
+    RESULTS = 'results'
+
+    def __init__(self, graph, drivers_graph, edge_description, drivers, partition, region):
+        """
+        :param drivers: list of every simulated driver
+        :param partition: dictionary node -> region
+        :param region: this region
+        """
+        self.drivers = drivers
+        self.indexes = {driver: i for i, driver in enumerate(drivers)}
+        self.partition = partition
+        self.region = region
+        """For each driver, the path he follows, his position in it and the edge he is driving on in this region"""
+        self.paths = {driver: edge_description[driver] or (driver.start,) for driver in drivers}
+        self.positions = {}
+        self.current_edges = {}
+        """Drivers whose next clock is the time they leave the region"""
+        self.leaving = set()
+        self.statistics = {
+            'nodes': sum(1 for r in partition.itervalues() if r == region),
+            'started': 0, 'finished': 0, 'events': 0, 'received': 0, 'sent': 0, 'rounds': 0, 'busy_time': 0.0
+        }
+        super(RegionSimulator, self).__init__(graph, drivers_graph, edge_description)
+
+    def initialize_clocks(self):
+        for driver in self.drivers:
+            if self.partition[self.paths[driver][0]] == self.region:
+                self.positions[driver] = 0
+                self.add_clock(driver, driver.time)
+                self.statistics['started'] += 1
+
+    def get_current_edge(self, driver):
+        return self.current_edges.get(driver)
+
+    def add_event(self, driver, edge, clock):
+        super(RegionSimulator, self).add_event(driver, edge, clock)
+        self.current_edges[driver] = edge
+
+    def get_next_time(self):
+        return self.clocks[0].time if len(self.clocks) > 0 else None
+
+    def handle(self, message):
+        if message[0] == self.WINDOW:
+            return self.run_window(*message[1:])
+        elif message[0] == self.RESULTS:
+            return self.get_results()
+        message = "Unknown message %s" % str(message[0])
+        log.error(message)
+        raise ValueError(message)
+
+    def run_window(self, window_end, incoming):
+        """
+        Receive the drivers handed over by the other regions, and simulate every clock before window_end.
+
+        :param window_end: end of the window (excluded)
+        :param incoming: list of (driver's index, clock, position in his path)
+        :return: list of handed over drivers (region, driver's index, clock, position in his path),
+                 and the next clock in this region (None if no driver is left)
+        """
+        ct = time.time()
+        for i, clock, position in incoming:
+            self.positions[self.drivers[i]] = position
+            self.add_clock(self.drivers[i], clock)
+        self.statistics['received'] += len(incoming)
+
+        outgoing = []
+        while len(self.clocks) > 0 and self.clocks[0].time < window_end:
+            driver, current_time = self.clocks[0]
+            del self.clocks[0]
+            self.statistics['events'] += 1
+            if driver in self.leaving:
+                # driver is now on the next region's edge
+                self.leaving.remove(driver)
+                self.update_traffic(self.current_edges.pop(driver), current_time, - driver.traffic_weight)
+                continue
+            path, position = self.paths[driver], self.positions[driver]
+            if position == len(path) - 1:
+                self.add_event(driver, (path[position], options.EXIT), current_time)
+                self.statistics['finished'] += 1
+                continue
+            edge = path[position], path[position + 1]
+            self.add_event(driver, edge, current_time)
+            clock = current_time + self.get_waiting_time(edge, self.get_current_traffic(edge, current_time))
+            self.positions[driver] = position + 1
+            self.add_clock(driver, clock)
+            region = self.partition[edge[1]]
+            if region != self.region:
+                self.leaving.add(driver)
+                outgoing.append((region, self.indexes[driver], clock, position + 1))
+        self.statistics['sent'] += len(outgoing)
+        self.statistics['rounds'] += 1
+        self.statistics['busy_time'] += time.time() - ct
+        return outgoing, self.get_next_time()
+
+    def get_results(self):
+        """
+        :return: for each driver's index the list of his events (edge, clock) in this region, and the statistics
+        """
+        events = {
+            self.indexes[driver]: [(e.object, e.time) for e in path_clocks]
+            for driver, path_clocks in self.events.iteritems()
+        }
+        return events, self.statistics
+
+
+class PartitionedSimulator(FromEdgeDescriptionSimulator):
+    """
+    Same simulation as FromEdgeDescriptionSimulator, run in parallel on the regions of the graph.
+    The congestion functions have to be non-decreasing, and the traffic-free time of the edges between two regions
+    positive.
+
+    >>> simulator = PartitionedSimulator(graph, drivers_graph, edge_description, processes=4)  # doctest: +SKIP
+    >>> simulator.simulate()  # doctest: +SKIP
+    >>> simulator.get_value(), simulator.get_region_statistics()  # doctest: +SKIP
+    """
+    def __init__(self, graph, drivers_graph, edge_description, timeout=sys.maxint, partition=None, regions=None,
+                 processes=None):
+        """
+        :param partition: dictionary node -> region. If None, the graph is split by partition_graph
+        :param regions: number of regions when partition is None. If None, the number of processes
+        :param processes: number of processes. If None, the number of cpus.
+                          If 1, every region is simulated in the current process
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.partition = partition or partition_graph(graph, regions or self.processes)
+        self.lookahead = None
+        self.rounds = 0
+        self.region_statistics = {}
+        super(PartitionedSimulator, self).__init__(graph, drivers_graph, edge_description, timeout=timeout)
+
+    def initialize_clocks(self):
+        """
+        The clocks are kept by the regions
+        """
+        pass
+
+    def compute_lookahead(self):
+        """
+        Return the minimum traffic-free time of the edges between two regions
+        """
+        lookahead = min([
+            self.graph.get_minimum_waiting_time(source, target) for source, target in self.graph.edges_iter()
+            if self.partition[source] != self.partition[target]
+        ] or [float('inf')])
+        if lookahead <= 0:
+            message = "The edges between two regions should have a positive traffic-free time"
+            log.error(message)
+            raise ValueError(message)
+        return lookahead
+
+    def simulate(self):
+        ct = time.time()
+        drivers = list(self.edge_description.iterkeys())
+        regions = sorted(set(self.partition.itervalues()))
+        self.lookahead = self.compute_lookahead()
+        simulators = {
+            region: RegionSimulator(
+                self.graph, self.drivers_graph, self.edge_description, drivers, self.partition, region)
+            for region in regions
+        }
+        next_times = {region: simulator.get_next_time() for region, simulator in simulators.iteritems()}
+
+        workers, connections = [], None
+        if self.processes > 1 and len(regions) > 1:
+            # the workers are forked: the graph and the drivers are inherited and never pickled
+            connections = {}
+            for region in regions:
+                connection, worker_connection = multiprocessing.Pipe()
+                worker = multiprocessing.Process(target=_run_region, args=(worker_connection, simulators[region]))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+                connections[region] = connection
+
+        def dispatch(messages):
+            if connections is None:
+                return {region: simulators[region].handle(message) for region, message in messages.iteritems()}
+            for region, message in messages.iteritems():
+                connections[region].send(message)
+            return {region: connections[region].recv() for region in messages}
+
+        try:
+            incoming = defaultdict(list)
+            self.status = options.SUCCESS
+            while True:
+                times = [t for t in next_times.itervalues() if t is not None]
+                times.extend(clock for messages in incoming.itervalues() for _, clock, _ in messages)
+                if len(times) == 0:
+                    break
+                if time.time() - ct >= self.timeout:
+                    self.status = options.TIMEOUT
+                    break
+                window_end = min(times) + self.lookahead
+                answers = dispatch({
+                    region: (RegionSimulator.WINDOW, window_end, incoming.pop(region, []))
+                    for region in regions
+                    if region in incoming or (next_times[region] is not None and next_times[region] < window_end)
+                })
+                self.rounds += 1
+                for region, (outgoing, next_time) in answers.iteritems():
+                    next_times[region] = next_time
+                    for target, i, clock, position in outgoing:
+                        incoming[target].append((i, clock, position))
+            results = dispatch({region: (RegionSimulator.RESULTS,) for region in regions})
+        finally:
+            for worker in workers:
+                worker.join(timeout=1)
+                if worker.is_alive():
+                    worker.terminate()
+
+        events = defaultdict(list)
+        for region, (region_events, statistics) in results.iteritems():
+            self.region_statistics[region] = statistics
+            for i, driver_events in region_events.iteritems():
+                events[i].extend(driver_events)
+        for i, driver_events in events.iteritems():
+            # a driver's events in different regions never happen at the same time
+            for edge, clock in sorted(driver_events, key=lambda e: e[1]):
+                self.add_event(drivers[i], edge, clock)
+        log.info("%s drivers simulated on %s regions in %s rounds and %s seconds",
+                 len(drivers), len(regions), self.rounds, time.time() - ct)
+
+    def get_region_statistics(self):
+        """
+        For each region: number of nodes, of drivers who started and finished in it, of simulated events,
+        of drivers received from and sent to other regions, of rounds where it was active, and the time spent
+        simulating.
+
+        :return: dict
+        """
+        return self.region_statistics
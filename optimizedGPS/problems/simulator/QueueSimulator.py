@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Mesoscopic simulation: every edge is a FIFO queue.
+
+A driver entering an edge needs at least the edge's traffic-free time to cross it. Then he waits in the edge's exit
+queue, which lets a limited number of drivers leave per unit of time: its capacity. The time is discretized in steps,
+and every edge is updated at the same time by vectorised operations on the drivers' arrays.
+"""
+import logging
+import math
+import sys
+import time
+
+import numpy as np
+
+from Simulator import Simulator
+from optimizedGPS import labels, options
+
+__all__ = ["QueueSimulator"]
+
+log = logging.getLogger(__name__)
+
+
+class QueueSimulator(Simulator):
+    """
+    Simulate an edge description, as FromEdgeDescriptionSimulator does, with capacity queues instead of congestion
+    functions. Problems can use it by setting their `simulator` attribute to this class.
+
+    By default, the capacity of an edge (drivers leaving it per unit of time) is lanes * traffic_limit divided by the
+    traffic-free time: traffic_limit drivers per lane can be on the edge without slowing each other down.
+    """
+    def __init__(self, graph, drivers_graph, edge_description, timeout=sys.maxint, time_step=1, capacity=None):
+        """
+        :param edge_description: for each driver, the path he has to follow
+        :param time_step: duration of one step. Starting times and traffic-free times are rounded up to a multiple
+                          of it
+        :param capacity: function taking an edge and returning its capacity. If None, see above
+        """
+        self.edge_description = edge_description
+        self.time_step = time_step
+        self.capacity = capacity or self.get_default_capacity
+        super(QueueSimulator, self).__init__(graph, drivers_graph, timeout=timeout)
+
+    def get_default_capacity(self, edge):
+        lanes = self.graph.get_edge_property(edge[0], edge[1], labels.LANES) or 1
+        traffic_limit = max(self.graph.get_traffic_limit(*edge) or 1, 1)
+        return float(lanes * traffic_limit) / max(self.graph.get_minimum_waiting_time(*edge), self.time_step)
+
+    def to_steps(self, _time):
+        return int(math.ceil(float(_time) / self.time_step - 1e-9))
+
+    def initialize_clocks(self):
+        """
+        Build the arrays describing the drivers and the edges:
+          - drivers are indexed by their position in self.drivers
+          - the paths are concatenated in self.route: the edges of driver i are route[offsets[i]:offsets[i + 1]]
+        """
+        self.drivers = list(self.edge_description.iterkeys())
+        self.drivers_index = {driver: i for i, driver in enumerate(self.drivers)}
+        self.edges, edges_index, route, offsets, exit_nodes = [], {}, [], [0], []
+        for driver in self.drivers:
+            path = self.edge_description[driver]
+            for edge in self.graph.iter_edges_in_path(path):
+                if edge not in edges_index:
+                    edges_index[edge] = len(self.edges)
+                    self.edges.append(edge)
+                route.append(edges_index[edge])
+            offsets.append(len(route))
+            exit_nodes.append(path[-1] if len(path) > 0 else driver.start)
+        self.edges_index = edges_index
+        self.exit_nodes = exit_nodes
+        self.route = np.array(route, dtype=np.int64)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.weights = np.array([driver.traffic_weight for driver in self.drivers], dtype=np.float64)
+        self.starting_steps = np.array([self.to_steps(driver.time) for driver in self.drivers], dtype=np.int64)
+
+        self.free_steps = np.array(
+            [max(self.to_steps(self.graph.get_minimum_waiting_time(*edge)), 1) for edge in self.edges], dtype=np.int64)
+        self.capacities = np.array([self.capacity(edge) * self.time_step for edge in self.edges], dtype=np.float64)
+
+        """Results: the step at which each driver enters each edge of his route, and the step he leaves the graph"""
+        self.entry_steps = np.full(len(self.route), -1, dtype=np.int64)
+        self.ending_steps = np.full(len(self.drivers), -1, dtype=np.int64)
+        self.edge_rows = None
+
+    def has_next(self):
+        return bool((self.ending_steps < 0).any())
+
+    def simulate(self):
+        """
+        Move the drivers step by step until every one of them has left the graph.
+        Steps where nothing can happen are skipped.
+
+        The drivers who crossed their edge wait in self.queue, sorted by edge then entry step: on a given edge,
+        a driver entering later is ready later, so the newly ready drivers are just inserted at the end of their
+        edge's queue.
+        """
+        ct = time.time()
+        n = len(self.drivers)
+        if n == 0:
+            self.status = options.SUCCESS
+            return
+        never = np.iinfo(np.int64).max
+        # current position of each driver in self.route (-1 when not started), and step at which he can leave it
+        position = np.full(n, -1, dtype=np.int64)
+        ready = np.full(n, never, dtype=np.int64)
+        departures = np.argsort(self.starting_steps, kind='mergesort')
+        departure_steps = self.starting_steps[departures]
+        next_departure, exited = 0, 0
+        # waiting drivers and their edges
+        queue, queue_edges = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        # unused capacity of each edge, bounded so that any driver can leave an empty queue
+        credits = np.zeros(len(self.edges), dtype=np.float64)
+        bursts = np.maximum(self.capacities, self.weights.max())
+        step = previous_step = departure_steps[0]
+
+        while True:
+            credits = np.minimum(credits + self.capacities * (step - previous_step), bursts)
+            previous_step = step
+
+            # drivers who have just crossed their edge join its queue
+            arrived = np.flatnonzero(ready <= step)
+            if len(arrived) > 0:
+                ready[arrived] = never
+                edges = self.route[position[arrived]]
+                order = np.lexsort((arrived, self.entry_steps[position[arrived]], edges))
+                indexes = np.searchsorted(queue_edges, edges[order], side='right')
+                queue = np.insert(queue, indexes, arrived[order])
+                queue_edges = np.insert(queue_edges, indexes, edges[order])
+
+            # drivers leaving their edge, in FIFO order and within the edge's capacity
+            if len(queue) > 0:
+                # weight of the drivers in the same queue up to each driver, himself included
+                weights = self.weights[queue]
+                cumulated = np.cumsum(weights)
+                heads = np.flatnonzero(np.r_[True, queue_edges[1:] != queue_edges[:-1]])
+                cumulated -= np.repeat(cumulated[heads] - weights[heads], np.diff(np.r_[heads, len(queue)]))
+                allowed = cumulated <= credits[queue_edges] + 1e-9
+                leaving = queue[allowed]
+                np.subtract.at(credits, queue_edges[allowed], weights[allowed])
+                queue, queue_edges = queue[~allowed], queue_edges[~allowed]
+                position[leaving] += 1
+                exited += self.move(leaving, position, ready, step)
+
+            # drivers starting at this step
+            first, next_departure = next_departure, np.searchsorted(departure_steps, step, side='right')
+            starting = departures[first:next_departure]
+            if len(starting) > 0:
+                position[starting] = self.offsets[starting]
+                exited += self.move(starting, position, ready, step)
+
+            if time.time() - ct >= self.timeout:
+                self.status = options.TIMEOUT
+                return
+            if exited >= n:
+                break
+            # next step where something can happen: a driver crosses his edge or starts, or a queue's head gets
+            # enough capacity to leave
+            candidates = [ready.min()]
+            if next_departure < n:
+                candidates.append(departure_steps[next_departure])
+            if len(queue) > 0:
+                heads = np.flatnonzero(np.r_[True, queue_edges[1:] != queue_edges[:-1]])
+                edges = queue_edges[heads]
+                missing = np.maximum(self.weights[queue[heads]] - credits[edges], 0) / self.capacities[edges]
+                candidates.append(step + max(int(math.ceil(missing.min() - 1e-9)), 1))
+            step = min(candidates)
+        self.status = options.SUCCESS
+
+    def move(self, drivers, position, ready, step):
+        """
+        drivers enter the edge at their current position at step, or leave the graph if their route is over
+
+        :return: number of drivers who left the graph
+        """
+        exiting = position[drivers] >= self.offsets[drivers + 1]
+        self.ending_steps[drivers[exiting]] = step
+        entering = drivers[~exiting]
+        self.entry_steps[position[entering]] = step
+        ready[entering] = step + self.free_steps[self.route[position[entering]]]
+        return int(exiting.sum())
+
+    # ----------------------------------------------------------------------------------------
+    # ------------------------------------ RESULTS -------------------------------------------
+    # ----------------------------------------------------------------------------------------
+
+    def get_driver_index(self, driver):
+        if driver not in self.drivers_index:
+            message = "driver %s has not been simulated" % str(driver)
+            log.error(message)
+            raise KeyError(message)
+        return self.drivers_index[driver]
+
+    def get_drivers_indexes(self, drivers=None):
+        if drivers is None:
+            return np.flatnonzero(self.ending_steps >= 0)
+        indexes = np.array([self.drivers_index[d] for d in drivers if d in self.drivers_index], dtype=np.int64)
+        return indexes[self.ending_steps[indexes] >= 0]
+
+    def get_sum_ending_time(self, drivers=None):
+        return self.ending_steps[self.get_drivers_indexes(drivers)].sum().item() * self.time_step
+
+    def get_maximum_ending_time(self, drivers=None):
+        return self.ending_steps[self.get_drivers_indexes(drivers)].max().item() * self.time_step
+
+    def get_sum_driving_time(self, drivers=None):
+        indexes = self.get_drivers_indexes(drivers)
+        return (self.ending_steps[indexes] - self.starting_steps[indexes]).sum().item() * self.time_step
+
+    def get_edge_description(self):
+        return dict(self.iter_edge_description())
+
+    def iter_edge_description(self):
+        for i, driver in enumerate(self.drivers):
+            if self.ending_steps[i] >= 0 or (self.entry_steps[self.offsets[i]:self.offsets[i + 1]] >= 0).any():
+                yield driver, tuple(self.edge_description[driver])
+
+    def iter_edge_in_driver_path(self, driver):
+        return self.graph.iter_edges_in_path(self.edge_description[driver])
+
+    def get_starting_times(self, driver):
+        """
+        Return the dictionary of starting times on each visited edge by drivers (see Simulator.get_starting_times)
+        """
+        i = self.get_driver_index(driver)
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        starting_times = {
+            self.edges[edge]: step * self.time_step
+            for edge, step in zip(self.route[rows].tolist(), self.entry_steps[rows].tolist()) if step >= 0
+        }
+        if self.ending_steps[i] >= 0:
+            starting_times[self.exit_nodes[i], options.EXIT] = self.ending_steps[i].item() * self.time_step
+        return starting_times
+
+    def get_ending_time(self, driver):
+        step = self.ending_steps[self.get_driver_index(driver)]
+        return step.item() * self.time_step if step >= 0 else None
+
+    def get_traffic(self, edge, _time):
+        """
+        Return the traffic on edge at time: weight of the drivers who entered it before time and left it at time
+        or later
+        """
+        if edge not in self.edges_index:
+            return 0
+        if self.edge_rows is None:
+            # for each row of self.route, its driver and the step at which he left the edge
+            drivers = np.repeat(np.arange(len(self.drivers)), np.diff(self.offsets))
+            exits = np.r_[self.entry_steps[1:], -1]
+            last = self.offsets[1:] - 1
+            exits[last[last >= self.offsets[:-1]]] = self.ending_steps[drivers[last[last >= self.offsets[:-1]]]]
+            exits = np.where(exits < 0, np.iinfo(np.int64).max, exits)
+            self.edge_rows = drivers, exits
+        drivers, exits = self.edge_rows
+        rows = np.flatnonzero((self.route == self.edges_index[edge]) & (self.entry_steps >= 0))
+        entries, exits = self.entry_steps[rows] * self.time_step, exits[rows] * float(self.time_step)
+        present = (entries < _time) & (_time <= exits)
+        return self.weights[drivers[rows][present]].sum().item()
@@ -4,6 +4,7 @@ Created on Wed Apr 01 21:38:37 2015
 
 @author: Mickael Grima
 """
+import heapq
 import logging
 import sys
 import time
@@ -11,7 +12,10 @@ from collections import defaultdict, namedtuple
 
 from sortedcontainers import SortedListWithKey
 
+from EventLog import EventLog
+from TrafficIndex import TrafficIndex
 from optimizedGPS import options
+from optimizedGPS.structure import Driver
 
 __all__ = []
 
@@ -42,6 +46,23 @@ class Simulator(object):
         self.events = defaultdict(lambda: SortedListWithKey(key=lambda c: c.time))
         """Sorted list of tuple (driver, clock)"""
         self.clocks = SortedListWithKey(key=lambda c: c.time)
+
+        """For each driver who left the graph, his index in the following lists"""
+        self.exited_drivers = {}
+        """Starting and ending times of drivers who left the graph, ordered by exit"""
+        self.exited_starting_times = []
+        self.exited_ending_times = []
+        """Running aggregates over the drivers who left the graph"""
+        self.sum_ending_time = 0
+        self.max_ending_time = None
+        self.sum_driving_time = 0
+
+        """Weight of the drivers on each edge, and of the ones who entered/left it at the time of the last change"""
+        self.traffic_counts = defaultdict(lambda: 0)
+        self.traffic_times = {}
+        self.entered_weights = defaultdict(lambda: 0)
+        self.left_weights = defaultdict(lambda: 0)
+
         self.initialize_clocks()
 
     def initialize_clocks(self):
@@ -71,7 +92,43 @@ class Simulator(object):
         :param clock: current time in the simulation
         :return:
         """
+        previous_edge = self.get_current_edge(driver)
         self.events[driver].add(self.Time(object=edge, time=clock))
+        if previous_edge is not None:
+            self.update_traffic(previous_edge, clock, - driver.traffic_weight)
+        if edge[-1] == options.EXIT:
+            self.add_exit(driver, clock)
+        else:
+            self.update_traffic(edge, clock, driver.traffic_weight)
+
+    def update_traffic(self, edge, clock, weight):
+        """
+        A driver with the given weight enters (weight > 0) or leaves (weight < 0) edge at clock.
+        The events are added in the order of the clocks, so that we know the traffic while simulating.
+        """
+        if self.traffic_times.get(edge) != clock:
+            self.traffic_times[edge] = clock
+            self.entered_weights[edge], self.left_weights[edge] = 0, 0
+        self.traffic_counts[edge] += weight
+        if weight > 0:
+            self.entered_weights[edge] += weight
+        else:
+            self.left_weights[edge] -= weight
+
+    def add_exit(self, driver, clock):
+        """
+        Driver leaves the graph at time clock: we update the aggregates used for computing the objective values
+
+        :param driver: driver object
+        :param clock: current time in the simulation
+        """
+        starting_time = self.events[driver][0].time
+        self.exited_drivers[driver] = len(self.exited_ending_times)
+        self.exited_starting_times.append(starting_time)
+        self.exited_ending_times.append(clock)
+        self.sum_ending_time += clock
+        self.max_ending_time = clock if self.max_ending_time is None else max(self.max_ending_time, clock)
+        self.sum_driving_time += clock - starting_time
 
     def get_current_edge(self, driver):
         """
@@ -134,7 +191,7 @@ class Simulator(object):
                 raise Exception("current edge %s and next edge %s are not connected"
                                 % (str(current_edge), str(next_edge)))
             self.add_event(driver, next_edge, current_time)
-            waiting_time = self.get_waiting_time(next_edge, self.get_traffic(next_edge, current_time))
+            waiting_time = self.get_waiting_time(next_edge, self.get_current_traffic(next_edge, current_time))
             self.add_clock(driver, current_time + waiting_time)
         del self.clocks[0]
 
@@ -169,54 +226,68 @@ class Simulator(object):
                 return
         self.status = options.SUCCESS
 
+    def get_drivers_mask(self, drivers):
+        """
+        Return the indexes of the given drivers who already left the graph (see self.exited_drivers)
+
+        :param drivers: iterable of driver objects
+        :return: list of integers
+        """
+        return [self.exited_drivers[d] for d in drivers if d in self.exited_drivers]
+
+    def iter_driving_times(self, drivers=None):
+        """
+        Iterate (starting time, last event's time) for every driver who is still driving on graph.
+        Once the simulation is over, nothing is yielded.
+
+        :param drivers: if not None, we just consider the drivers inside drivers
+        """
+        for driver, _ in self.clocks:
+            if (drivers is None or driver in drivers) and len(self.events.get(driver, ())) > 0:
+                yield self.events[driver][0].time, self.events[driver][-1].time
+
     def get_maximum_driving_time(self, drivers=None):
         """
         Return the worst driving time
         If drivers is not None, we just consider the drivers inside drivers
+
+        ** WARNING **: as it has always been, the returned value is the time of the latest event
         """
-        if drivers is None:
-            return max(self.events.itervalues(), key=lambda e: e[-1].time if len(e) > 0 else 0)[-1].time
-        else:
-            return max(
-                map(lambda d: self.events[d], filter(lambda d: d in drivers, self.events.iterkeys())),
-                key=lambda e: e[-1].time if len(e) > 0 else 0
-            )[-1].time
+        return self.get_maximum_ending_time(drivers=drivers)
 
     def get_sum_driving_time(self, drivers=None):
         """
         Return the sum of every driving time
         """
         if drivers is None:
-            return sum(map(lambda e: e[-1].time - e[0].time, self.events.itervalues()))
+            value = self.sum_driving_time
         else:
-            return sum(map(
-                lambda d: self.events[d][-1].time - self.events[d][0].time,
-                filter(lambda d: d in drivers, self.events.iterkeys())
-            ))
+            drivers = set(drivers)
+            value = sum(self.exited_ending_times[i] - self.exited_starting_times[i]
+                        for i in self.get_drivers_mask(drivers))
+        return value + sum(end - start for start, end in self.iter_driving_times(drivers=drivers))
 
     def get_maximum_ending_time(self, drivers=None):
         """
         Return the max of ending times
         """
         if drivers is None:
-            return max(map(lambda e: e[-1].time, self.events.itervalues()))
+            values = [] if self.max_ending_time is None else [self.max_ending_time]
         else:
-            return max(map(
-                lambda d: self.events[d][-1].time,
-                filter(lambda d: d in drivers, self.events.iterkeys())
-            ))
+            drivers = set(drivers)
+            values = [self.exited_ending_times[i] for i in self.get_drivers_mask(drivers)]
+        return max(values + [end for _, end in self.iter_driving_times(drivers=drivers)])
 
     def get_sum_ending_time(self, drivers=None):
         """
         Return the sum of ending times
         """
         if drivers is None:
-            return sum(map(lambda e: e[-1].time, self.events.itervalues()))
+            value = self.sum_ending_time
         else:
-            return sum(map(
-                lambda d: self.events[d][-1].time,
-                filter(lambda d: d in drivers, self.events.iterkeys())
-            ))
+            drivers = set(drivers)
+            value = sum(self.exited_ending_times[i] for i in self.get_drivers_mask(drivers))
+        return value + sum(end for _, end in self.iter_driving_times(drivers=drivers))
 
     def get_value(self):
         """
@@ -286,6 +357,35 @@ class Simulator(object):
             waiting_times[previous_edge] = self.get_ending_time(driver) - waiting_times[previous_edge]
         return waiting_times
 
+    def export_events(self, directory):
+        """
+        Write the events into directory as columnar arrays, which can be loaded later with EventLog.load
+
+        :param directory: path to the directory
+        :return: EventLog instance
+        """
+        return EventLog.export(self, directory)
+
+    def get_traffic_index(self, limits=None):
+        """
+        Index the traffic of the simulated events, for answering traffic queries in logarithmic time
+
+        :param limits: see TrafficIndex.from_event_log. If None, the traffic limits of the graph
+        :return: TrafficIndex instance
+        """
+        return TrafficIndex.from_simulator(self, limits=limits)
+
+    def get_current_traffic(self, edge, _time):
+        """
+        Return the traffic on edge at time, while simulating: every event before time has already been added.
+        Same value as get_traffic, in constant time: the drivers entering edge at time are not counted,
+        the ones leaving it at time are.
+        """
+        traffic = self.traffic_counts.get(edge, 0)
+        if self.traffic_times.get(edge) == _time:
+            traffic += self.left_weights[edge] - self.entered_weights[edge]
+        return traffic
+
     def get_traffic(self, edge, _time):
         """
         Return the traffic on edge at time
@@ -351,3 +451,210 @@ class FromEdgeDescriptionSimulator(Simulator):
                           % (str(driver), str(current_edge))
                 log.error(message)
                 raise StopIteration(message)
+
+
+class CohortSimulator(FromEdgeDescriptionSimulator):
+    """
+    Same simulation as FromEdgeDescriptionSimulator, but identical drivers (same start, end, starting time and path)
+    are merged into one weighted driver: the cohort.
+    Drivers of a cohort enter every edge at the same time, and since a driver never sees the drivers entering an edge
+    at the same time as him, they see the same traffic: the simulation is exact.
+    Per-driver results are computed from the cohort's results when asked.
+    """
+    def __init__(self, graph, drivers_graph, edge_description, timeout=sys.maxint):
+        """For each cohort's driver, the drivers he represents"""
+        self.cohorts = {}
+        """For each driver, the cohort's driver representing him"""
+        self.cohort_of = {}
+        cohorts = {}
+        for driver, path in edge_description.iteritems():
+            cohorts.setdefault((driver.start, driver.end, driver.time, tuple(path)), []).append(driver)
+        cohorts_description = {}
+        for (start, end, _time, path), drivers in cohorts.iteritems():
+            cohort = Driver(start, end, _time, traffic_weight=sum(d.traffic_weight for d in drivers))
+            self.cohorts[cohort] = drivers
+            for driver in drivers:
+                self.cohort_of[driver] = cohort
+            cohorts_description[cohort] = path
+        super(CohortSimulator, self).__init__(graph, drivers_graph, cohorts_description, timeout=timeout)
+
+    def get_cohort(self, driver):
+        """
+        Return the cohort's driver representing driver
+        """
+        return self.cohort_of.get(driver, driver)
+
+    def number_of_cohorts(self):
+        return len(self.cohorts)
+
+    def add_exit(self, driver, clock):
+        """
+        Each driver of the cohort leaves the graph at clock
+        """
+        super(CohortSimulator, self).add_exit(driver, clock)
+        others = len(self.cohorts[driver]) - 1
+        self.sum_ending_time += others * clock
+        self.sum_driving_time += others * (clock - self.events[driver][0].time)
+
+    def get_drivers_mask(self, drivers):
+        """
+        A cohort's index is repeated for each of the given drivers it represents
+        """
+        return super(CohortSimulator, self).get_drivers_mask(map(self.get_cohort, drivers))
+
+    def iter_driving_times(self, drivers=None):
+        for cohort, _ in self.clocks:
+            if len(self.events.get(cohort, ())) > 0:
+                for driver in self.cohorts[cohort]:
+                    if drivers is None or driver in drivers:
+                        yield self.events[cohort][0].time, self.events[cohort][-1].time
+
+    def get_edge_description(self):
+        return dict(self.iter_edge_description())
+
+    def iter_edge_description(self):
+        for cohort, path in super(CohortSimulator, self).iter_edge_description():
+            for driver in self.cohorts[cohort]:
+                yield driver, path
+
+    def iter_edge_in_driver_path(self, driver):
+        return self.graph.iter_edges_in_path(self.edge_description[self.get_cohort(driver)])
+
+    def get_starting_times(self, driver):
+        return super(CohortSimulator, self).get_starting_times(self.get_cohort(driver))
+
+    def get_ending_time(self, driver):
+        return super(CohortSimulator, self).get_ending_time(self.get_cohort(driver))
+
+
+class DynamicRoutingSimulator(Simulator):
+    """
+    Drivers don't follow a fixed path: on each node, a driver re-evaluates his remaining route considering the
+    current traffic, and takes the first edge of the fastest route.
+
+    The cost of an edge is its congestion function applied on its current traffic. The search is an A* whose
+    heuristic is the traffic-free driving time to the driver's target (one backward search per target, computed
+    once). Since congestion functions are non-decreasing, this heuristic is a lower bound, which gives:
+      - if the planned route still costs its traffic-free time, it is optimal and no search is needed
+      - otherwise the A* only settles the nodes which could improve the route
+
+    Every decision is recorded: see get_routing_statistics.
+    """
+    def __init__(self, graph, drivers_graph, timeout=sys.maxint):
+        """For each driver, the planned route from the node he is driving to"""
+        self.plans = {}
+        """For each target, the traffic-free driving time from every node"""
+        self.lower_bounds = {}
+        """Instrumentation: number of settled nodes and time spent for each decision"""
+        self.decisions_costs = []
+        self.decisions_times = []
+        self.searches = 0
+        self.reroutes = 0
+        super(DynamicRoutingSimulator, self).__init__(graph, drivers_graph, timeout=timeout)
+
+    def get_lower_bounds(self, target):
+        """
+        Traffic-free driving time from every node to target (backward Dijkstra), computed once per target
+        """
+        if target not in self.lower_bounds:
+            distances, heap = {target: 0}, [(0, target)]
+            while heap:
+                distance, node = heapq.heappop(heap)
+                if distance > distances[node]:
+                    continue
+                for pred in self.graph.predecessors_iter(node):
+                    new_distance = distance + self.graph.get_minimum_waiting_time(pred, node)
+                    if new_distance < distances.get(pred, new_distance + 1):
+                        distances[pred] = new_distance
+                        heapq.heappush(heap, (new_distance, pred))
+            self.lower_bounds[target] = distances
+        return self.lower_bounds[target]
+
+    def get_edge_cost(self, edge, _time):
+        return self.get_waiting_time(edge, self.get_current_traffic(edge, _time))
+
+    def get_path_cost(self, path, _time):
+        return sum(self.get_edge_cost(edge, _time) for edge in self.graph.iter_edges_in_path(path))
+
+    def search_route(self, source, target, _time):
+        """
+        A* from source to target with the current traffic.
+
+        :return: the fastest path (None if target is unreachable), and the number of settled nodes
+        """
+        lower_bounds = self.get_lower_bounds(target)
+        if source not in lower_bounds:
+            return None, 0
+        distances, predecessors, settled = {source: 0}, {source: None}, set()
+        heap = [(lower_bounds[source], 0, source)]
+        while heap:
+            _, distance, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == target:
+                break
+            for succ in self.graph.successors_iter(node):
+                if succ in settled or succ not in lower_bounds:
+                    continue
+                new_distance = distance + self.get_edge_cost((node, succ), _time)
+                if new_distance < distances.get(succ, new_distance + 1):
+                    distances[succ] = new_distance
+                    predecessors[succ] = node
+                    heapq.heappush(heap, (new_distance + lower_bounds[succ], new_distance, succ))
+        if target not in settled:
+            return None, len(settled)
+        path, node = (), target
+        while node is not None:
+            path = (node,) + path
+            node = predecessors[node]
+        return path, len(settled)
+
+    def get_next_edge(self, driver):
+        """
+        Re-evaluate the driver's route from his current node and return its first edge.
+        If driver has reached his target, we return None
+        """
+        current_edge = self.get_current_edge(driver)
+        node = driver.start if current_edge is None else current_edge[1]
+        if node == driver.end:
+            return None
+
+        ct = time.time()
+        _time = self.clocks[0].time
+        plan, cost = self.plans.get(driver), 0
+        if plan is None or plan[0] != node or \
+                self.get_path_cost(plan, _time) > self.get_lower_bounds(driver.end).get(node, 0):
+            new_plan, cost = self.search_route(node, driver.end, _time)
+            self.searches += 1
+            if plan is not None and new_plan != plan:
+                self.reroutes += 1
+            plan = new_plan
+        self.decisions_costs.append(cost)
+        self.decisions_times.append(time.time() - ct)
+
+        if plan is None:
+            log.warning("No path from node %s to node %s for driver %s", node, driver.end, str(driver))
+            return None
+        self.plans[driver] = plan[1:]
+        return plan[0], plan[1]
+
+    def get_routing_statistics(self):
+        """
+        Return some statistics about the routing decisions:
+          - number of decisions, searches and re-routes
+          - mean and maximum number of settled nodes per decision
+          - total and mean time spent per decision
+
+        :return: dict
+        """
+        decisions = len(self.decisions_costs)
+        return {
+            'decisions': decisions,
+            'searches': self.searches,
+            'reroutes': self.reroutes,
+            'mean_settled_nodes': sum(self.decisions_costs) / float(decisions) if decisions > 0 else 0,
+            'max_settled_nodes': max(self.decisions_costs) if decisions > 0 else 0,
+            'decisions_time': sum(self.decisions_times),
+            'mean_decision_time': sum(self.decisions_times) / decisions if decisions > 0 else 0
+        }
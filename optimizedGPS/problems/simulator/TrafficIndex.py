@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# !/bin/env python
+"""
+Index over the traffic of a finished simulation.
+
+The traffic on an edge is a step function of the time: it only changes when a driver enters or leaves the edge.
+For each edge we store the sorted times where it changes (breakpoints) and the traffic right after each of them,
+so that the traffic on (breakpoints[k], breakpoints[k + 1]] is values[k].
+The arrays of every edge are concatenated, and a sparse table over the values gives the maximum traffic over any
+range of breakpoints in constant time.
+"""
+import logging
+
+import numpy as np
+
+from EventLog import EventLog
+from optimizedGPS import labels
+from optimizedGPS.structure import GPSGraph
+
+__all__ = ["TrafficIndex"]
+
+log = logging.getLogger(__name__)
+
+
+class TrafficIndex(object):
+    """
+    Answer traffic queries in logarithmic time:
+
+    >>> index = simulator.get_traffic_index()  # doctest: +SKIP
+    >>> index.get_traffic(edge, 4)  # doctest: +SKIP
+    >>> index.get_maximum_traffic(edge, 0, 10)  # doctest: +SKIP
+    >>> index.get_congested_edges(4)  # doctest: +SKIP
+    """
+    def __init__(self, edges, breakpoints, values, offsets, limits):
+        """
+        :param edges: list of edges. The index of an edge is its position in this list
+        :param breakpoints: for each edge, sorted times where its traffic changes (concatenated)
+        :param values: traffic right after each breakpoint
+        :param offsets: the breakpoints of edge i are breakpoints[offsets[i]:offsets[i + 1]]
+        :param limits: for each edge, the traffic over which the edge is congested
+        """
+        self.edges = edges
+        self.edges_index = {edge: i for i, edge in enumerate(edges)}
+        self.breakpoints = breakpoints
+        self.values = values
+        self.offsets = offsets
+        self.limits = limits
+
+        self.sparse_table = self.build_sparse_table(values)
+        self.build_congestion_tree()
+
+    @classmethod
+    def from_event_log(cls, event_log, limits=None):
+        """
+        :param event_log: EventLog instance
+        :param limits: traffic limit of every edge (number), or dictionary edge -> traffic limit.
+                       If None, the default traffic limit of GPSGraph
+        :return: TrafficIndex instance
+        """
+        if limits is None:
+            limits = GPSGraph.PROPERTIES['edges'][labels.TRAFFIC_LIMIT]
+        if not isinstance(limits, dict):
+            limits = {edge: limits for edge in event_log.edges}
+
+        # every change of traffic: +weight when a driver enters, -weight when he leaves
+        weights = event_log.weights[event_log.driver]
+        edges = np.concatenate([event_log.edge, event_log.edge])
+        times = np.concatenate([event_log.entry, event_log.exit])
+        deltas = np.concatenate([weights, -weights])
+        order = np.lexsort((times, edges))
+        edges, times, deltas = edges[order], times[order], deltas[order]
+
+        # traffic after each change: cumulated deltas since the edge's first change
+        cumulated = np.cumsum(deltas)
+        firsts = np.flatnonzero(np.r_[True, edges[1:] != edges[:-1]]) if len(edges) > 0 else np.empty(0, np.int64)
+        cumulated -= np.repeat(cumulated[firsts] - deltas[firsts], np.diff(np.r_[firsts, len(edges)]))
+
+        # we keep the last change at each time, and forget the drivers who never left
+        last = np.r_[(edges[1:] != edges[:-1]) | (times[1:] != times[:-1]), True] & np.isfinite(times)
+        edges, breakpoints, values = edges[last], times[last], cumulated[last]
+        offsets = np.searchsorted(edges, np.arange(len(event_log.edges) + 1), side='left')
+
+        return cls(
+            list(event_log.edges), breakpoints, values, offsets.astype(np.int64),
+            np.array([limits.get(edge, 0) for edge in event_log.edges], dtype=np.float64)
+        )
+
+    @classmethod
+    def from_simulator(cls, simulator, limits=None):
+        """
+        :param simulator: Simulator instance
+        :param limits: see from_event_log. If None, the traffic limits of simulator's graph
+        :return: TrafficIndex instance
+        """
+        event_log = EventLog.from_simulator(simulator)
+        if limits is None:
+            limits = {edge: simulator.graph.get_traffic_limit(*edge) for edge in event_log.edges}
+        return cls.from_event_log(event_log, limits=limits)
+
+    @classmethod
+    def build_sparse_table(cls, values):
+        """
+        table[j][i] is the maximum of values[i:i + 2 ** j]
+        """
+        table = [values]
+        length = 1
+        while 2 * length <= len(values):
+            table.append(np.maximum(table[-1][:-length], table[-1][length:]))
+            length *= 2
+        return table
+
+    def build_congestion_tree(self):
+        """
+        Build the periods where each edge is congested, sorted by starting time, and a segment tree giving the
+        latest end of the periods in any node
+        """
+        congested = self.values > np.repeat(self.limits, np.diff(self.offsets))
+        # a period starts on a congested breakpoint following an uncongested one (or the edge's first breakpoint)
+        firsts = np.zeros(len(self.values), dtype=bool)
+        firsts[self.offsets[:-1][np.diff(self.offsets) > 0]] = True
+        starts = np.flatnonzero(congested & (firsts | ~np.r_[False, congested[:-1]]))
+        # and ends on the edge's next uncongested breakpoint: never if some drivers didn't leave the edge
+        edges = np.searchsorted(self.offsets, starts, side='right') - 1
+        uncongested = np.r_[np.flatnonzero(~congested), len(self.values)]
+        ends = uncongested[np.searchsorted(uncongested, starts)]
+        finished = ends < self.offsets[edges + 1]
+        self.congestion_starts = self.breakpoints[starts]
+        self.congestion_ends = np.full(len(starts), np.inf)
+        self.congestion_ends[finished] = self.breakpoints[ends[finished]]
+        self.congestion_edges = edges
+        order = np.argsort(self.congestion_starts, kind='mergesort')
+        self.congestion_starts = self.congestion_starts[order]
+        self.congestion_ends = self.congestion_ends[order]
+        self.congestion_edges = self.congestion_edges[order]
+
+        size = 1
+        while size < len(order):
+            size *= 2
+        self.congestion_tree = np.full(2 * size, -np.inf)
+        self.congestion_tree[size:size + len(order)] = self.congestion_ends
+        while size > 1:
+            self.congestion_tree[size // 2:size] = np.maximum(
+                self.congestion_tree[size:2 * size:2], self.congestion_tree[size + 1:2 * size:2])
+            size //= 2
+
+    # ----------------------------------------------------------------------------------------
+    # ------------------------------------ QUERIES -------------------------------------------
+    # ----------------------------------------------------------------------------------------
+
+    def get_edge_range(self, edge):
+        if edge not in self.edges_index:
+            return 0, 0
+        i = self.edges_index[edge]
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def get_traffic(self, edge, _time):
+        """
+        Return the traffic on edge at time (see Simulator.get_traffic)
+        """
+        start, end = self.get_edge_range(edge)
+        k = start + np.searchsorted(self.breakpoints[start:end], _time, side='left') - 1
+        return self.values[k].item() if k >= start else 0
+
+    def get_range_maximum(self, start, end):
+        """
+        Return the maximum of self.values[start:end], None if the range is empty
+        """
+        if end <= start:
+            return None
+        j = int(end - start).bit_length() - 1
+        return max(self.sparse_table[j][start], self.sparse_table[j][end - 2 ** j]).item()
+
+    def get_maximum_traffic(self, edge, start_time, end_time):
+        """
+        Return the maximum traffic on edge over [start_time, end_time]
+        """
+        start, end = self.get_edge_range(edge)
+        breakpoints = self.breakpoints[start:end]
+        # the traffic at start_time, and after each breakpoint in [start_time, end_time)
+        first = start + np.searchsorted(breakpoints, start_time, side='left')
+        last = start + np.searchsorted(breakpoints, end_time, side='left')
+        traffic = self.get_traffic(edge, start_time)
+        return max(traffic, self.get_range_maximum(first, last))
+
+    def iter_congested_edges(self, _time):
+        """
+        Iterate the edges whose traffic at time is over their traffic limit
+        """
+        size = len(self.congestion_tree) // 2
+        # the periods starting before time, and among them the ones ending at time or later
+        count = np.searchsorted(self.congestion_starts, _time, side='left')
+        stack = [(1, 0, size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if lo >= count or self.congestion_tree[node] < _time:
+                continue
+            if node >= size:
+                yield self.edges[self.congestion_edges[lo]]
+                continue
+            middle = (lo + hi) // 2
+            stack.append((2 * node + 1, middle, hi))
+            stack.append((2 * node, lo, middle))
+
+    def get_congested_edges(self, _time):
+        return list(self.iter_congested_edges(_time))
+
+    def get_traffic_history(self, edge):
+        """
+        Return the list of (time, traffic) where the traffic on edge changes
+        """
+        start, end = self.get_edge_range(edge)
+        return zip(self.breakpoints[start:end].tolist(), self.values[start:end].tolist())
@@ -1 +1,5 @@
-from Simulator import FromEdgeDescriptionSimulator
+from Simulator import FromEdgeDescriptionSimulator, CohortSimulator, DynamicRoutingSimulator
+from QueueSimulator import QueueSimulator
+from PartitionedSimulator import PartitionedSimulator
+from EventLog import EventLog
+from TrafficIndex import TrafficIndex
@@ -89,3 +89,30 @@ class DriversGraph(nx.Graph):
         Iterate every drivers
         """
         return self.nodes_iter()
+
+    def add_interaction(self, driver, other, edge):
+        """
+        driver and other can drive on edge at the same time: they are linked, and the shared edges are stored in the
+        link's attribute "edges"
+        """
+        if not self.has_edge(driver, other):
+            self.add_edge(driver, other, edges=set())
+        self[driver][other]['edges'].add(edge)
+
+    def get_sub_drivers_graph(self, drivers):
+        """
+        Return the DriversGraph containing only the given drivers and their interactions
+        """
+        drivers_graph = DriversGraph()
+        for driver in drivers:
+            drivers_graph.add_driver(driver, attr_dict=dict(self.node[driver]))
+        for driver, other, data in self.edges_iter(drivers, data=True):
+            if drivers_graph.has_driver(other):
+                drivers_graph.add_edge(driver, other, **data)
+        return drivers_graph
+
+    def get_independent_drivers(self):
+        """
+        Return the lists of drivers linked by interactions (connected components), the largest first
+        """
+        return sorted(map(list, nx.connected_components(self)), key=len, reverse=True)
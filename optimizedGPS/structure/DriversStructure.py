@@ -12,100 +12,252 @@ We specify the safety and presence interval here as well:
    - A safety interval is specified for each driver and edge. It ensures that, if driver takes a path containing this
    edge, then driver will drive on this edge during an interval which is contained in this safety interval.
 """
+import ctypes
+import logging
+import multiprocessing
 import sys
-from collections import defaultdict
+import time
 
+import networkx as nx
+import numpy as np
 from sortedcontainers import SortedSet
 
+from Driver import Driver
+
+log = logging.getLogger(__name__)
+
+# Read-only data shared by the worker processes of compute_optimal_safety_intervals. Set once per worker by
+# `_initialize_worker`.
+_shared = {}
+
+
+def _initialize_worker(drivers_structure, edges, min_traffics, max_traffics):
+    """
+    The workers are forked: drivers_structure is inherited and never pickled, and the traffics are stored in shared
+    memory, so that the workers read the values written by the main process at each round.
+    """
+    _shared['drivers_structure'] = drivers_structure
+    _shared['edges'] = edges
+    _shared['min_traffics'] = min_traffics
+    _shared['max_traffics'] = max_traffics
+
+
+def _compute_shared_driver_intervals(i):
+    return _shared['drivers_structure'].compute_driver_intervals(
+        i, _shared['edges'], _shared['min_traffics'], _shared['max_traffics'])
+
+
+class DriversEdgesValues(object):
+    """
+    Read-only values for every driver and edge, stored as an array (drivers, edges).
+    Read as values[driver][edge] or values[driver, edge]: unknown drivers or edges give the default value.
+    """
+    def __init__(self, values, drivers_index, edges_index, default=0):
+        self.values = values
+        self.drivers_index = drivers_index
+        self.edges_index = edges_index
+        self.default = default
+
+    def get(self, driver, edge):
+        i, j = self.drivers_index.get(driver), self.edges_index.get(edge)
+        if i is None or j is None or i >= self.values.shape[0] or j >= self.values.shape[1]:
+            return self.default
+        return self.values[i, j].item()
+
+    def __getitem__(self, key):
+        if isinstance(key, Driver):
+            return DriverValues(self, key)
+        return self.get(*key)
+
+
+class DriverValues(object):
+    """ The values of DriversEdgesValues for one driver """
+    def __init__(self, values, driver):
+        self.values = values
+        self.driver = driver
+
+    def __getitem__(self, edge):
+        return self.values.get(self.driver, edge)
+
 
 class DriversStructure(object):
+    """
+    Drivers and edges are indexed by their row and column in arrays of shape (drivers, edges): reading a missing
+    driver or edge never allocates anything. Drivers and edges are indexed the first time a value is set for them,
+    and the arrays grow by doubling their capacity.
+    """
     def __init__(self, graph, drivers_graph, horizon=sys.maxint):
         self.graph = graph  # road network structure
         self.drivers_graph = drivers_graph  # drivers graph
         self.horizon = horizon  # no possible time greater than this value
 
-        # set of edges unreachable for driver
-        self.unreachable_edges = defaultdict(lambda: defaultdict(lambda: 0))
-        # for every driver and edge, if the value is not None, it represents the only possible starting times
-        self.starting_times = defaultdict(lambda: defaultdict(lambda: None))
-        # for every driver and edge, if the value is not None, it represents the only possible ending times
-        self.ending_times = defaultdict(lambda: defaultdict(lambda: None))
+        # index of each driver (rows) and each edge (columns)
+        self.drivers, self.drivers_index = [], {}
+        self.edges, self.edges_index = [], {}
+
+        # True if the edge is unreachable for driver
+        self.unreachable_edges = np.zeros((0, 0), dtype=bool)
+        # For every driver and edge, a pair of times (start, end). NaN means not set
+        self.presence_intervals = np.full((0, 0, 2), np.nan)
+        self.safety_intervals = np.full((0, 0, 2), np.nan)
+
+        # for every (driver index, edge index), if set, the only possible starting times
+        self.starting_times = {}
+        # for every (driver index, edge index), if set, the only possible ending times
+        self.ending_times = {}
+
+        # for every driver, the earliest and latest times at which he can reach each node (see compute_reaching_times)
+        self.reaching_times = {}
+        # for every round of compute_optimal_safety_intervals, what has been recomputed
+        self.rounds_statistics = []
+
+        self.index(drivers_graph.get_all_drivers(), graph.edges_iter())
+
+    # ----------------------------------------------------------------------------------------
+    # ---------------------------------- INDEXES ---------------------------------------------
+    # ----------------------------------------------------------------------------------------
 
-        # For every driver and edge, we specify a pair of int
-        self.presence_interval = defaultdict(lambda: defaultdict(lambda: (None, None)))
-        self.safety_interval = defaultdict(lambda: defaultdict(lambda: (None, None)))
+    def index(self, drivers=(), edges=()):
+        """
+        Give an index to every new driver and edge, and grow the arrays if needed
+        """
+        for driver in drivers:
+            if driver not in self.drivers_index:
+                self.drivers_index[driver] = len(self.drivers)
+                self.drivers.append(driver)
+        for edge in edges:
+            if edge not in self.edges_index:
+                self.edges_index[edge] = len(self.edges)
+                self.edges.append(edge)
+        shape = self.unreachable_edges.shape
+        if len(self.drivers) > shape[0] or len(self.edges) > shape[1]:
+            shape = (
+                max(len(self.drivers), 2 * shape[0]) if len(self.drivers) > shape[0] else shape[0],
+                max(len(self.edges), 2 * shape[1]) if len(self.edges) > shape[1] else shape[1]
+            )
+            self.unreachable_edges = self.resize(self.unreachable_edges, shape, False)
+            self.presence_intervals = self.resize(self.presence_intervals, shape + (2,), np.nan)
+            self.safety_intervals = self.resize(self.safety_intervals, shape + (2,), np.nan)
+
+    @classmethod
+    def resize(cls, array, shape, default):
+        resized = np.full(shape, default, dtype=array.dtype)
+        resized[:array.shape[0], :array.shape[1]] = array
+        return resized
+
+    def get_indexes(self, driver, edge, create=False):
+        """
+        Return the indexes of driver and edge. If one of them has no index, we return None unless create is True
+        """
+        if create is True and (driver not in self.drivers_index or edge not in self.edges_index):
+            self.index((driver,), (edge,))
+        i, j = self.drivers_index.get(driver), self.edges_index.get(edge)
+        return (i, j) if i is not None and j is not None else None
+
+    @classmethod
+    def to_time(cls, value):
+        """ convert a stored time (float): None if not set, integers are returned as int """
+        if value != value:
+            return None
+        return int(value) if value.is_integer() else value
+
+    # ----------------------------------------------------------------------------------------
+    # ---------------------------------- SETTERS ---------------------------------------------
+    # ----------------------------------------------------------------------------------------
 
     def set_unreachable_edge_to_driver(self, driver, *edges):
         """
         Set an edge as unreachable for a driver
         """
         for edge in edges:
-            self.unreachable_edges[driver][edge] = 1
-            if driver in self.starting_times and edge in self.starting_times[driver]:
-                del self.starting_times[driver][edge]
-            if driver in self.ending_times and edge in self.ending_times[driver]:
-                del self.ending_times[driver][edge]
+            indexes = self.get_indexes(driver, edge, create=True)
+            self.unreachable_edges[indexes] = True
+            self.starting_times.pop(indexes, None)
+            self.ending_times.pop(indexes, None)
 
     def set_reachable_edge_to_driver(self, driver, *edges):
         """ Set an edge as reachable for a driver """
         for edge in edges:
-            self.unreachable_edges[driver][edge] = 0
+            indexes = self.get_indexes(driver, edge)
+            if indexes is not None:
+                self.unreachable_edges[indexes] = False
 
     def is_edge_reachable_by_driver(self, driver, edge):
         """ return True if the edge is reachable by the driver """
-        return self.unreachable_edges[driver][edge] != 1
+        indexes = self.get_indexes(driver, edge)
+        return indexes is None or not self.unreachable_edges[indexes]
 
     def add_starting_times(self, driver, edge, *starting_times):
         """ Add the given starting times to the set of possible starting times for driver """
-        if self.starting_times[driver][edge] is None:
-            self.starting_times[driver][edge] = SortedSet()
-        self.starting_times[driver][edge].update(starting_times)
+        indexes = self.get_indexes(driver, edge, create=True)
+        self.starting_times.setdefault(indexes, SortedSet()).update(starting_times)
 
     def add_ending_times(self, driver, edge, *ending_times):
         """ Add the given ending times to the set of possible ending times for driver """
-        if self.ending_times[driver][edge] is None:
-            self.ending_times[driver][edge] = SortedSet()
-        self.ending_times[driver][edge].update(ending_times)
+        indexes = self.get_indexes(driver, edge, create=True)
+        self.ending_times.setdefault(indexes, SortedSet()).update(ending_times)
 
     def add_safety_interval(self, driver, edge, start=None, end=None):
         """
         If start or end is None, we don't modify the actual value
         """
-        safety_interval = (
-            self.safety_interval[driver][edge][0] if start is None else start,
-            self.safety_interval[driver][edge][1] if end is None else end
-        )
-        self.safety_interval[driver][edge] = safety_interval
+        if start is None and end is None:
+            return
+        indexes = self.get_indexes(driver, edge, create=True)
+        if start is not None:
+            self.safety_intervals[indexes][0] = start
+        if end is not None:
+            self.safety_intervals[indexes][1] = end
 
     def add_presence_interval(self, driver, edge, start=None, end=None):
         """
         If start or end is None, we don't modify the actual value
         """
-        presence_interval = (
-            self.presence_interval[driver][edge][0] if start is None else start,
-            self.presence_interval[driver][edge][1] if end is None else end
-        )
-        self.presence_interval[driver][edge] = presence_interval
+        if start is None and end is None:
+            return
+        indexes = self.get_indexes(driver, edge, create=True)
+        if start is not None:
+            self.presence_intervals[indexes][0] = start
+        if end is not None:
+            self.presence_intervals[indexes][1] = end
+
+    # ----------------------------------------------------------------------------------------
+    # ---------------------------------- GETTERS ---------------------------------------------
+    # ----------------------------------------------------------------------------------------
+
+    def get_explicit_starting_times(self, driver, edge):
+        """ Return the set of possible starting times for driver on edge, None if it has not been set """
+        return self.starting_times.get(self.get_indexes(driver, edge))
+
+    def get_explicit_ending_times(self, driver, edge):
+        """ Return the set of possible ending times for driver on edge, None if it has not been set """
+        return self.ending_times.get(self.get_indexes(driver, edge))
 
     def get_starting_times(self, driver, edge):
         """ Return the possible starting times for driver on edge. If None return every integer up to horizon """
-        if self.starting_times[driver][edge] is None:
-            return range(self.horizon + 1)
-        return self.starting_times[driver][edge]
+        times = self.get_explicit_starting_times(driver, edge)
+        return range(self.horizon + 1) if times is None else times
 
     def get_ending_times(self, driver, edge):
         """ Return the possible ending times for driver on edge. If None return every integer up to horizon """
-        if self.ending_times[driver][edge] is None:
-            return range(self.horizon + 1)
-        return self.ending_times[driver][edge]
+        times = self.get_explicit_ending_times(driver, edge)
+        return range(self.horizon + 1) if times is None else times
 
     def get_safety_interval(self, driver, edge):
         """ return the safety interval for driver and edge """
-        return self.safety_interval[driver][edge]
+        indexes = self.get_indexes(driver, edge)
+        if indexes is None:
+            return None, None
+        start, end = self.safety_intervals[indexes].tolist()
+        return self.to_time(start), self.to_time(end)
 
     def get_presence_interval(self, driver, edge):
         """ return the presence interval for driver and edge """
-        return self.presence_interval[driver][edge]
+        indexes = self.get_indexes(driver, edge)
+        if indexes is None:
+            return None, None
+        start, end = self.presence_intervals[indexes].tolist()
+        return self.to_time(start), self.to_time(end)
 
     def get_safety_starting_time(self, driver, edge):
         """ return the starting time of the safety interval for driver and edge """
@@ -127,8 +279,8 @@ class DriversStructure(object):
 
     def iter_starting_times(self, driver, edge):
         """ iterator version of get_starting_times """
-        min_starting_time = self.safety_interval[driver][edge][0] or 0
-        times = self.starting_times[driver][edge]
+        min_starting_time = self.get_safety_interval(driver, edge)[0] or 0
+        times = self.get_explicit_starting_times(driver, edge)
         times = times if times is not None else xrange(driver.time, self.horizon + 1)
         for starting_time in times:
             if starting_time >= min_starting_time:
@@ -136,8 +288,8 @@ class DriversStructure(object):
 
     def iter_ending_times(self, driver, edge, starting_time=-1):
         """ iterator version of get_ending_times """
-        max_ending_time = self.safety_interval[driver][edge][1] or self.horizon
-        times = self.ending_times[driver][edge]
+        max_ending_time = self.get_safety_interval(driver, edge)[1] or self.horizon
+        times = self.get_explicit_ending_times(driver, edge)
         times = times if times is not None else xrange(self.horizon + 1)
         for ending_time in times:
             if starting_time < ending_time <= max_ending_time:
@@ -145,7 +297,7 @@ class DriversStructure(object):
 
     def iter_time_intervals(self, driver, edge):
         """ Return the possible times interval on which driver could be on edge """
-        ending_times = self.ending_times[driver][edge]
+        ending_times = self.get_explicit_ending_times(driver, edge)
         ending_times = set(ending_times) if ending_times is not None else None
         for starting_time in self.iter_starting_times(driver, edge):
             for wtime in self.graph.iter_possible_waiting_time(edge, max_waiting_time=self.horizon - starting_time):
@@ -180,102 +332,251 @@ class DriversStructure(object):
             if self.is_edge_reachable_by_driver(driver, edge):
                 yield edge
 
-    def compute_minimum_traffics(self):
+    def get_bounds_arrays(self, edges=None):
+        """
+        Return the indexes of the drivers in drivers_graph and of edges (every edge of graph if None), and for them
+        (arrays of shape (drivers, edges)):
+          - the safety starting and ending times (see get_safety_starting_time, get_safety_ending_time)
+          - the presence starting and ending times (see get_presence_starting_time, get_presence_ending_time)
+          - True where the edge is reachable by the driver
+        """
+        drivers = list(self.drivers_graph.get_all_drivers())
+        self.index(drivers, self.graph.edges_iter())
+        rows = np.array([self.drivers_index[driver] for driver in drivers], dtype=np.int64)
+        if edges is None:
+            edges = self.graph.edges_iter()
+        columns = np.array([self.edges_index[edge] for edge in edges], dtype=np.int64)
+        safety = self.safety_intervals[rows[:, None], columns[None, :]]
+        starts, ends = safety[..., 0], safety[..., 1]
+        return (
+            rows, columns,
+            np.where(np.isnan(starts), 0, starts), np.where(np.isnan(ends), self.horizon, ends),
+            np.where(np.isnan(starts), self.horizon, starts), np.where(np.isnan(ends), 0, ends),
+            ~self.unreachable_edges[rows[:, None], columns[None, :]]
+        )
+
+    @classmethod
+    def count_intervals(cls, starts, ends, length):
+        """
+        For every integer time s in [0, length), count the intervals such that start < s <= end
+        """
+        lows = np.clip(np.floor(starts) + 1, 0, length).astype(np.int64)
+        highs = np.clip(np.floor(ends) + 1, 0, length).astype(np.int64)
+        valid = lows < highs
+        diff = np.zeros(length + 1, dtype=np.int64)
+        np.add.at(diff, lows[valid], 1)
+        np.add.at(diff, highs[valid], -1)
+        return np.cumsum(diff)[:length]
+
+    @classmethod
+    def build_sparse_table(cls, values, function):
+        """
+        Return the levels of the sparse table of values: level k holds function (np.minimum or np.maximum) of every
+        range of length 2 ** k
+        """
+        table = [values]
+        while 2 ** len(table) <= len(values):
+            length = 2 ** (len(table) - 1)
+            table.append(function(table[-1][:-length], table[-1][length:]))
+        return table
+
+    @classmethod
+    def get_range_extrema(cls, table, lows, highs, function, default):
+        """
+        For every i, return function of values[lows[i]:highs[i] + 1], default if the range is empty.
+        table is the sparse table of values (see build_sparse_table).
+        """
+        result = np.full(len(lows), default, dtype=np.float64)
+        valid = lows <= highs
+        lows, highs = lows[valid], highs[valid]
+        levels = np.floor(np.log2(highs - lows + 1)).astype(np.int64)
+        extrema = np.full(len(lows), default, dtype=np.float64)
+        for level in np.unique(levels):
+            mask = levels == level
+            extrema[mask] = function(table[level][lows[mask]], table[level][highs[mask] - 2 ** level + 1])
+        result[valid] = extrema
+        return result
+
+    def compute_traffics(self, starts, ends, windows_starts, windows_ends, reachable, function, default):
+        """
+        For each driver and reachable edge, the extremum (function) over the integer times of the driver's window of
+        the number of other drivers d such that starts[d] < time <= ends[d]. It is 0 if the window has no integer
+        time.
+
+        Per edge, the number of drivers at each time is computed once with a difference array, the driver's own
+        interval is removed by splitting his window in three ranges, and the ranges' extrema are answered by a
+        sparse table: O(T log T + D) per edge instead of O(D^2 T).
+        """
+        traffics = np.zeros(starts.shape, dtype=np.int64)
+        for j in xrange(starts.shape[1]):
+            drivers = np.flatnonzero(reachable[:, j])
+            if len(drivers) == 0:
+                continue
+            lows = np.ceil(windows_starts[drivers, j]).astype(np.int64)
+            highs = np.floor(windows_ends[drivers, j]).astype(np.int64)
+            counts = self.count_intervals(starts[:, j], ends[:, j], max(int(highs.max()) + 1, 0))
+            table = self.build_sparse_table(counts, function)
+            # the driver's own interval, and the parts of his window before, inside and after it
+            own_lows = np.floor(starts[drivers, j]).astype(np.int64) + 1
+            own_highs = np.floor(ends[drivers, j]).astype(np.int64)
+            before = self.get_range_extrema(table, lows, np.minimum(highs, own_lows - 1), function, default)
+            inside = self.get_range_extrema(
+                table, np.maximum(lows, own_lows), np.minimum(highs, own_highs), function, default) - 1
+            after = self.get_range_extrema(table, np.maximum(lows, own_highs + 1), highs, function, default)
+            extrema = function(function(before, inside), after)
+            traffics[drivers, j] = np.where(np.isfinite(extrema), extrema, 0)
+        return traffics
+
+    def compute_drivers_interactions(self):
+        """
+        Two drivers interact if they can drive on the same edge at the same time, considering their safety intervals:
+        otherwise none of them can have any influence on the other one's traffic.
+        Every interaction is added to drivers_graph (see DriversGraph.add_interaction).
+
+        :return: number of interactions (pairs of drivers and edge)
+        """
+        rows, columns, safety_starts, safety_ends, _, _, reachable = self.get_bounds_arrays()
+        count = 0
+        for j in xrange(len(columns)):
+            edge = self.edges[columns[j]]
+            drivers = np.flatnonzero(reachable[:, j])
+            drivers = drivers[np.argsort(safety_starts[drivers, j], kind='mergesort')]
+            starts, ends = safety_starts[drivers, j], safety_ends[drivers, j]
+            # the drivers after p starting before p's end
+            lasts = np.searchsorted(starts, ends, side='right').tolist()
+            drivers = [self.drivers[i] for i in rows[drivers].tolist()]
+            for p in xrange(len(drivers)):
+                for q in xrange(p + 1, lasts[p]):
+                    self.drivers_graph.add_interaction(drivers[p], drivers[q], edge)
+                count += max(lasts[p] - p - 1, 0)
+        return count
+
+    def compute_minimum_traffics(self, edges=None):
         """
         Considering the presence and safety interval of every driver, we compute for a driver and an edge the minimum
-        traffic that this driver could see on this edge
+        traffic that this driver could see on this edge.
+        If edges is given, only the traffics on these edges are computed, the other ones are 0.
         """
-        min_traffics = defaultdict(lambda: defaultdict(lambda: 0))
-        for driver in self.drivers_graph.get_all_drivers():
-            for edge in self.graph.edges_iter():
-                if not self.is_edge_reachable_by_driver(driver, edge):
-                    continue
-                min_traffics[driver][edge] = min(
-                    [
-                        sum([
-                            1 * (self.get_presence_starting_time(d, edge) < s <= self.get_presence_ending_time(d, edge))
-                            for d in self.drivers_graph.get_all_drivers() if d != driver
-                        ])
-                        for s in xrange(
-                            self.get_safety_starting_time(driver, edge),
-                            self.get_presence_starting_time(driver, edge) + 1
-                        )
-                    ]
-                )
-        return min_traffics
-
-    def compute_maximum_traffics(self):
+        rows, columns, safety_starts, _, presence_starts, presence_ends, reachable = self.get_bounds_arrays(edges=edges)
+        min_traffics = np.zeros((len(self.drivers), len(self.edges)), dtype=np.int64)
+        min_traffics[rows[:, None], columns[None, :]] = self.compute_traffics(
+            presence_starts, presence_ends, safety_starts, presence_starts, reachable, np.minimum, np.inf)
+        return DriversEdgesValues(min_traffics, self.drivers_index, self.edges_index)
+
+    def compute_maximum_traffics(self, edges=None):
         """
         Considering the presence and safety interval of every driver, we compute for a driver and an edge the maximum
-        traffic that this driver could see on this edge
+        traffic that this driver could see on this edge.
+        If edges is given, only the traffics on these edges are computed, the other ones are 0.
+        """
+        rows, columns, safety_starts, safety_ends, presence_starts, _, reachable = self.get_bounds_arrays(edges=edges)
+        max_traffics = np.zeros((len(self.drivers), len(self.edges)), dtype=np.int64)
+        max_traffics[rows[:, None], columns[None, :]] = self.compute_traffics(
+            safety_starts, safety_ends, safety_starts, presence_starts, reachable, np.maximum, - np.inf)
+        return DriversEdgesValues(max_traffics, self.drivers_index, self.edges_index)
+
+    def get_reachable_graph(self, driver, **traffics):
+        """
+        Return the graph of the edges that driver can reach from his starting node.
+        For each keyword argument name=traffics, the edges have an attribute name: their driving time under traffics.
         """
-        max_traffics = defaultdict(lambda: defaultdict(lambda: 0))
-        for driver in self.drivers_graph.get_all_drivers():
-            for edge in self.graph.edges_iter():
+        reachable_graph = nx.DiGraph()
+        reachable_graph.add_node(driver.start)
+        stack = [driver.start]
+        while stack:
+            node = stack.pop()
+            for successor in self.graph.successors_iter(node):
+                edge = node, successor
                 if not self.is_edge_reachable_by_driver(driver, edge):
                     continue
-                max_traffics[driver][edge] = max(
-                    [
-                        sum([
-                            1 * (self.get_safety_starting_time(d, edge) < s <= self.get_safety_ending_time(d, edge))
-                            for d in self.drivers_graph.get_all_drivers() if d != driver
-                        ])
-                        for s in xrange(
-                            self.get_safety_starting_time(driver, edge),
-                            self.get_presence_starting_time(driver, edge) + 1
-                        )
-                    ]
-                )
-        return max_traffics
+                if successor not in reachable_graph:
+                    stack.append(successor)
+                cong_function = self.graph.get_congestion_function(*edge)
+                reachable_graph.add_edge(node, successor, **{
+                    name: cong_function(values[driver][edge]) for name, values in traffics.iteritems()})
+        return reachable_graph
+
+    def compute_earliest_times(self, driver, reachable_graph, weight):
+        """
+        Return for each node of reachable_graph the earliest time at which driver can reach it: shortest paths from
+        his starting node, the edges weighted by their attribute weight.
+        """
+        return {
+            node: driver.time + length
+            for node, length in nx.single_source_dijkstra_path_length(
+                reachable_graph, driver.start, weight=weight).iteritems()
+        }
+
+    def compute_latest_times(self, driver, reachable_graph, weight):
+        """
+        Return for each node of reachable_graph the latest time, bounded by the horizon, at which driver can reach it.
+
+        Driver may drive through cycles, so the latest time is the longest walk from his starting node: we compute the
+        longest paths in the acyclic graph of the strongly connected components. A component containing an edge of
+        positive weight can be driven through as long as wanted, so the nodes after it are reached at the horizon.
+        """
+        components = nx.condensation(reachable_graph)
+        mapping = components.graph['mapping']
+        unbounded, incoming = set(), {component: [] for component in components.nodes_iter()}
+        for source, target, data in reachable_graph.edges_iter(data=True):
+            if mapping[source] == mapping[target]:
+                if data[weight] > 0:
+                    unbounded.add(mapping[source])
+            else:
+                incoming[mapping[target]].append((mapping[source], data[weight]))
+
+        lengths = {}
+        for component in nx.topological_sort(components):
+            if component in unbounded:
+                lengths[component] = float('inf')
+            else:
+                lengths[component] = max([lengths[source] + w for source, w in incoming[component]] or [0])
+        return {node: min(driver.time + lengths[component], self.horizon) for node, component in mapping.iteritems()}
+
+    def compute_reaching_times(self, driver, min_traffics, max_traffics):
+        """
+        In one pass for every node, the earliest time at which driver can reach it considering the minimal traffics,
+        and the latest one considering the maximal traffics.
+        The result is stored in self.reaching_times.
+
+        :return: two dictionaries node -> time. Nodes that driver can't reach are missing.
+        """
+        reachable_graph = self.get_reachable_graph(driver, min_time=min_traffics, max_time=max_traffics)
+        self.reaching_times[driver] = (
+            self.compute_earliest_times(driver, reachable_graph, 'min_time'),
+            self.compute_latest_times(driver, reachable_graph, 'max_time')
+        )
+        return self.reaching_times[driver]
 
     def compute_minimum_starting_time(self, driver, edge, min_traffics):
         """
         Compute the shortest path from starting node of driver to edge, and return the driving time on this path
         considering the minimal traffic
         """
-        try:
-            return driver.time + sum(
-                map(
-                    lambda e: self.graph.get_congestion_function(*e)(min_traffics[driver][e]),
-                    self.graph.iter_edges_in_path(self.graph.get_shortest_path(
-                        driver.start, edge[0],
-                        key=lambda *x: self.graph.get_congestion_function(*x)(min_traffics[driver][x]),
-                        next_choice=lambda *x: self.is_edge_reachable_by_driver(driver, x)
-                    ))
-                )
-            )
-        except StopIteration:
-            return None
+        reachable_graph = self.get_reachable_graph(driver, min_time=min_traffics)
+        return self.compute_earliest_times(driver, reachable_graph, 'min_time').get(edge[0])
 
     def compute_maximum_starting_time(self, driver, edge, max_traffics):
         """
         Compute the longest path from starting node of driver to edge, and return the driving time on this path
-        considering the maximal traffic
+        considering the maximal traffic (see compute_latest_times)
         """
-        try:
-            return driver.time + sum(
-                map(
-                    lambda e: self.graph.get_congestion_function(*e)(max_traffics[driver][e]),
-                    self.graph.iter_edges_in_path(self.graph.get_shortest_path(
-                        driver.start, edge[0],
-                        key=lambda *x: - self.graph.get_congestion_function(*x)(max_traffics[driver][x]),
-                        next_choice=lambda *x: self.is_edge_reachable_by_driver(driver, x)
-                    ))
-                )
-            )
-        except StopIteration:
-            return None
+        reachable_graph = self.get_reachable_graph(driver, max_time=max_traffics)
+        return self.compute_latest_times(driver, reachable_graph, 'max_time').get(edge[0])
 
-    def update_intervals(self, driver, edge, min_traffics, max_traffics):
+    def compute_intervals(self, driver, edge, min_traffics, max_traffics, reaching_times=None):
         """
         Given the minimum and maximum traffics, compute the minimum/maximum starting/ending time for driver on edge.
-        Then replace the old presence and safety intervals by the new values.
+        reaching_times is the result of compute_reaching_times for driver, if already computed.
 
-        return True if the new values are different to the old ones.
+        :return: min_starting_time, max_starting_time, min_ending_time, max_ending_time. None if not computable
         """
         cong_function = self.graph.get_congestion_function(*edge)
-        min_starting_time = self.compute_minimum_starting_time(driver, edge, min_traffics)
-        max_starting_time = self.compute_maximum_starting_time(driver, edge, max_traffics)
+        if reaching_times is None:
+            min_starting_time = self.compute_minimum_starting_time(driver, edge, min_traffics)
+            max_starting_time = self.compute_maximum_starting_time(driver, edge, max_traffics)
+        else:
+            min_starting_time, max_starting_time = reaching_times[0].get(edge[0]), reaching_times[1].get(edge[0])
         if min_starting_time is not None:
             min_ending_time = min_starting_time + cong_function(min_traffics[driver][edge])
         else:
@@ -284,7 +585,14 @@ class DriversStructure(object):
             max_ending_time = max_starting_time + cong_function(max_traffics[driver][edge])
         else:
             max_ending_time = None
+        return min_starting_time, max_starting_time, min_ending_time, max_ending_time
+
+    def set_intervals(self, driver, edge, min_starting_time, max_starting_time, min_ending_time, max_ending_time):
+        """
+        Replace the old presence and safety intervals by the new values (see compute_intervals).
 
+        return True if the new values are different to the old ones.
+        """
         safety_interval = self.get_safety_interval(driver, edge)
         presence_interval = self.get_presence_interval(driver, edge)
         self.add_safety_interval(driver, edge, min_starting_time, max_ending_time)
@@ -293,19 +601,128 @@ class DriversStructure(object):
         return safety_interval != self.get_safety_interval(driver, edge) or \
                presence_interval != self.get_presence_interval(driver, edge)
 
-    def compute_optimal_safety_intervals(self):
+    def update_intervals(self, driver, edge, min_traffics, max_traffics, reaching_times=None):
+        """
+        Given the minimum and maximum traffics, compute the minimum/maximum starting/ending time for driver on edge.
+        Then replace the old presence and safety intervals by the new values.
+        reaching_times is the result of compute_reaching_times for driver, if already computed.
+
+        return True if the new values are different to the old ones.
+        """
+        return self.set_intervals(
+            driver, edge, *self.compute_intervals(driver, edge, min_traffics, max_traffics, reaching_times))
+
+    def compute_driver_intervals(self, i, edges, min_traffics, max_traffics):
+        """
+        Compute the reaching times of the driver of index i, and his intervals on every edge of edges.
+        Nothing is modified: this is run by the worker processes in parallel mode.
+
+        :return: i, the reaching times, and the list of intervals (see compute_intervals)
+        """
+        driver = self.drivers[i]
+        reaching_times = self.compute_reaching_times(driver, min_traffics, max_traffics)
+        return i, reaching_times, [
+            self.compute_intervals(driver, edge, min_traffics, max_traffics, reaching_times) for edge in edges]
+
+    @classmethod
+    def share_values(cls, values):
+        """
+        Return a copy of the DriversEdgesValues values whose array is in memory shared with the forked processes
+        """
+        array = values.values
+        buffer = multiprocessing.RawArray(ctypes.c_char, max(array.nbytes, 1))
+        shared = np.frombuffer(buffer, dtype=array.dtype, count=array.size).reshape(array.shape)
+        shared[...] = array
+        return DriversEdgesValues(shared, values.drivers_index, values.edges_index, default=values.default)
+
+    def update_traffics(self, min_traffics, max_traffics, edges):
+        """
+        Recompute the minimum and maximum traffics on edges, and write them into min_traffics and max_traffics.
+
+        :return: indexes of the drivers whose traffic on one of these edges changed
+        """
+        columns = np.array([self.edges_index[edge] for edge in edges], dtype=np.int64)
+        changed = np.zeros(len(self.drivers), dtype=bool)
+        for traffics, new_traffics in ((min_traffics, self.compute_minimum_traffics(edges=edges)),
+                                       (max_traffics, self.compute_maximum_traffics(edges=edges))):
+            new_values = new_traffics.values[:, columns]
+            changed |= (traffics.values[:, columns] != new_values).any(axis=1)
+            traffics.values[:, columns] = new_values
+        return np.flatnonzero(changed)
+
+    def compute_optimal_safety_intervals(self, processes=1):
         """
         The objective is to reduce the safety_interval as much as possible.
         In a time iterations loop, considering the actual presence and safety intervals,
         we compute the minimal and maximal possible traffic on a given edge for a given driver.
         From these traffics, we can update the safety and presence intervals.
+
+        The traffics on an edge only depend on the intervals on this edge, and the intervals of a driver only on his
+        traffics: each round, we recompute the traffics on the edges where an interval changed during the previous
+        round, and update the intervals of the drivers whose traffics changed, with one search per driver (see
+        compute_reaching_times). We stop when no interval changes.
+        The work done at each round is stored in self.rounds_statistics.
+
+        :param processes: number of processes computing the drivers' intervals of a round in parallel, from the
+                          traffics of the previous round. If None, the number of cpus
         """
-        is_update_possible = True  # Boolean to know if we can still run the update
-        while is_update_possible is True:
-            is_update_possible = False
-            min_traffics = self.compute_minimum_traffics()
-            max_traffics = self.compute_maximum_traffics()
-            for driver in self.drivers_graph.get_all_drivers():
-                for edge in self.graph.edges_iter():
-                    is_update_possible = self.update_intervals(
-                        driver, edge, min_traffics, max_traffics) or is_update_possible
+        drivers = list(self.drivers_graph.get_all_drivers())
+        edges = list(self.graph.edges_iter())
+        self.index(drivers, edges)
+        self.rounds_statistics = []
+        processes = processes or multiprocessing.cpu_count()
+
+        min_traffics = self.compute_minimum_traffics()
+        max_traffics = self.compute_maximum_traffics()
+        pool = None
+        if processes > 1 and len(drivers) > 1:
+            processes = min(processes, len(drivers))
+            min_traffics, max_traffics = self.share_values(min_traffics), self.share_values(max_traffics)
+            pool = multiprocessing.Pool(
+                processes=processes,
+                initializer=_initialize_worker,
+                initargs=(self, edges, min_traffics, max_traffics)
+            )
+
+        updated_drivers = [self.drivers_index[driver] for driver in drivers]
+        changed_edges = edges
+        try:
+            while True:
+                ct = time.time()
+                if self.rounds_statistics:
+                    updated_drivers = self.update_traffics(min_traffics, max_traffics, changed_edges)
+                statistics = {'edges': len(changed_edges), 'drivers': len(updated_drivers), 'updates': 0, 'changes': 0}
+                if pool is None:
+                    results = (self.compute_driver_intervals(i, edges, min_traffics, max_traffics)
+                               for i in updated_drivers)
+                else:
+                    # the workers read the traffics while the main process waits: every result is merged before
+                    # the traffics of the next round are written
+                    results = pool.imap_unordered(
+                        _compute_shared_driver_intervals, updated_drivers,
+                        chunksize=max(len(updated_drivers) // (4 * processes), 1)
+                    )
+                changed_edges = set()
+                for i, reaching_times, intervals in results:
+                    driver = self.drivers[i]
+                    self.reaching_times[driver] = reaching_times
+                    for edge, new_intervals in zip(edges, intervals):
+                        statistics['updates'] += 1
+                        if self.set_intervals(driver, edge, *new_intervals):
+                            statistics['changes'] += 1
+                            changed_edges.add(edge)
+                statistics['time'] = time.time() - ct
+                self.rounds_statistics.append(statistics)
+                log.debug("Safety intervals round %s: %s", len(self.rounds_statistics), statistics)
+                if not changed_edges:
+                    break
+                changed_edges = list(changed_edges)
+            if pool is not None:
+                pool.close()
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
@@ -4,22 +4,36 @@
 from optimizedGPS.logger import configure
 configure()
 
+import shutil
+import sys
+import tempfile
 import unittest
 from collections import defaultdict
 
+import mock
+import numpy as np
+
 try:
     from gurobipy import Var, GRB
 except ImportError:
     Var, GRB = None, None
 
-from optimizedGPS import labels
+from optimizedGPS import labels, options
 from optimizedGPS.data.data_generator import generate_grid_data, generate_random_drivers, generate_bad_heuristic_graphs
-from optimizedGPS.problems.Heuristics import RealGPS
+from optimizedGPS.problems.Heuristics import RealGPS, ShortestPathTrafficFree
 from optimizedGPS.problems.Models import TEGModel
+from optimizedGPS.problems.PiecewiseLinear import PiecewiseLinearFunction
+from optimizedGPS.problems.PreSolver import HorizonPresolver, GlobalPreSolver, GraphReductionPresolver
+from optimizedGPS.problems.PresolveCache import PresolveCache
 from optimizedGPS.problems.Algorithms import TEGColumnGenerationAlgorithm
 from optimizedGPS.problems.simulator import FromEdgeDescriptionSimulator
+from optimizedGPS.problems.ScenarioEngine import ScenarioEngine
 from optimizedGPS.problems.Solver import Solver
-from optimizedGPS.structure import Driver, DriversGraph, GPSGraph
+from optimizedGPS.problems import SolverBackend
+from optimizedGPS.problems import labels as problem_labels
+from optimizedGPS.problems.TEGMatrix import TEGMatrix
+from optimizedGPS.problems.TEGVariables import TEGVariables
+from optimizedGPS.structure import Driver, DriversGraph, DriversStructure, GPSGraph
 
 
 class ProblemsTest(unittest.TestCase):
@@ -84,9 +98,9 @@ class ProblemsTest(unittest.TestCase):
                 graph.get_congestion_function(*edge)(
                     sum(
                         sum(
-                            model.x[model.TEGgraph.build_edge(edge, i, j), d].X
+                            model.x.get(d, edge, i, j).X
                             for j in model.drivers_structure.iter_ending_times(driver, edge, starting_time=i)
-                            if isinstance(model.x[model.TEGgraph.build_edge(edge, i, j), d], Var)
+                            if model.x.has(d, edge, i, j)
                         )
                         for d in drivers_graph.get_all_drivers()
                     )
@@ -110,9 +124,8 @@ class ProblemsTest(unittest.TestCase):
         self.assertEqual(model.get_objective_from_solution(x), 11)
 
         x = defaultdict(lambda: 0)
-        for key, var in model.x.iteritems():
-            if isinstance(var, Var):
-                x[key] = var.X
+        for (d, edge, start, end), var in model.x.iteritems():
+            x[model.TEGgraph.build_edge(edge, start, end), d] = var.X
         self.assertTrue(model.check_feasibility(x))
 
         # Check optimality
@@ -211,6 +224,44 @@ class ProblemsTest(unittest.TestCase):
 
         self.assertEqual(2 * traffic_influence + 7, simulator.get_sum_ending_time())
 
+    def test_scenario_engine(self):
+        graph = generate_grid_data(4, 4)
+        graph.set_global_congestion_function(lambda x: 3 * x + 4)
+
+        engine = ScenarioEngine(graph, seeds=range(6), processes=2, total_drivers=8)
+        engine.append_algorithm(RealGPS)
+        engine.append_algorithm(ShortestPathTrafficFree)
+        streamed = dict(engine.iter_scenarios())
+        self.assertEqual(set(streamed.iterkeys()), set(range(6)))
+
+        # The process pool gives the same results as running sequentially
+        sequential = ScenarioEngine(graph, seeds=range(6), processes=1, total_drivers=8)
+        sequential.append_algorithm(RealGPS)
+        sequential.append_algorithm(ShortestPathTrafficFree)
+        stats = sequential.run()
+        for seed, metrics in sequential.results.iteritems():
+            for algo in ["RealGPS", "ShortestPathTrafficFree"]:
+                self.assertEqual(metrics[algo]["value"], streamed[seed][algo]["value"])
+                self.assertEqual(metrics[algo]["status"], options.SUCCESS)
+
+        values = [m["RealGPS"]["value"] for m in sequential.results.itervalues()]
+        self.assertEqual(stats["RealGPS"]["status"], {"SUCCESS": 6})
+        self.assertEqual(stats["RealGPS"]["value"]["min"], min(values))
+        self.assertEqual(stats["RealGPS"]["value"]["max"], max(values))
+        self.assertAlmostEqual(stats["RealGPS"]["value"]["mean"], sum(values) / 6.)
+
+        # an algorithm failing in its constructor fails its scenarios without stopping the other ones
+        class FailingAlgorithm(RealGPS):
+            def __init__(self, graph, drivers_graph, **kwargs):
+                raise ValueError("failing constructor")
+
+        engine = ScenarioEngine(graph, seeds=range(4), processes=2, total_drivers=8)
+        engine.append_algorithm(RealGPS)
+        engine.append_algorithm(FailingAlgorithm)
+        stats = engine.run()
+        self.assertEqual(stats["RealGPS"]["status"], {"SUCCESS": 4})
+        self.assertEqual(stats["FailingAlgorithm"]["status"], {"FAILED": 4})
+
     @unittest.skipIf(Var is None, "gurobipy dependency not satisfied")
     def test_solver_shared_memory(self):
         """
@@ -254,6 +305,251 @@ class ProblemsTest(unittest.TestCase):
 
         self.assertEqual(heuristic.value - algorithm.value, annex_road_congestion + 2)
 
+    @unittest.skipIf(SolverBackend.sparse is None, "scipy dependency not satisfied")
+    def test_highs_backend_model(self):
+        model = SolverBackend.HighsModel()
+        x = model.addVar(vtype=SolverBackend.GRB.BINARY, name="x")
+        y = model.addVar(0.0, name="y")
+        constraint = model.addConstr(SolverBackend.quicksum([x, 2 * y, 1]) - x / 2 >= 3 - y, "c")
+        self.assertEqual((constraint.Sense, constraint.RHS, constraint.terms), ('>', 2, {x.index: 0.5, y.index: 3}))
+        model.chgCoeff(constraint, x, 0)
+        self.assertEqual(constraint.terms, {y.index: 3})
+        self.assertRaises(AttributeError, lambda: x.X)
+        if not SolverBackend.is_available('highs'):
+            # scipy's HiGHS interface needs Python 3: the model can't be solved
+            self.assertRaises(ImportError, model.optimize)
+
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        solutions = {}
+        for matrix in (False, True):
+            drivers_structure = DriversStructure(graph, drivers_graph, horizon=10)
+            algorithm = TEGModel(graph, drivers_graph, drivers_structure=drivers_structure, horizon=10,
+                                 backend='highs', matrix=matrix)
+            algorithm.build_model()
+            self.assertIsInstance(algorithm.model, SolverBackend.HighsModel)
+            self.assertEqual(algorithm.get_objectif(), sys.maxint)
+
+            # the heuristic's solution satisfies every constraint, and has the same value
+            A, senses, rhs = algorithm.model.get_matrix()
+            solution = np.zeros(A.shape[1])
+            for driver, edge, start, end in heuristic.iter_variable_indexes_from_optimal_solution():
+                solution[algorithm.x.get(driver, edge, start, end).index] = 1
+            lhs = A.dot(solution)
+            satisfied = np.where(senses == '<', lhs <= rhs, np.where(senses == '>', lhs >= rhs, lhs == rhs))
+            self.assertTrue(np.all(satisfied))
+            self.assertEqual(algorithm.model.objective.getValue(solution), heuristic.value)
+            solutions[matrix] = {
+                constraint.ConstrName: lhs[constraint.index] for constraint in algorithm.model.constraints}
+        for name, value in solutions[True].iteritems():
+            self.assertEqual(solutions[False][name], value)
+
+    @unittest.skipIf(not SolverBackend.is_available('highs'), "scipy >= 1.9 (Python 3) dependency not satisfied")
+    def test_highs_backend_solve(self):
+        model = SolverBackend.HighsModel()
+        x, y = model.addVar(name="x"), model.addVar(name="y")
+        constraint = model.addConstr(x + 2 * y >= 2, "c")
+        model.setObjective(x + y, SolverBackend.GRB.MINIMIZE)
+        model.optimize()
+        self.assertEqual(model.Status, SolverBackend.GRB.OPTIMAL)
+        self.assertAlmostEqual(model.ObjVal, 1)
+        self.assertAlmostEqual(constraint.Pi, 0.5)
+        self.assertAlmostEqual(x.RC, 0.5)
+
+        traffic_influence, annex_road_congestion = 2, 10
+        graph, drivers_graph = generate_bad_heuristic_graphs(traffic_influence, annex_road_congestion)
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        algorithm = TEGModel(graph, drivers_graph, horizon=11, backend='highs')
+        algorithm.build_model()
+        algorithm.solve()
+        self.assertEqual(heuristic.value - algorithm.value, annex_road_congestion + 2)
+
+    @unittest.skipIf(SolverBackend.sparse is None, "scipy dependency not satisfied")
+    def test_TEGModel_initial_solution(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        columns = set(heuristic.iter_variable_indexes_from_optimal_solution())
+
+        # from the paths, or from the complete time paths
+        for solution in (heuristic.opt_solution, dict(heuristic.iter_complete_optimal_solution())):
+            algorithm = TEGModel(graph, drivers_graph, horizon=10, backend='highs', initial_solution=solution)
+            algorithm.build_model()
+            self.assertTrue(algorithm.warm_start)
+            self.assertEqual({key for key, var in algorithm.x.iteritems() if var.Start == 1}, columns)
+            self.assertEqual(sum(var.Start == 0 for var in algorithm.x.itervalues()), len(algorithm.x) - len(columns))
+
+        # the last driver ends after the horizon
+        algorithm = TEGModel(graph, drivers_graph, horizon=3, backend='highs')
+        algorithm.build_model()
+        self.assertFalse(algorithm.warm_start)
+        self.assertEqual(algorithm.set_initial_solution(heuristic.opt_solution), 1)
+
+    @unittest.skipIf(not SolverBackend.is_available(SolverBackend.get_default_backend()),
+                     "solver dependency not satisfied")
+    def test_TEGModel_warm_start(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+
+        statistics = {}
+        for initial_solution in (None, heuristic.opt_solution):
+            algorithm = TEGModel(graph, drivers_graph, horizon=12, initial_solution=initial_solution)
+            algorithm.solve()
+            self.assertLessEqual(algorithm.value, heuristic.value)
+            statistics[initial_solution is not None] = algorithm.solving_statistics
+        for warm_start, stats in statistics.iteritems():
+            self.assertEqual(stats['warm_start'], warm_start)
+            self.assertIsNotNone(stats['first_incumbent_time'])
+            self.assertIsNotNone(stats['optimality_time'])
+            self.assertLessEqual(stats['first_incumbent_time'], stats['optimality_time'])
+
+    @unittest.skipIf(SolverBackend.sparse is None, "scipy dependency not satisfied")
+    def test_TEGModel_lazy_constraints(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        columns = list(heuristic.iter_variable_indexes_from_optimal_solution())
+
+        eager = TEGModel(graph, drivers_graph, horizon=10, backend='highs')
+        eager.build_model()
+        algorithm = TEGModel(graph, drivers_graph, horizon=10, backend='highs', lazy=True)
+        algorithm.build_model()
+        waiting_time_constraints = eager.count[problem_labels.LOWER_WAITING_TIME] + \
+            eager.count[problem_labels.UPPER_WAITING_TIME]
+        self.assertEqual(algorithm.model.NumConstrs, eager.model.NumConstrs - waiting_time_constraints)
+        self.assertNotIn(problem_labels.LOWER_WAITING_TIME, algorithm.count)
+
+        self.assertEqual(list(algorithm.iter_violated_waiting_time_constraints({key: 1 for key in columns})), [])
+        # both drivers entering edge ("0", "2") at 0 wait 2: one of them waiting 4 violates his constraints
+        driver = next(key[0] for key in columns if key[1:] == (("0", "2"), 0, 2))
+        late_columns = {key: 1 for key in columns if key[0] is not driver or key[1] != ("0", "2")}
+        late_columns[driver, ("0", "2"), 0, 4] = 1
+        self.assertEqual(list(algorithm.iter_violated_waiting_time_constraints(late_columns)),
+                         [(driver, ("0", "2"), 0)])
+        algorithm.add_waiting_time_constraints(driver, ("0", "2"), 0)
+        self.assertEqual(algorithm.count[problem_labels.LOWER_WAITING_TIME], 1)
+        self.assertEqual(algorithm.count[problem_labels.UPPER_WAITING_TIME], 1)
+
+    @unittest.skipIf(not SolverBackend.is_available(SolverBackend.get_default_backend()),
+                     "solver dependency not satisfied")
+    def test_TEGModel_lazy_solve(self):
+        traffic_influence, annex_road_congestion = 2, 10
+        graph, drivers_graph = generate_bad_heuristic_graphs(traffic_influence, annex_road_congestion)
+        eager = TEGModel(graph, drivers_graph, horizon=11)
+        eager.solve()
+        algorithm = TEGModel(graph, drivers_graph, horizon=11, lazy=True)
+        algorithm.solve()
+
+        self.assertEqual(algorithm.value, eager.value)
+        self.assertGreater(algorithm.solving_statistics['separation_rounds'], 0)
+        self.assertEqual(algorithm.solving_statistics['lazy_constraints'],
+                         algorithm.count[problem_labels.LOWER_WAITING_TIME] +
+                         algorithm.count[problem_labels.UPPER_WAITING_TIME])
+        self.assertEqual(list(algorithm.iter_violated_waiting_time_constraints()), [])
+
+    def test_piecewise_linear_function(self):
+        func = PiecewiseLinearFunction.from_function(lambda x: x ** 4 + 1, 3)
+        self.assertEqual(func.breakpoints.tolist(), [0, 1, 2, 3])
+        self.assertEqual(func.values.tolist(), [1, 2, 17, 82])
+        self.assertEqual(func(1.5), 9.5)
+        self.assertFalse(func.is_linear())
+
+        func = PiecewiseLinearFunction.from_function(lambda x: 2 * x + 1, 4, number_of_breakpoints=3)
+        self.assertEqual(func.breakpoints.tolist(), [0, 2, 4])
+        self.assertTrue(func.is_linear())
+        self.assertEqual(func.get_slope(), 2)
+        self.assertRaises(ValueError, PiecewiseLinearFunction.from_function, lambda x: x, 4, 1)
+        # with more breakpoints than integers, the integers
+        self.assertEqual(PiecewiseLinearFunction.from_function(lambda x: x ** 2, 3, 5).breakpoints.tolist(),
+                         [0, 1, 2, 3])
+        self.assertEqual(PiecewiseLinearFunction.from_function(lambda x: x ** 2, 20, 5).breakpoints.tolist(),
+                         [0, 5, 10, 15, 20])
+
+    @unittest.skipIf(SolverBackend.sparse is None, "scipy dependency not satisfied")
+    def test_TEGModel_piecewise_linear_congestion(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        graph.set_edge_property("1", "3", labels.CONGESTION_FUNC, lambda x: x ** 2 + 1)
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        columns = list(heuristic.iter_variable_indexes_from_optimal_solution())
+
+        self.assertRaises(ValueError, TEGModel, graph, drivers_graph, horizon=10, backend='highs',
+                          congestion_formulation=TEGModel.SOS2)
+        self.assertEqual(TEGModel(graph, drivers_graph, horizon=10, breakpoints=3)
+                         .get_congestion_approximation(("1", "3")).breakpoints.tolist(), [0, 1.5, 3])
+
+        def get_violated_constraints(algorithm, columns):
+            """ the approximation's variables are set from the traffic """
+            solution = np.zeros(algorithm.model.NumVars)
+            for key in columns:
+                solution[algorithm.x.get(*key).index] = 1
+            variables = {var.VarName: var.index for var in algorithm.model.variables}
+            for edge, time in algorithm.congestion_expressions:
+                traffic = sum(1 for _, e, start, end in columns if e == edge and start < time <= end)
+                for k in xrange(algorithm.get_congestion_approximation(edge).number_of_breakpoints() - 1):
+                    solution[variables['d[%s,%s,%s]' % (str(edge), time, k)]] = 1 * (k < traffic)
+                    if k > 0:
+                        solution[variables['z[%s,%s,%s]' % (str(edge), time, k - 1)]] = 1 * (k < traffic)
+            A, senses, rhs = algorithm.model.get_matrix()
+            lhs = A.dot(solution)
+            satisfied = np.where(senses == '<', lhs <= rhs, np.where(senses == '>', lhs >= rhs, lhs == rhs))
+            return [algorithm.model.constraints[i].ConstrName for i in np.flatnonzero(~satisfied)]
+
+        # waiting 2 on ("1", "3") without traffic
+        driver = next(key[0] for key in columns if key[1] == ("1", "3"))
+        late_columns = [key if key[0] is not driver else
+                        (driver, key[1], key[2] + (key[1] == ("3", "2")), key[3] + (key[1] != ("0", "1")))
+                        for key in columns]
+        for matrix in (False, True):
+            algorithm = TEGModel(graph, drivers_graph, horizon=10, backend='highs', matrix=matrix)
+            algorithm.build_model()
+            self.assertEqual(algorithm.congestion_formulation, TEGModel.INCREMENTAL)
+            # with 3 drivers, the default breakpoints are every integer traffic
+            self.assertEqual(algorithm.get_congestion_approximation(("1", "3")).number_of_breakpoints(), 4)
+            # the linear congestion functions don't need any variable
+            self.assertEqual({edge for edge, _ in algorithm.congestion_expressions}, {("1", "3")})
+            self.assertEqual(algorithm.bigM(), 10)
+            self.assertEqual(get_violated_constraints(algorithm, columns), [])
+            self.assertEqual(get_violated_constraints(algorithm, late_columns),
+                             ["%s:%s:%s:3" % (problem_labels.LOWER_WAITING_TIME, id(driver), str(("1", "3")))])
+        # the congestion rows are assembled with the other families, for the starting times having a variable
+        self.assertEqual(algorithm.build_statistics[problem_labels.CONGESTION_TRAFFIC]['rows'], 10)
+        self.assertEqual(algorithm.build_statistics[problem_labels.CONGESTION_ORDER]['rows'], 40)
+
+    def test_TEGModel_congestion_breakpoints(self):
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: x ** 2 + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: 1)
+        drivers_graph = DriversGraph()
+        for starting_time in range(5):
+            drivers_graph.add_driver(Driver(0, 2, starting_time))
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        solution = {key: 1 for key in heuristic.iter_variable_indexes_from_optimal_solution()}
+
+        # by default the breakpoints are every integer traffic: the heuristic's solution is feasible
+        algorithm = TEGModel(graph, drivers_graph, horizon=30, backend='highs')
+        self.assertEqual(algorithm.get_congestion_approximation((0, 1)).breakpoints.tolist(), range(6))
+        self.assertEqual(list(algorithm.iter_violated_waiting_time_constraints(solution)), [])
+        # coarser breakpoints distort the waiting times between them
+        algorithm = TEGModel(graph, drivers_graph, horizon=30, backend='highs', breakpoints=3)
+        self.assertEqual(algorithm.get_congestion_approximation((0, 1))(1), 3.5)
+        self.assertNotEqual(list(algorithm.iter_violated_waiting_time_constraints(solution)), [])
+
+    @unittest.skipIf(not SolverBackend.is_available(SolverBackend.get_default_backend()),
+                     "solver dependency not satisfied")
+    def test_TEGModel_nonlinear_solve(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        graph.set_edge_property("1", "3", labels.CONGESTION_FUNC, lambda x: x ** 2 + 1)
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        algorithm = TEGModel(graph, drivers_graph, horizon=12)
+        algorithm.solve()
+        self.assertLessEqual(algorithm.value, heuristic.value)
+
     @unittest.skipIf(Var is None, "gurobipy dependency not satisfied")
     def test_TEGModel_feasibility(self):
         graph, drivers_graph = generate_bad_heuristic_graphs()
@@ -261,22 +557,54 @@ class ProblemsTest(unittest.TestCase):
         algorithm.build_model()
         algorithm.solve()
 
-        for edge_, driver in algorithm.x.iterkeys():
-            edge = algorithm.TEGgraph.get_original_edge(edge_)
-            start = algorithm.TEGgraph.get_node_layer(edge_[0])
-            end = algorithm.TEGgraph.get_node_layer(edge_[1])
-
-            var_value = algorithm.x[edge_, driver].X if isinstance(algorithm.x[edge_, driver], Var) else 0
+        for (driver, edge, start, end), var in algorithm.x.iteritems():
+            var_value = var.X
             self.assertIn(var_value, [0, 1])
 
             # Test the mu constraint: for one given edge and driver, there is at most one variable which is equal to 1
             if var_value == 1:
                 for s, e in algorithm.drivers_structure.iter_time_intervals(driver, edge):
                     if (s, e) != (start, end):
-                        v = algorithm.x[algorithm.TEGgraph.build_edge(edge, s, e), driver]
-                        v = v.X if isinstance(v, Var) else 0
+                        v = algorithm.x.get(driver, edge, s, e)
+                        v = v.X if algorithm.x.has(driver, edge, s, e) else 0
                         self.assertEqual(v, 0)
 
+    @unittest.skipIf(Var is None, "gurobipy dependency not satisfied")
+    def test_TEGModel_new_columns(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        algo = TEGColumnGenerationAlgorithm(graph, drivers_graph, horizon=7)
+        algo.master.presolve()
+        model = algo.master.algorithm
+        model.build_model()
+        names = set(model.constraints)
+        self.assertEqual(len(names), sum(model.count.itervalues()))
+        self.assertTrue(all(model.has_constraint(name) for name in names))
+        self.assertFalse(model.has_constraint("unknown"))
+        self.assertIsNone(model.get_constraint("unknown"))
+
+        column = next(
+            (driver, edge, start, end)
+            for driver in drivers_graph.get_all_drivers() for edge in graph.edges_iter()
+            for start, end in algo.drivers_structure.iter_time_intervals(driver, edge)
+            if not model.has_variable(driver, edge, start, end)
+        )
+        algo.add_column_to_master(column)
+
+        # the existing constraints are updated in place as if the model had been built with the new column
+        rebuilt = TEGModel(graph, drivers_graph, drivers_structure=model.drivers_structure, horizon=model.horizon,
+                           binary=False)
+        rebuilt.build_model()
+
+        def get_coefficients(m, name):
+            row, coefficients = m.model.getRow(m.get_constraint(name)), defaultdict(lambda: 0)
+            for k in range(row.size()):
+                coefficients[row.getVar(k).VarName] += row.getCoeff(k)
+            return {var_name: value for var_name, value in coefficients.iteritems() if value != 0}
+
+        for name in names:
+            if rebuilt.has_constraint(name):
+                self.assertEqual(get_coefficients(model, name), get_coefficients(rebuilt, name))
+
     @unittest.skipIf(Var is None, "gurobipy dependency not satisfied")
     def test_column_generation_algorithm(self):
         graph, drivers_graph = generate_bad_heuristic_graphs()
@@ -286,7 +614,7 @@ class ProblemsTest(unittest.TestCase):
         algo.master.algorithm.build_model()
 
         # Check number of initial variables
-        number_vars = len(filter(lambda v: isinstance(v, Var), algo.master.algorithm.x.itervalues()))
+        number_vars = len(algo.master.algorithm.x)
         self.assertEqual(number_vars, 5)
 
         # Check the number of new variables: is the drivers_structure of algo different from the one used by algo.master
@@ -325,6 +653,252 @@ class ProblemsTest(unittest.TestCase):
 
         self.assertEqual(opt_algo.value, algo.value)
 
+    def test_global_presolver(self):
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: x + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: x + 1)
+        graph.add_edge(0, 3, congestion_func=lambda x: x + 5)
+        graph.add_edge(3, 2, congestion_func=lambda x: x + 5)
+        graph.add_edge(2, 4, congestion_func=lambda x: x + 1)
+        driver = Driver(0, 2, 0)
+        drivers_graph = DriversGraph()
+        drivers_graph.add_driver(driver)
+
+        presolver = GlobalPreSolver(graph, drivers_graph, horizon=5, upper_bound=float('inf'))
+        self.assertEqual(sorted(presolver.map_reachable_edges_for_drivers()[driver]), [(0, 1), (1, 2)])
+        self.assertEqual(sorted(presolver.iter_unused_edges()), [(0, 3), (2, 4), (3, 2)])
+
+        # the paths of RealGPS stay reachable, its solution giving the upper bound
+        graph = generate_grid_data(5, 5)
+        graph.set_global_congestion_function(lambda x: 3 * x + 2)
+        drivers_graph = generate_random_drivers(graph, 10)
+        presolver = GlobalPreSolver(graph, drivers_graph)
+        presolver.solve()
+        real_gps = RealGPS(graph, drivers_graph)
+        real_gps.solve()
+        self.assertEqual(presolver.upper_bound, real_gps.opt_simulator.get_sum_ending_time())
+        for driver, path in real_gps.iter_optimal_solution():
+            for edge in graph.iter_edges_in_path(path):
+                self.assertTrue(presolver.is_edge_reachable_by_driver(driver, edge))
+
+    def test_solver_decomposition(self):
+        """
+        Drivers on two disconnected parts of the graph are solved separately, giving the same solution
+        """
+        graph = GPSGraph()
+        for part in ('a', 'b'):
+            graph.add_edge(part + '0', part + '1', congestion_func=lambda x: 3 * x + 1)
+            graph.add_edge(part + '1', part + '3', congestion_func=lambda x: 3 * x + 1)
+            graph.add_edge(part + '0', part + '2', congestion_func=lambda x: x + 2)
+            graph.add_edge(part + '2', part + '3', congestion_func=lambda x: x + 2)
+        drivers_graph = DriversGraph()
+        for part in ('a', 'b'):
+            for starting_time in (0, 0, 1):
+                drivers_graph.add_driver(Driver(part + '0', part + '3', starting_time))
+
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        for processes in (1, 2):
+            solver = Solver(graph, drivers_graph, RealGPS, horizon=20, decompose=True,
+                            presolvers={"HorizonPresolver", "GlobalPreSolver"}, decomposition_processes=processes)
+            solver.solve()
+            self.assertGreaterEqual(len(solver.components), 2)
+            for drivers in solver.components:
+                self.assertEqual(len(set(driver.start for driver in drivers)), 1)
+            self.assertEqual(solver.get_value(), heuristic.get_value())
+            self.assertEqual(len(list(solver.iter_optimal_solution())), drivers_graph.number_of_drivers())
+
+    def test_graph_reduction_presolver(self):
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: 3 * x + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: x + 1)
+        graph.add_edge(0, 3, congestion_func=lambda x: 1)
+        graph.add_edge(3, 4, congestion_func=lambda x: 1)
+        graph.add_edge(4, 2, congestion_func=lambda x: 1)
+        graph.add_edge(2, 5, congestion_func=lambda x: 1)
+        drivers_graph = DriversGraph()
+        for starting_time in range(2):
+            drivers_graph.add_driver(Driver(0, 2, starting_time))
+
+        presolver = GraphReductionPresolver(graph, drivers_graph, horizon=10)
+        reduced_graph = presolver.get_reduced_graph()
+        # (2, 5) is useless, and the chain 0 -> 3 -> 4 -> 2 doesn't depend on the traffic
+        self.assertEqual(sorted(reduced_graph.edges()), [(0, 1), (0, 2), (1, 2)])
+        self.assertEqual(reduced_graph.get_congestion_function(0, 2)(2), 3)
+        self.assertEqual(reduced_graph.get_edge_property(0, 2, labels.DISTANCE),
+                         3 * graph.get_edge_property(0, 3, labels.DISTANCE))
+        self.assertEqual(presolver.map_path((0, 2)), (0, 3, 4, 2))
+        self.assertEqual(presolver.map_path((0, 1, 2)), (0, 1, 2))
+        self.assertEqual(len(list(presolver.get_reduced_drivers_structure().get_possible_edges_for_driver(
+            drivers_graph.get_all_drivers().next()))), 3)
+
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        solver = Solver(graph, drivers_graph, RealGPS, horizon=10, presolvers={"GraphReductionPresolver"})
+        solver.solve()
+        self.assertEqual(solver.algorithm.graph.number_of_edges(), 3)
+        self.assertEqual(sorted(path for _, path in solver.iter_optimal_solution()), [(0, 1, 2), (0, 3, 4, 2)])
+        self.assertEqual(solver.get_value(), heuristic.get_value())
+
+    def test_TEG_variables(self):
+        driver, other = Driver(0, 2, 0), Driver(0, 2, 1)
+        # the solvers' variables overload ==: they are compared by name
+        model = SolverBackend.HighsModel()
+        a, b, c, d, e = [model.addVar(name=name) for name in 'abcde']
+
+        def names(variables):
+            return sorted(variable.VarName for variable in variables)
+
+        x = TEGVariables()
+        x.add(driver, (0, 1), 0, 2, a)
+        x.add(driver, (0, 1), 0, 3, b)
+        x.add(other, (0, 1), 1, 2, c)
+        x.add(other, (1, 2), 2, 4, d)
+
+        self.assertEqual(len(x), 4)
+        self.assertTrue(x.has(driver, (0, 1), 0, 2))
+        self.assertIs(x.get(other, (1, 2), 2, 4), d)
+        # reading missing variables stores nothing
+        self.assertEqual(x.get(driver, (1, 2), 2, 4), 0)
+        self.assertEqual(x.get(Driver(0, 2, 0), (0, 1), 0, 2), 0)
+        self.assertFalse(x.has(driver, (0, 3), 0, 2))
+        self.assertEqual(len(x), 4)
+
+        self.assertEqual(sorted((end, v.VarName) for end, v in x.iter_ending(driver, (0, 1), 0)), [(2, 'a'), (3, 'b')])
+        self.assertEqual(names(v for _, _, _, v in x.iter_covering((0, 1), 2)), ['a', 'b', 'c'])
+        self.assertEqual(names(v for _, _, _, v in x.iter_covering((0, 1), 3)), ['b'])
+        self.assertEqual(list(x.iter_covering((0, 1), 0)), [])
+        self.assertEqual(names(x.iter_leaving(other, 1, 2)), ['d'])
+        self.assertEqual(names(x.iter_entering(other, 1, 2)), ['c'])
+
+        # b is replaced, and only b
+        x.add(driver, (0, 1), 0, 3, e)
+        self.assertEqual(len(x), 4)
+        self.assertEqual(names(v for _, _, _, v in x.iter_covering((0, 1), 2)), ['a', 'c', 'e'])
+        self.assertEqual(names(v for _, _, _, v in x.iter_covering((0, 1), 3)), ['e'])
+        self.assertEqual(names(x.iter_leaving(driver, 0, 0)), ['a', 'e'])
+        self.assertEqual(names(x.iter_entering(driver, 1, 3)), ['e'])
+        self.assertIs(dict(x.iteritems())[driver, (0, 1), 0, 2], a)
+
+    def test_TEG_matrix(self):
+        graph, drivers_graph = generate_bad_heuristic_graphs()
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=10)
+        x = TEGVariables()
+        for driver in drivers_graph.get_all_drivers():
+            for edge in graph.edges_iter():
+                for start, end in drivers_structure.iter_time_intervals(driver, edge):
+                    x.add(driver, edge, start, end, (driver, edge, start, end))
+        big_m = max(graph.get_congestion_function(*edge)(3) for edge in graph.edges_iter())
+        matrix = TEGMatrix(graph, drivers_graph, drivers_structure, x, big_m)
+        matrix.build()
+
+        self.assertEqual(matrix.variables, [key for key, _ in x.iteritems()])
+        statistics = matrix.get_statistics()
+        self.assertEqual(set(statistics), {problem_labels.ENDING_TIME, problem_labels.ENDING_NODE,
+                                           problem_labels.TRANSFERT, problem_labels.EDGE_TIME_UNICITY,
+                                           problem_labels.LOWER_WAITING_TIME, problem_labels.UPPER_WAITING_TIME})
+        self.assertEqual(statistics[problem_labels.ENDING_TIME]['rows'], 3)
+        for label, family in matrix.families.iteritems():
+            self.assertEqual(family.number_of_nonzeros(), statistics[label]['nonzeros'])
+            self.assertEqual(len(family.names), len(set(family.names)))
+
+        # the heuristic's solution satisfies every constraint
+        columns = list(heuristic.iter_variable_indexes_from_optimal_solution())
+        solution = matrix.get_solution_vector(columns)
+        for family in matrix.families.itervalues():
+            self.assertEqual(len(family.get_violated_rows(solution)), 0)
+
+        # a driver leaving edge ("0", "2") too late, and a driver not leaving his start
+        driver = next(column[0] for column in columns if column[1:] == (("0", "2"), 0, 2))
+        late_columns = [(driver, ("0", "2"), 0, 4) if column[0] is driver and column[1] == ("0", "2") else column
+                        for column in columns]
+        solution = matrix.get_solution_vector(late_columns)
+        self.assertEqual(len(matrix.families[problem_labels.LOWER_WAITING_TIME].get_violated_rows(solution)), 1)
+        self.assertEqual(len(matrix.families[problem_labels.TRANSFERT].get_violated_rows(solution)), 2)
+        solution = matrix.get_solution_vector([column for column in columns if column[0] is not driver])
+        self.assertEqual(len(matrix.families[problem_labels.ENDING_TIME].get_violated_rows(solution)), 1)
+        self.assertEqual(len(matrix.families[problem_labels.UPPER_WAITING_TIME].get_violated_rows(solution)), 0)
+
+    def test_horizon_presolver(self):
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: 3 * x + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: x + 1)
+        graph.add_edge(0, 3, congestion_func=lambda x: 2)
+        graph.add_edge(3, 2, congestion_func=lambda x: x + 2)
+        drivers_graph = DriversGraph()
+        for starting_time in range(3):
+            drivers_graph.add_driver(Driver(0, 2, starting_time))
+
+        # with 3 drivers on every edge, the shortest path is 0 -> 3 -> 2 and takes 7
+        presolver = HorizonPresolver(graph, drivers_graph)
+        presolver.solve()
+        self.assertEqual(presolver.get_horizon(), 9)
+        self.assertEqual(presolver.get_statistics()['tier'], 'analytic')
+        self.assertNotIn('refined_bound', presolver.get_statistics())
+
+        heuristic = RealGPS(graph, drivers_graph)
+        heuristic.solve()
+        presolver = HorizonPresolver(graph, drivers_graph, refine=True)
+        presolver.solve()
+        self.assertEqual(presolver.get_horizon(), heuristic.opt_simulator.get_maximum_ending_time())
+        self.assertEqual(presolver.get_statistics()['analytic_bound'], 9)
+        self.assertEqual(presolver.get_statistics()['tier'], 'refined')
+
+        # the given horizon is kept when a driver can't reach his end
+        drivers_graph.add_driver(Driver(2, 0, 0))
+        presolver = HorizonPresolver(graph, drivers_graph, horizon=20)
+        presolver.solve()
+        self.assertEqual(presolver.get_horizon(), 20)
+
+    def test_presolve_cache(self):
+        def build_instance():
+            graph = GPSGraph()
+            graph.add_edge(0, 1, congestion_func=lambda x: 3 * x + 1)
+            graph.add_edge(1, 2, congestion_func=lambda x: x + 1)
+            graph.add_edge(0, 3, congestion_func=lambda x: 1)
+            graph.add_edge(3, 4, congestion_func=lambda x: 1)
+            graph.add_edge(4, 2, congestion_func=lambda x: 1)
+            graph.add_edge(2, 5, congestion_func=lambda x: 1)
+            drivers_graph = DriversGraph()
+            for starting_time in range(3):
+                drivers_graph.add_driver(Driver(0, 2, starting_time))
+            return graph, drivers_graph
+
+        presolvers = {"HorizonPresolver", "GlobalPreSolver", "GraphReductionPresolver", "SafetyIntervalsPresolver"}
+        directory = tempfile.mkdtemp()
+        try:
+            cache = PresolveCache(directory)
+            solvers, heuristic_calls = [], []
+            # the same instance built twice: the second one is read from the cache
+            for _ in range(2):
+                # RealGPS.solve is only called by the presolvers: the algorithm is solved by solve_with_heuristic
+                with mock.patch.object(RealGPS, 'solve', autospec=True, side_effect=RealGPS.solve) as solve:
+                    solver = Solver(*build_instance(), algorithm=RealGPS, presolvers=presolvers, cache=cache)
+                    solver.solve()
+                heuristic_calls.append(solve.call_count)
+                solvers.append(solver)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            # GlobalPreSolver's upper bound, which GraphReductionPresolver reuses
+            self.assertEqual(heuristic_calls, [1, 0])
+            self.assertEqual(solvers[0].horizon, solvers[1].horizon)
+            self.assertEqual(solvers[0].get_value(), solvers[1].get_value())
+            self.assertEqual(solvers[1].algorithm.graph.number_of_edges(), 3)
+            states = [
+                PresolveCache.get_state(solver.drivers_structure, solver.algorithm.graph, solver.drivers_graph, '')
+                for solver in solvers
+            ]
+            for name, values in states[0].iteritems():
+                self.assertTrue(((values == states[1][name]) | (values != values)).all())
+
+            # another horizon is another instance
+            Solver(*build_instance(), algorithm=RealGPS, presolvers=presolvers, cache=cache, horizon=50).presolve()
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+        finally:
+            shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
     unittest.main()
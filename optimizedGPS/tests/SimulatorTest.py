@@ -4,10 +4,13 @@
 from optimizedGPS.logger import configure
 configure()
 
+import shutil
+import tempfile
 import unittest
 import random
 
-from optimizedGPS.problems.simulator import FromEdgeDescriptionSimulator
+from optimizedGPS.problems.simulator import FromEdgeDescriptionSimulator, CohortSimulator, DynamicRoutingSimulator, \
+    QueueSimulator, PartitionedSimulator, EventLog, TrafficIndex
 from optimizedGPS.structure import GPSGraph, Driver, DriversGraph
 from optimizedGPS.data.data_generator import generate_grid_data, generate_random_drivers
 from optimizedGPS import options
@@ -108,6 +111,246 @@ class SimulatorTest(unittest.TestCase):
                 opt_value
             )
 
+    def test_running_aggregates(self):
+        """
+        The aggregates kept during the simulation should match a full scan of the events
+        """
+        grid_graph = generate_grid_data(5, 5)
+        grid_graph.set_global_congestion_function(lambda x: 3 * x + 4)
+        drivers_graph = generate_random_drivers(grid_graph, 20)
+        edge_description = {
+            driver: grid_graph.get_shortest_path(driver.start, driver.end, key=grid_graph.get_minimum_waiting_time)
+            for driver in drivers_graph.get_all_drivers()
+        }
+        simulator = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, edge_description)
+        simulator.simulate()
+
+        drivers = list(drivers_graph.get_all_drivers())
+        for subset in [drivers, drivers[:5], drivers[::3]]:
+            self.assertEqual(
+                simulator.get_sum_ending_time(drivers=subset),
+                sum(simulator.events[d][-1].time for d in subset)
+            )
+            self.assertEqual(
+                simulator.get_maximum_ending_time(drivers=subset),
+                max(simulator.events[d][-1].time for d in subset)
+            )
+            self.assertEqual(
+                simulator.get_sum_driving_time(drivers=subset),
+                sum(simulator.events[d][-1].time - simulator.events[d][0].time for d in subset)
+            )
+        self.assertEqual(simulator.get_sum_ending_time(), simulator.get_sum_ending_time(drivers=drivers))
+        self.assertEqual(simulator.get_maximum_ending_time(), simulator.get_maximum_ending_time(drivers=drivers))
+        self.assertEqual(simulator.get_sum_driving_time(), simulator.get_sum_driving_time(drivers=drivers))
+
+    def test_event_log(self):
+        """
+        The memory-mapped event log answers the same queries as the simulator
+        """
+        grid_graph = generate_grid_data(5, 5)
+        grid_graph.set_global_congestion_function(lambda x: 3 * x + 4)
+        drivers_graph = generate_random_drivers(grid_graph, 20)
+        edge_description = {
+            driver: grid_graph.get_shortest_path(driver.start, driver.end, key=grid_graph.get_minimum_waiting_time)
+            for driver in drivers_graph.get_all_drivers()
+        }
+        simulator = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, edge_description)
+        simulator.simulate()
+
+        directory = tempfile.mkdtemp()
+        try:
+            simulator.export_events(directory)
+            events = EventLog.load(directory)
+
+            self.assertEqual(events.number_of_drivers(), drivers_graph.number_of_drivers())
+            self.assertEqual(events.get_sum_ending_time(), simulator.get_sum_ending_time())
+            self.assertEqual(events.get_maximum_ending_time(), simulator.get_maximum_ending_time())
+            self.assertEqual(events.get_sum_driving_time(), simulator.get_sum_driving_time())
+            # drivers are exported in the order of simulator.events
+            for i, driver in enumerate(simulator.events.iterkeys()):
+                self.assertEqual(events.drivers[i].to_tuple(), driver.to_tuple())
+                self.assertEqual(events.get_starting_times(i), simulator.get_starting_times(driver))
+                self.assertEqual(events.get_ending_time(i), simulator.get_ending_time(driver))
+                self.assertEqual(events.get_driver_waiting_times(i), simulator.get_driver_waiting_times(driver))
+            for edge in grid_graph.edges_iter():
+                for t in range(int(simulator.get_maximum_ending_time()) + 1):
+                    self.assertEqual(events.get_traffic(edge, t), simulator.get_traffic(edge, t))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_cohort_simulator(self):
+        """
+        Merging identical drivers into cohorts doesn't change the simulation
+        """
+        grid_graph = generate_grid_data(5, 5)
+        grid_graph.set_global_congestion_function(lambda x: 3 * x + 4)
+        drivers_graph = DriversGraph()
+        for driver in generate_random_drivers(grid_graph, 10).get_all_drivers():
+            for _ in range(3):
+                drivers_graph.add_driver(Driver(driver.start, driver.end, driver.time))
+        edge_description = {
+            driver: grid_graph.get_shortest_path(driver.start, driver.end, key=grid_graph.get_minimum_waiting_time)
+            for driver in drivers_graph.get_all_drivers()
+        }
+        simulator = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, edge_description)
+        simulator.simulate()
+        cohort_simulator = CohortSimulator(grid_graph, drivers_graph, edge_description)
+        cohort_simulator.simulate()
+
+        self.assertLessEqual(cohort_simulator.number_of_cohorts(), 10)
+        self.assertEqual(cohort_simulator.get_value(), simulator.get_value())
+        self.assertEqual(cohort_simulator.get_sum_driving_time(), simulator.get_sum_driving_time())
+        self.assertEqual(cohort_simulator.get_maximum_ending_time(), simulator.get_maximum_ending_time())
+        self.assertEqual(cohort_simulator.get_edge_description(), simulator.get_edge_description())
+        drivers = list(drivers_graph.get_all_drivers())[::4]
+        self.assertEqual(cohort_simulator.get_sum_ending_time(drivers), simulator.get_sum_ending_time(drivers))
+        for driver in drivers_graph.get_all_drivers():
+            self.assertEqual(cohort_simulator.get_starting_times(driver), simulator.get_starting_times(driver))
+            self.assertEqual(
+                cohort_simulator.get_driver_waiting_times(driver), simulator.get_driver_waiting_times(driver))
+        for edge in grid_graph.edges_iter():
+            for t in range(simulator.get_maximum_ending_time() + 1):
+                self.assertEqual(cohort_simulator.get_traffic(edge, t), simulator.get_traffic(edge, t))
+
+    def test_dynamic_routing_simulator(self):
+        """
+        Drivers re-routed on the current traffic reach their targets, and replaying their paths gives the same result
+        """
+        grid_graph = generate_grid_data(6, 6)
+        grid_graph.set_global_congestion_function(lambda x: 3 * x + 4)
+        drivers_graph = generate_random_drivers(grid_graph, 30)
+        simulator = DynamicRoutingSimulator(grid_graph, drivers_graph)
+        simulator.simulate()
+
+        for driver in drivers_graph.get_all_drivers():
+            path = simulator.get_edge_description()[driver]
+            self.assertEqual((path[0], path[-1]), (driver.start, driver.end))
+        replay = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, simulator.get_edge_description())
+        replay.simulate()
+        self.assertEqual(replay.get_value(), simulator.get_value())
+        for driver in drivers_graph.get_all_drivers():
+            self.assertEqual(replay.get_starting_times(driver), simulator.get_starting_times(driver))
+
+        stats = simulator.get_routing_statistics()
+        self.assertEqual(stats['decisions'], sum(len(p) - 1 for p in simulator.get_edge_description().itervalues()))
+        self.assertLessEqual(stats['reroutes'], stats['searches'])
+        self.assertLessEqual(stats['searches'], stats['decisions'])
+        self.assertLessEqual(stats['max_settled_nodes'], grid_graph.number_of_nodes())
+
+        # without traffic, every driver follows a traffic-free shortest path without re-searching
+        drivers_graph = DriversGraph()
+        driver = Driver('n_0_0', 'n_5_5', 0)
+        drivers_graph.add_driver(driver)
+        simulator = DynamicRoutingSimulator(grid_graph, drivers_graph)
+        simulator.simulate()
+        self.assertEqual(simulator.get_ending_time(driver), 10 * 4)
+        self.assertEqual(simulator.get_routing_statistics()['searches'], 1)
+
+    def test_queue_simulator(self):
+        """
+        Without congestion the queues give the traffic-free times, and a bottleneck lets its capacity out per time
+        """
+        grid_graph = generate_grid_data(6, 6)
+        grid_graph.set_global_congestion_function(lambda x: 4)
+        drivers_graph = generate_random_drivers(grid_graph, 30)
+        edge_description = {
+            driver: grid_graph.get_shortest_path(driver.start, driver.end, key=grid_graph.get_minimum_waiting_time)
+            for driver in drivers_graph.get_all_drivers()
+        }
+        simulator = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, edge_description)
+        simulator.simulate()
+        queue_simulator = QueueSimulator(grid_graph, drivers_graph, edge_description, capacity=lambda e: 100)
+        queue_simulator.simulate()
+        self.assertEqual(queue_simulator.status, options.SUCCESS)
+        self.assertEqual(queue_simulator.get_value(), simulator.get_value())
+        self.assertEqual(queue_simulator.get_sum_driving_time(), simulator.get_sum_driving_time())
+        self.assertEqual(queue_simulator.get_edge_description(), edge_description)
+        for driver in drivers_graph.get_all_drivers():
+            self.assertEqual(queue_simulator.get_starting_times(driver), simulator.get_starting_times(driver))
+
+        graph = GPSGraph(name='graph-test')
+        graph.add_edge(1, 2, lanes=2, traffic_limit=1)
+        graph.add_edge(2, 3, lanes=1, traffic_limit=2)
+        graph.set_global_congestion_function(lambda x: 2)
+        drivers_graph = DriversGraph()
+        drivers = [Driver(1, 3, 0) for _ in range(5)]
+        for driver in drivers:
+            drivers_graph.add_driver(driver)
+        # capacity of both edges: 2 / 2 = 1 driver per time unit
+        simulator = QueueSimulator(graph, drivers_graph, {driver: (1, 2, 3) for driver in drivers})
+        simulator.simulate()
+        self.assertEqual(sorted(simulator.get_ending_time(driver) for driver in drivers), [4, 5, 6, 7, 8])
+        self.assertEqual(simulator.get_maximum_ending_time(), 8)
+        self.assertEqual(simulator.get_traffic((1, 2), 1), 5)
+        self.assertEqual(simulator.get_traffic((1, 2), 4), 3)
+        self.assertEqual(simulator.get_traffic((2, 3), 4), 2)
+
+    def test_partitioned_simulator(self):
+        """
+        Simulating the regions in parallel gives the same result as simulating the whole graph
+        """
+        grid_graph = generate_grid_data(8, 8)
+        grid_graph.set_global_congestion_function(lambda x: 3 * x + 4)
+        drivers_graph = generate_random_drivers(grid_graph, 40)
+        edge_description = {
+            driver: grid_graph.get_shortest_path(driver.start, driver.end, key=grid_graph.get_minimum_waiting_time)
+            for driver in drivers_graph.get_all_drivers()
+        }
+        simulator = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, edge_description)
+        simulator.simulate()
+
+        for processes, regions in [(1, 3), (2, 2), (3, 4)]:
+            partitioned_simulator = PartitionedSimulator(
+                grid_graph, drivers_graph, edge_description, regions=regions, processes=processes)
+            partitioned_simulator.simulate()
+            self.assertEqual(partitioned_simulator.status, options.SUCCESS)
+            self.assertEqual(partitioned_simulator.lookahead, 4)
+            self.assertEqual(partitioned_simulator.get_value(), simulator.get_value())
+            self.assertEqual(partitioned_simulator.get_edge_description(), simulator.get_edge_description())
+            for driver in drivers_graph.get_all_drivers():
+                self.assertEqual(
+                    partitioned_simulator.get_starting_times(driver), simulator.get_starting_times(driver))
+
+            stats = partitioned_simulator.get_region_statistics()
+            self.assertEqual(len(stats), regions)
+            self.assertEqual(sum(s['nodes'] for s in stats.itervalues()), grid_graph.number_of_nodes())
+            self.assertEqual(sum(s['started'] for s in stats.itervalues()), drivers_graph.number_of_drivers())
+            self.assertEqual(sum(s['finished'] for s in stats.itervalues()), drivers_graph.number_of_drivers())
+            self.assertEqual(sum(s['sent'] for s in stats.itervalues()), sum(s['received'] for s in stats.itervalues()))
+
+    def test_traffic_index(self):
+        """
+        The traffic index answers the same traffic queries as the simulator
+        """
+        grid_graph = generate_grid_data(5, 5)
+        grid_graph.set_global_congestion_function(lambda x: 3 * x + 4)
+        drivers_graph = generate_random_drivers(grid_graph, 30)
+        edge_description = {
+            driver: grid_graph.get_shortest_path(driver.start, driver.end, key=grid_graph.get_minimum_waiting_time)
+            for driver in drivers_graph.get_all_drivers()
+        }
+        simulator = FromEdgeDescriptionSimulator(grid_graph, drivers_graph, edge_description)
+        simulator.simulate()
+        index = simulator.get_traffic_index()
+        self.assertEqual(TrafficIndex.from_event_log(EventLog.from_simulator(simulator)).values.tolist(),
+                         index.values.tolist())
+
+        horizon = int(simulator.get_maximum_ending_time()) + 2
+        traffic = {
+            edge: [simulator.get_traffic(edge, t) for t in range(horizon)] for edge in grid_graph.edges_iter()}
+        for edge in grid_graph.edges_iter():
+            self.assertEqual([index.get_traffic(edge, t) for t in range(horizon)], traffic[edge])
+            self.assertEqual(index.get_traffic(edge, 0.5), simulator.get_traffic(edge, 0.5))
+            for start in range(0, horizon, 3):
+                for end in range(start, horizon, 4):
+                    self.assertEqual(index.get_maximum_traffic(edge, start, end), max(traffic[edge][start:end + 1]))
+        for t in range(horizon):
+            self.assertEqual(
+                set(index.get_congested_edges(t)),
+                {edge for edge in grid_graph.edges_iter() if traffic[edge][t] > grid_graph.get_traffic_limit(*edge)}
+            )
+        self.assertEqual(index.get_congested_edges(horizon), [])
+
 
 if __name__ == '__main__':
     unittest.main()
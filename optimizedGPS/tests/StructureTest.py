@@ -4,13 +4,16 @@
 from optimizedGPS.logger import configure
 configure()
 
+import random
 import unittest
 
-from networkx import NetworkXError
+from networkx import NetworkXError, all_simple_paths
+import numpy as np
 from optimizedGPS.structure import Graph
 from optimizedGPS.structure import GPSGraph
 from optimizedGPS.structure import TimeExpandedGraph, ReducedTimeExpandedGraph
-from optimizedGPS.data.data_generator import generate_graph_from_file, generate_bad_heuristic_graphs
+from optimizedGPS.data.data_generator import generate_graph_from_file, generate_bad_heuristic_graphs, \
+    generate_grid_data, generate_random_drivers
 from optimizedGPS.structure import Driver
 from optimizedGPS.structure import DriversGraph
 from optimizedGPS.structure import DriversStructure
@@ -309,6 +312,205 @@ class StructureTest(unittest.TestCase):
                 drivers_structure.update_intervals(driver, edge, min_traffics, max_traffics)
         self.assertEqual(drivers_structure.get_safety_interval(driver2, (0, 1)), (2, 4))
 
+    def test_drivers_structure_storage(self):
+        """
+        Reading unknown drivers or edges allocates nothing, and drivers added later get their own row
+        """
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: x + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: x + 2)
+        drivers_graph = DriversGraph()
+        driver0, driver1 = Driver(0, 2, 0), Driver(0, 2, 1)
+        drivers_graph.add_driver(driver0)
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=5)
+        self.assertEqual(drivers_structure.unreachable_edges.shape, (1, 2))
+
+        self.assertEqual(drivers_structure.get_safety_interval(driver1, (0, 1)), (None, None))
+        self.assertEqual(drivers_structure.get_presence_interval(driver0, (5, 6)), (None, None))
+        self.assertTrue(drivers_structure.is_edge_reachable_by_driver(driver1, (0, 1)))
+        self.assertEqual(list(drivers_structure.get_starting_times(driver1, (0, 1))), range(6))
+        self.assertEqual((len(drivers_structure.drivers), len(drivers_structure.edges)), (1, 2))
+
+        drivers_structure.add_safety_interval(driver0, (0, 1), start=1)
+        drivers_structure.add_safety_interval(driver0, (0, 1), end=3.5)
+        self.assertEqual(drivers_structure.get_safety_interval(driver0, (0, 1)), (1, 3.5))
+        drivers_structure.add_starting_times(driver1, (1, 2), 3, 1)
+        drivers_structure.set_unreachable_edge_to_driver(driver1, (0, 1))
+        self.assertEqual(list(drivers_structure.get_starting_times(driver1, (1, 2))), [1, 3])
+        self.assertFalse(drivers_structure.is_edge_reachable_by_driver(driver1, (0, 1)))
+        self.assertTrue(drivers_structure.is_edge_reachable_by_driver(driver0, (0, 1)))
+        self.assertEqual(drivers_structure.get_safety_interval(driver0, (0, 1)), (1, 3.5))
+        drivers_structure.set_reachable_edge_to_driver(driver1, (0, 1))
+        self.assertTrue(drivers_structure.is_edge_reachable_by_driver(driver1, (0, 1)))
+
+    def test_traffics_bounds(self):
+        """
+        The traffics bounds computed by sweeping the intervals are the ones obtained by counting the drivers at
+        every time
+        """
+        graph = generate_grid_data(3, 3)
+        drivers_graph = generate_random_drivers(graph, 15)
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=12)
+        drivers = list(drivers_graph.get_all_drivers())
+        for driver in drivers:
+            for edge in graph.edges_iter():
+                if random.random() < 0.2:
+                    drivers_structure.set_unreachable_edge_to_driver(driver, edge)
+                elif random.random() < 0.7:
+                    start = random.randint(0, 8)
+                    drivers_structure.add_safety_interval(driver, edge, start, start + random.randint(0, 4))
+
+        min_traffics = drivers_structure.compute_minimum_traffics()
+        max_traffics = drivers_structure.compute_maximum_traffics()
+        for driver in drivers:
+            for edge in graph.edges_iter():
+                if not drivers_structure.is_edge_reachable_by_driver(driver, edge):
+                    continue
+                window = range(drivers_structure.get_safety_starting_time(driver, edge),
+                               drivers_structure.get_presence_starting_time(driver, edge) + 1)
+                self.assertEqual(min_traffics[driver][edge], min(
+                    sum(drivers_structure.get_presence_starting_time(d, edge) < s <=
+                        drivers_structure.get_presence_ending_time(d, edge) for d in drivers if d != driver)
+                    for s in window
+                ))
+                self.assertEqual(max_traffics[driver][edge], max(
+                    sum(drivers_structure.get_safety_starting_time(d, edge) < s <=
+                        drivers_structure.get_safety_ending_time(d, edge) for d in drivers if d != driver)
+                    for s in window
+                ))
+
+    def test_traffics_fractional_windows(self):
+        """
+        A window without any integer time gets a traffic of 0
+        """
+        graph = GPSGraph()
+        graph.add_edge(0, 1)
+        drivers_structure = DriversStructure(graph, DriversGraph(), horizon=5)
+        starts, ends = np.array([[0.], [0.]]), np.array([[2.], [2.]])
+        windows_starts, windows_ends = np.array([[0.5], [0.]]), np.array([[0.8], [1.]])
+        reachable = np.array([[True], [True]])
+        for function, default, traffic in ((np.maximum, - np.inf, 1), (np.minimum, np.inf, 0)):
+            traffics = drivers_structure.compute_traffics(
+                starts, ends, windows_starts, windows_ends, reachable, function, default)
+            self.assertEqual(traffics[:, 0].tolist(), [0, traffic])
+
+    def test_safety_intervals_worklist(self):
+        """
+        Only the drivers whose traffics changed are updated after the first round, and the intervals reach a fixed
+        point: updating every driver on every edge doesn't change anything
+        """
+        graph = generate_grid_data(3, 3)
+        graph.set_global_congestion_function(lambda x: 2 * x + 1)
+        drivers_graph = generate_random_drivers(graph, 6)
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=25)
+        drivers_structure.compute_optimal_safety_intervals()
+
+        statistics = drivers_structure.rounds_statistics
+        self.assertEqual(statistics[0]['edges'], graph.number_of_edges())
+        self.assertEqual(statistics[0]['drivers'], drivers_graph.number_of_drivers())
+        self.assertEqual(statistics[-1]['changes'], 0)
+        for previous, current in zip(statistics[:-1], statistics[1:]):
+            self.assertGreater(previous['changes'], 0)
+            self.assertLessEqual(current['drivers'], drivers_graph.number_of_drivers())
+
+        min_traffics = drivers_structure.compute_minimum_traffics()
+        max_traffics = drivers_structure.compute_maximum_traffics()
+        for driver in drivers_graph.get_all_drivers():
+            for edge in graph.edges_iter():
+                self.assertFalse(drivers_structure.update_intervals(driver, edge, min_traffics, max_traffics))
+
+    def test_reaching_times(self):
+        """
+        On an acyclic graph, the earliest and latest reaching times are the shortest and longest paths.
+        After a cycle, the latest reaching time is the horizon
+        """
+        graph = generate_grid_data(3, 4)
+        graph.set_global_congestion_function(lambda x: 2 * x + 1)
+        drivers_graph = generate_random_drivers(graph, 5)
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=100)
+        for driver in drivers_graph.get_all_drivers():
+            for edge in graph.edges_iter():
+                if random.random() < 0.2:
+                    drivers_structure.set_unreachable_edge_to_driver(driver, edge)
+                else:
+                    start = random.randint(0, 8)
+                    drivers_structure.add_safety_interval(driver, edge, start, start + random.randint(0, 4))
+        min_traffics = drivers_structure.compute_minimum_traffics()
+        max_traffics = drivers_structure.compute_maximum_traffics()
+
+        for driver in drivers_graph.get_all_drivers():
+            earliest, latest = drivers_structure.compute_reaching_times(driver, min_traffics, max_traffics)
+            for node in graph.nodes_iter():
+                paths = [(driver.start,)] if node == driver.start else [
+                    path for path in all_simple_paths(graph, driver.start, node)
+                    if all(drivers_structure.is_edge_reachable_by_driver(driver, e) for e in zip(path, path[1:]))
+                ]
+                if not paths:
+                    self.assertNotIn(node, earliest)
+                    self.assertNotIn(node, latest)
+                    continue
+                self.assertEqual(earliest[node], driver.time + min(
+                    sum(2 * min_traffics[driver][e] + 1 for e in zip(path, path[1:])) for path in paths))
+                self.assertEqual(latest[node], driver.time + max(
+                    sum(2 * max_traffics[driver][e] + 1 for e in zip(path, path[1:])) for path in paths))
+
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: x + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: x + 1)
+        graph.add_edge(2, 1, congestion_func=lambda x: x + 1)
+        graph.add_edge(2, 3, congestion_func=lambda x: x + 1)
+        drivers_graph = DriversGraph()
+        driver = Driver(0, 3, 1)
+        drivers_graph.add_driver(driver)
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=10)
+        traffics = drivers_structure.compute_minimum_traffics()
+        earliest, latest = drivers_structure.compute_reaching_times(driver, traffics, traffics)
+        self.assertEqual(earliest, {0: 1, 1: 2, 2: 3, 3: 4})
+        self.assertEqual(latest, {0: 1, 1: 10, 2: 10, 3: 10})
+
+    def test_parallel_safety_intervals(self):
+        """
+        Computing the drivers' intervals in parallel gives the same intervals as sequentially
+        """
+        graph = generate_grid_data(3, 4)
+        graph.set_global_congestion_function(lambda x: 2 * x + 1)
+        drivers_graph = generate_random_drivers(graph, 8)
+        intervals = []
+        for processes in (1, 2):
+            drivers_structure = DriversStructure(graph, drivers_graph, horizon=40)
+            drivers_structure.compute_optimal_safety_intervals(processes=processes)
+            intervals.append([
+                (drivers_structure.get_safety_interval(driver, edge),
+                 drivers_structure.get_presence_interval(driver, edge))
+                for driver in drivers_graph.get_all_drivers() for edge in graph.edges_iter()
+            ])
+        self.assertEqual(intervals[0], intervals[1])
+
+    def test_drivers_interactions(self):
+        graph = GPSGraph()
+        graph.add_edge(0, 1, congestion_func=lambda x: x + 1)
+        graph.add_edge(1, 2, congestion_func=lambda x: x + 1)
+        drivers_graph = DriversGraph()
+        driver0, driver1, driver2, driver3 = Driver(0, 2, 0), Driver(0, 2, 2), Driver(0, 2, 5), Driver(1, 2, 0)
+        for driver in (driver0, driver1, driver2, driver3):
+            drivers_graph.add_driver(driver)
+        drivers_structure = DriversStructure(graph, drivers_graph, horizon=10)
+        drivers_structure.add_safety_interval(driver0, (0, 1), 0, 2)
+        drivers_structure.add_safety_interval(driver1, (0, 1), 2, 4)
+        drivers_structure.add_safety_interval(driver2, (0, 1), 5, 6)
+        drivers_structure.set_unreachable_edge_to_driver(driver3, (0, 1))
+        for driver, start in ((driver0, 1), (driver1, 3), (driver2, 6), (driver3, 8)):
+            drivers_structure.add_safety_interval(driver, (1, 2), start, start + 1)
+
+        # driver0 and driver1 are both on (0, 1) at time 2
+        self.assertEqual(drivers_structure.compute_drivers_interactions(), 1)
+        self.assertEqual(drivers_graph[driver0][driver1]['edges'], {(0, 1)})
+        self.assertEqual(drivers_graph.number_of_edges(), 1)
+        components = drivers_graph.get_independent_drivers()
+        self.assertEqual(sorted(map(len, components)), [1, 1, 2])
+        self.assertEqual(set(components[0]), {driver0, driver1})
+        self.assertEqual(drivers_graph.get_sub_drivers_graph(components[0]).number_of_edges(), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
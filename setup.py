@@ -22,8 +22,13 @@ setup(
         'requests==2.12.3',
         'osmapi==0.8.1',
         'sortedcontainers==1.5.7',
+        'numpy==1.13.3',
         'mock==2.0.0',
         'pytest==3.1.2'
     ],
+    extras_require={
+        # sparse matrices of TEGModel(matrix=True) and of the highs backend
+        'sparse': ['scipy==1.2.3']
+    },
     zip_safe=False
 )